@@ -0,0 +1,276 @@
+"""
+Post-hoc classification of the answers of a sweep.
+
+Streams every `out_*.json` file under the config directory, runs the classifiers of
+`experiments.loggers.classifiers` (`ZeroShot`, `RegexClassifier`) over the chat answers and the survey
+answers in a process pool, and writes one row per answer, with the labels, to a columnar file (Parquet,
+or CSV when pyarrow isn't installed).
+
+The results are cached by classifier and text hash in a SQLite file, so a rerun after more runs of the
+sweep finished only classifies the texts it hasn't seen. The texts are sorted by length before being cut
+into batches, which keeps the padding of the model batches low.
+
+Usage (from the repository root):
+    python -m analyze.classify_outputs --zero-shot-labels agree disagree neutral --regex "\\d+"
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from analyze.sanity_check_preprocess import resolve_config_dir
+
+# (name of the classifier in `get_known_classifier`, its keyword arguments)
+ClassifierSpec = Tuple[str, Dict[str, object]]
+
+_worker_classifiers: list = []
+# settings of the classifiers which don't change their results, left out of the cache key
+EXECUTION_SETTINGS = ("batch_size",)
+# classifiers holding a model (bart-large-mnli takes about 1.6 GB), each worker process loads its own copy
+MODEL_CLASSIFIERS = ("ZeroShot",)
+MODEL_WORKERS = 2
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def spec_key(spec: ClassifierSpec) -> str:
+    """Identifies a classifier and the settings its results depend on in the cache."""
+
+    name, kwargs = spec
+    settings = {key: value for key, value in kwargs.items() if key not in EXECUTION_SETTINGS}
+    return hashlib.sha256(json.dumps((name, settings), sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+def default_workers(specs: List[ClassifierSpec]) -> int:
+    """A process per CPU, but only a few when a classifier loads a model in every process."""
+
+    workers = os.cpu_count() or 1
+    if any(name in MODEL_CLASSIFIERS for name, _ in specs):
+        workers = min(workers, MODEL_WORKERS)
+    return workers
+
+
+def column_prefixes(specs: List[ClassifierSpec]) -> List[str]:
+    """The prefix of the label columns of each classifier, its name (numbered if several share it)."""
+
+    names = [name for name, _ in specs]
+    return [name if names.count(name) == 1 else f"{name}{names[:index].count(name)}"
+            for index, name in enumerate(names)]
+
+
+def iter_answers(config_root: Path, model_prefix: str) -> Iterator[Dict[str, object]]:
+    """Yield one row per chat answer and survey answer of the output files, with the answer text."""
+
+    for json_path in sorted(config_root.rglob("out_*.json")):
+        if model_prefix and not json_path.name.startswith(model_prefix):
+            continue
+        try:
+            with json_path.open("r", encoding="utf-8") as fh:
+                payload = json.load(fh)
+        except json.JSONDecodeError as exc:
+            print(f"Skipping {json_path}: invalid JSON ({exc})")
+            continue
+        source_file = str(json_path.relative_to(config_root))
+
+        for iteration, chat_entry in enumerate(payload.get("chat_entry") or []):
+            yield _answer_row(source_file, "chat", iteration, None, chat_entry)
+        for question in payload.get("survey_question") or []:
+            yield _answer_row(source_file, "survey", question.get("iteration"), question.get("question_id"),
+                              question.get("chat_entry") or {})
+
+
+def _answer_row(source_file: str, kind: str, iteration: Optional[int], question_id: Optional[str],
+                chat_entry: Dict[str, object]) -> Dict[str, object]:
+    entity = chat_entry.get("entity")
+    return {
+        "source_file": source_file,
+        "kind": kind,
+        "iteration": iteration,
+        "question_id": question_id,
+        "person": entity.get("name") if isinstance(entity, dict) else entity,
+        "text": chat_entry.get("answer") or "",
+    }
+
+
+class ClassificationCache:
+    """SQLite store of the classification results, keyed by classifier and text hash."""
+
+    def __init__(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._connection = sqlite3.connect(path)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "classifier TEXT NOT NULL, text_hash TEXT NOT NULL, result TEXT NOT NULL, "
+            "PRIMARY KEY (classifier, text_hash))"
+        )
+
+    def get_many(self, classifier: str, hashes: List[str]) -> Dict[str, Optional[dict]]:
+        found = {}
+        # bounded by the maximum number of SQLite variables
+        for start in range(0, len(hashes), 500):
+            chunk = hashes[start:start + 500]
+            rows = self._connection.execute(
+                f"SELECT text_hash, result FROM results WHERE classifier = ? "
+                f"AND text_hash IN ({','.join('?' * len(chunk))})", [classifier, *chunk])
+            found.update((digest, json.loads(result)) for digest, result in rows)
+        return found
+
+    def put_many(self, classifier: str, results: Dict[str, Optional[dict]]):
+        with self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO results (classifier, text_hash, result) VALUES (?, ?, ?)",
+                [(classifier, digest, json.dumps(result, ensure_ascii=False)) for digest, result in results.items()])
+
+    def close(self):
+        self._connection.close()
+
+
+def _init_worker(specs: List[ClassifierSpec]) -> None:
+    """Loads the classifiers once per worker process (the zero-shot model is large)."""
+
+    from experiments.loggers.classifiers import get_known_classifier
+
+    global _worker_classifiers
+    _worker_classifiers = [get_known_classifier(name)(**kwargs) for name, kwargs in specs]
+
+
+def _classify_batch(index: int, texts: List[str]) -> List[Optional[dict]]:
+    return _worker_classifiers[index].classify_batch(texts)
+
+
+def length_bucketed_batches(texts: Dict[str, str], batch_size: int) -> List[List[str]]:
+    """Cuts the text hashes into batches of texts of similar length."""
+
+    ordered = sorted(texts, key=lambda digest: len(texts[digest]))
+    return [ordered[start:start + batch_size] for start in range(0, len(ordered), batch_size)]
+
+
+def classify_texts(texts: Dict[str, str], specs: List[ClassifierSpec], cache: ClassificationCache,
+                   batch_size: int, workers: int) -> List[Dict[str, Optional[dict]]]:
+    """Returns, for each classifier, the result of every text hash of `texts`, classifying only the uncached ones."""
+
+    results = [cache.get_many(spec_key(spec), list(texts)) for spec in specs]
+    missing = [{digest: text for digest, text in texts.items() if digest not in found} for found in results]
+    print(f"Classifying {sum(len(m) for m in missing)} new texts "
+          f"({sum(len(found) for found in results)} cached results)")
+    if not any(missing):
+        return results
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(specs,)) as executor:
+        futures = []
+        for index, texts_to_classify in enumerate(missing):
+            for batch in length_bucketed_batches(texts_to_classify, batch_size):
+                futures.append((index, batch, executor.submit(
+                    _classify_batch, index, [texts_to_classify[digest] for digest in batch])))
+        for index, batch, future in futures:
+            batch_results = dict(zip(batch, future.result()))
+            # stored batch by batch, an interrupted run keeps what was classified
+            cache.put_many(spec_key(specs[index]), batch_results)
+            results[index].update(batch_results)
+    return results
+
+
+def label_columns(prefix: str, result: Optional[dict]) -> Dict[str, object]:
+    if not result:
+        return {}
+    # the classifiers echo the classified text, it is already joined through the row
+    return {f"{prefix}.{key}": value for key, value in result.items() if key != "classify"}
+
+
+def write_table(rows: List[Dict[str, object]], output_path: Path) -> Path:
+    """Writes the rows as Parquet (CSV when pyarrow isn't installed), returns the written path."""
+
+    import pandas as pd
+
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    df = pd.DataFrame(rows)
+    for column in ("source_file", "kind", "question_id", "person"):
+        df[column] = df[column].astype("category")
+    if output_path.suffix == ".parquet":
+        try:
+            df.to_parquet(output_path, index=False)
+            return output_path
+        except ImportError:
+            warnings.warn("pyarrow is not installed, writing the labels as CSV instead of Parquet")
+            output_path = output_path.with_suffix(".csv")
+    df.to_csv(output_path, index=False)
+    return output_path
+
+
+def classify_outputs(config_root: Path, output_path: Path, specs: List[ClassifierSpec], cache_path: Path,
+                     model_prefix: str = "out_", batch_size: int = 64, workers: Optional[int] = None) -> Path:
+    """
+    Run the classification of every answer of the sweep and write the labels table.
+    :param workers: processes classifying the texts, see `default_workers` by default
+    """
+
+    rows = []
+    texts: Dict[str, str] = {}
+    for row in iter_answers(config_root, model_prefix):
+        text = row.pop("text")
+        row["text_hash"] = digest = text_hash(text)
+        if text:
+            texts[digest] = text
+        rows.append(row)
+    print(f"Read {len(rows)} answers ({len(texts)} distinct texts)")
+
+    cache = ClassificationCache(cache_path)
+    try:
+        results = classify_texts(texts, specs, cache, batch_size, workers or default_workers(specs))
+    finally:
+        cache.close()
+
+    for row in rows:
+        for prefix, spec_results in zip(column_prefixes(specs), results):
+            row.update(label_columns(prefix, spec_results.get(row["text_hash"])))
+    return write_table(rows, output_path)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Classify the answers of the sweep outputs.")
+    parser.add_argument("--config-dir", type=str, default=None,
+                        help="Path to the config directory (defaults to ../config relative to this script).")
+    parser.add_argument("--model-prefix", type=str, default="out_",
+                        help="Only the output files starting with this prefix are read (e.g. out_41-mini).")
+    parser.add_argument("--zero-shot-labels", nargs="+", default=None,
+                        help="Labels of the zero-shot classifier, it isn't run when not given.")
+    parser.add_argument("--zero-shot-model", type=str, default="facebook/bart-large-mnli")
+    parser.add_argument("--regex", action="append", default=[],
+                        help="Pattern of a regex classifier, can be given several times.")
+    parser.add_argument("--batch-size", type=int, default=64, help="Texts sent to a worker at once.")
+    parser.add_argument("--workers", type=int, default=None,
+                        help=f"Worker processes, defaults to one per CPU ({MODEL_WORKERS} at most with the "
+                             f"zero-shot classifier, each worker loads its own copy of the model).")
+    parser.add_argument("--cache", type=str, default=str(Path(__file__).with_name("classification_cache.sqlite")))
+    parser.add_argument("--output", type=str, default=str(Path(__file__).with_name("classifications.parquet")))
+    args = parser.parse_args()
+
+    specs: List[ClassifierSpec] = []
+    if args.zero_shot_labels:
+        specs.append(("ZeroShot", {"model": args.zero_shot_model, "labels": args.zero_shot_labels,
+                                   "batch_size": args.batch_size}))
+    specs.extend(("Regex", {"regex": pattern}) for pattern in args.regex)
+    if not specs:
+        parser.error("no classifier given (--zero-shot-labels and/or --regex)")
+
+    config_root = resolve_config_dir(args.config_dir)
+    print(f"Scanning config directory: {config_root}")
+    written = classify_outputs(config_root, Path(args.output).expanduser().resolve(), specs,
+                               Path(args.cache).expanduser().resolve(), args.model_prefix, args.batch_size,
+                               args.workers)
+    print(f"Done. Wrote the labels to {written}")
+
+
+if __name__ == "__main__":  # pragma: no cover
+    main()
@@ -0,0 +1,214 @@
+"""
+Converts the output files of a sweep into a partitioned Parquet dataset.
+
+The sweep tree `config/question_<q>/<party pair>/out_<model>_<prompt version>_<repetition>.json` becomes
+two tables, partitioned (hive style) by question, party pair, model, prompt version and repetition:
+    - `chat_turns`: one row per turn of the conversations,
+    - `survey_answers`: one row per answer to a survey question.
+The text columns that repeat (persons, question ids, ...) are dictionary encoded, so the notebooks can
+load only the columns and partitions they need, e.g.
+
+    load_table("analyze/dataset", "survey_answers", columns=["person", "iteration", "answer"],
+               filters=[("question", "=", 0), ("model", "=", "41-mini")])
+
+Usage (from the repository root, requires pyarrow):
+    python -m analyze.ingest_outputs --output analyze/dataset
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import shutil
+import warnings
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from analyze.sanity_check_preprocess import resolve_config_dir
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+except ImportError:
+    warnings.warn("pyarrow not installed, the sweep outputs can't be converted to Parquet")
+
+PARTITION_COLUMNS = ["question", "party_pair", "model", "prompt_version", "repetition"]
+TABLES = ("chat_turns", "survey_answers")
+# repeated text columns, stored once per row group and loaded as categoricals
+DICTIONARY_COLUMNS = {
+    "chat_turns": ["source_file", "person"],
+    "survey_answers": ["source_file", "person", "question_id", "question_content"],
+}
+# the columns of each table (the partition columns first), by arrow type name
+COLUMNS = {
+    "chat_turns": [("source_file", "string"), ("turn", "int64"), ("person", "string"), ("answer", "string"),
+                   ("time", "string")],
+    "survey_answers": [("source_file", "string"), ("iteration", "int64"), ("question_id", "string"),
+                       ("question_content", "string"), ("person", "string"), ("answer", "string")],
+}
+
+
+def parse_run_path(relative_path: Path) -> Optional[Dict[str, object]]:
+    """The partition values of an output file path relative to the config directory, None if it doesn't match."""
+
+    if len(relative_path.parts) != 3 or not relative_path.parts[0].startswith("question_"):
+        return None
+    question_dir, party_pair, _ = relative_path.parts
+    # the model name can contain underscores, the prompt version and repetition can't
+    parts = relative_path.stem.removeprefix("out_").rsplit("_", 2)
+    if len(parts) != 3 or not parts[2].isdigit() or not question_dir.removeprefix("question_").isdigit():
+        return None
+    model, prompt_version, repetition = parts
+    return {
+        "question": int(question_dir.removeprefix("question_")),
+        "party_pair": party_pair,
+        "model": model,
+        "prompt_version": prompt_version,
+        "repetition": int(repetition),
+    }
+
+
+def _person(chat_entry: Dict[str, object]) -> Optional[str]:
+    entity = chat_entry.get("entity")
+    return entity.get("name") if isinstance(entity, dict) else entity
+
+
+def run_rows(payload: Dict[str, object], partition: Dict[str, object],
+             source_file: str) -> Tuple[List[dict], List[dict]]:
+    """The rows of the chat turns and of the survey answers of one output file."""
+
+    chat_rows = [
+        {**partition, "source_file": source_file, "turn": turn, "person": _person(chat_entry),
+         "answer": chat_entry.get("answer"), "time": chat_entry.get("time")}
+        for turn, chat_entry in enumerate(payload.get("chat_entry") or [])
+    ]
+    survey_rows = []
+    for question in payload.get("survey_question") or []:
+        chat_entry = question.get("chat_entry") or {}
+        survey_rows.append({
+            **partition, "source_file": source_file, "iteration": question.get("iteration"),
+            # the ids can be numbers in the configurations, the column holds strings
+            "question_id": None if question.get("question_id") is None else str(question["question_id"]),
+            "question_content": question.get("question_content"),
+            "person": _person(chat_entry), "answer": chat_entry.get("answer"),
+        })
+    return chat_rows, survey_rows
+
+
+def iter_runs(config_root: Path, model_prefix: str = "out_") -> Iterator[Tuple[Path, Dict[str, object]]]:
+    """Yield the output files of the sweep with their partition values."""
+
+    for json_path in sorted(config_root.rglob("out_*.json")):
+        if model_prefix and not json_path.name.startswith(model_prefix):
+            continue
+        partition = parse_run_path(json_path.relative_to(config_root))
+        if partition is None:
+            print(f"Skipping {json_path}: not in the question_<q>/<party pair>/out_<model>_<version>_<rep> layout")
+            continue
+        yield json_path, partition
+
+
+def _partition_type(column: str) -> pa.DataType:
+    return pa.int64() if column in ("question", "repetition") else pa.string()
+
+
+def table_schema(name: str) -> pa.Schema:
+    """
+    The schema of a table. It is the same for every part, otherwise the types of a part would be inferred from its
+    rows (e.g. a null column when all its answers are None) and the parts couldn't be read together.
+    """
+    fields = [pa.field(column, _partition_type(column)) for column in PARTITION_COLUMNS]
+    for column, type_name in COLUMNS[name]:
+        data_type = getattr(pa, type_name)()
+        if column in DICTIONARY_COLUMNS[name]:
+            data_type = pa.dictionary(pa.int32(), data_type)
+        fields.append(pa.field(column, data_type))
+    return pa.schema(fields)
+
+
+def to_arrow(rows: List[dict], name: str) -> pa.Table:
+    return pa.Table.from_pylist(rows, schema=table_schema(name))
+
+
+def write_rows(dataset_root: Path, rows: Dict[str, List[dict]], part: int):
+    """Appends the rows of each table to the dataset, as new files of their partitions."""
+
+    partitioning = ds.partitioning(
+        pa.schema([(column, _partition_type(column)) for column in PARTITION_COLUMNS]), flavor="hive")
+    for name in TABLES:
+        if not rows[name]:
+            continue
+        ds.write_dataset(to_arrow(rows[name], name), dataset_root / name, schema=table_schema(name),
+                         format="parquet", partitioning=partitioning, basename_template=f"part-{part}-{{i}}.parquet",
+                         existing_data_behavior="overwrite_or_ignore")
+
+
+def ingest(config_root: Path, dataset_root: Path, model_prefix: str = "out_",
+           files_per_part: int = 500) -> Dict[str, int]:
+    """
+    Rebuilds the dataset from every output file of the sweep, returns the row count of each table.
+    The files are read `files_per_part` at a time, so the memory use doesn't grow with the sweep.
+    """
+
+    if "pa" not in globals():
+        raise ImportError("pyarrow is required to write the dataset (pip install pyarrow)")
+    for name in TABLES:
+        shutil.rmtree(dataset_root / name, ignore_errors=True)
+
+    counts = {name: 0 for name in TABLES}
+    rows: Dict[str, List[dict]] = {name: [] for name in TABLES}
+    part = files = 0
+    for json_path, partition in iter_runs(config_root, model_prefix):
+        try:
+            with json_path.open("r", encoding="utf-8") as fh:
+                payload = json.load(fh)
+        except json.JSONDecodeError as exc:
+            print(f"Skipping {json_path}: invalid JSON ({exc})")
+            continue
+        chat_rows, survey_rows = run_rows(payload, partition, str(json_path.relative_to(config_root)))
+        rows["chat_turns"].extend(chat_rows)
+        rows["survey_answers"].extend(survey_rows)
+        files += 1
+        if files % files_per_part == 0:
+            write_rows(dataset_root, rows, part)
+            part += 1
+            for name in TABLES:
+                counts[name] += len(rows[name])
+                rows[name] = []
+    write_rows(dataset_root, rows, part)
+    for name in TABLES:
+        counts[name] += len(rows[name])
+    return counts
+
+
+def load_table(dataset_root, table: str, columns: Optional[List[str]] = None, filters=None):
+    """
+    Loads a table of the dataset as a DataFrame, reading only the given columns and the partitions
+    matching `filters` (pyarrow filter tuples, e.g. [("question", "=", 0)]).
+    """
+
+    import pandas as pd
+
+    return pd.read_parquet(Path(dataset_root) / table, columns=columns, filters=filters)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Convert the sweep outputs into a partitioned Parquet dataset.")
+    parser.add_argument("--config-dir", type=str, default=None,
+                        help="Path to the config directory (defaults to ../config relative to this script).")
+    parser.add_argument("--model-prefix", type=str, default="out_",
+                        help="Only the output files starting with this prefix are read (e.g. out_41-mini).")
+    parser.add_argument("--output", type=str, default=str(Path(__file__).with_name("dataset")),
+                        help="Directory of the dataset, its tables are rebuilt.")
+    args = parser.parse_args()
+
+    config_root = resolve_config_dir(args.config_dir)
+    dataset_root = Path(args.output).expanduser().resolve()
+    print(f"Scanning config directory: {config_root}")
+    counts = ingest(config_root, dataset_root, args.model_prefix)
+    print(f"Done. Wrote {counts['chat_turns']} chat turns and {counts['survey_answers']} survey answers "
+          f"to {dataset_root}")
+
+
+if __name__ == "__main__":  # pragma: no cover
+    main()
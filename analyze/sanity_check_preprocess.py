@@ -1,9 +1,14 @@
 from __future__ import annotations
 
 import argparse
+import hashlib
 import json
+import os
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 from pathlib import Path
-from typing import Dict, Iterator, List, Optional
+from typing import Dict, Iterator, List, Optional, Set, Tuple
 
 
 def resolve_config_dir(explicit_path: Optional[str] = None) -> Path:
@@ -28,67 +33,250 @@ def resolve_config_dir(explicit_path: Optional[str] = None) -> Path:
     )
 
 
-def iter_survey_entries(config_root: Path, model_prefix: str) -> Iterator[Dict[str, object]]:
-    """Yield flattened survey question entries for the chosen model prefix."""
+def materialize_prompt(prompt: object, prompt_nodes: Dict[str, Dict[str, object]]) -> object:
+    """Resolve a prompt written in the compact form ({"head": ..., "node": ...}) to its message list."""
 
-    for json_path in sorted(config_root.rglob("*.json")):
-        if model_prefix and not json_path.name.startswith(model_prefix):
-            continue
+    if not (isinstance(prompt, dict) and "head" in prompt and "node" in prompt):
+        return prompt
 
-        try:
-            with json_path.open("r", encoding="utf-8") as fh:
-                payload = json.load(fh)
-        except json.JSONDecodeError as exc:
-            print(f"Skipping {json_path}: invalid JSON ({exc})")
-            continue
+    deltas = []
+    node_id = prompt["node"]
+    while node_id is not None:
+        node = prompt_nodes[node_id]
+        deltas.append(node["messages"])
+        node_id = node["parent"]
 
-        survey_questions: List[Dict[str, object]] = payload.get("survey_question") or []
-        if not survey_questions:
-            continue
+    messages = list(prompt["head"])
+    for delta in reversed(deltas):
+        messages.extend(delta)
+    return messages
+
+
+def survey_entries(json_path: Path, config_root: Path, model_prefix: str) -> List[Dict[str, object]]:
+    """Flattened survey question entries of a single output file."""
 
-        relative_path = json_path.relative_to(config_root)
+    try:
+        with json_path.open("r", encoding="utf-8") as fh:
+            payload = json.load(fh)
+    except json.JSONDecodeError as exc:
+        print(f"Skipping {json_path}: invalid JSON ({exc})")
+        return []
 
-        for question in survey_questions:
-            chat_entry = question.get("chat_entry", {}) if isinstance(question, dict) else {}
-            prompt_messages = chat_entry.get("prompt", []) if isinstance(chat_entry, dict) else []
-            entity = chat_entry.get("entity") if isinstance(chat_entry, dict) else None
-            answer = chat_entry.get("answer", "") if isinstance(chat_entry, dict) else ""
+    survey_questions: List[Dict[str, object]] = payload.get("survey_question") or []
+    if not survey_questions:
+        return []
 
-            record: Dict[str, object] = {
-                "source_file": str(relative_path),
-                "model_prefix": model_prefix,
-                "question_id": question.get("question_id"),
-                "question_content": question.get("question_content"),
-                "iteration": question.get("iteration"),
-                "prompt_messages": prompt_messages,
-                "entity": entity,
-                "model_answer": answer,
-            }
+    relative_path = json_path.relative_to(config_root)
+    prompt_nodes = payload.get("prompt_nodes") or {}
 
-            # Attempt to capture prompt version info from filename, e.g. out_41-mini_v1_3.json
-            parts = json_path.stem.split("_v", maxsplit=1)
-            if len(parts) == 2:
-                record["file_suffix"] = parts[1]
+    records = []
+    for question in survey_questions:
+        chat_entry = question.get("chat_entry", {}) if isinstance(question, dict) else {}
+        prompt_messages = chat_entry.get("prompt", []) if isinstance(chat_entry, dict) else []
+        prompt_messages = materialize_prompt(prompt_messages, prompt_nodes)
+        entity = chat_entry.get("entity") if isinstance(chat_entry, dict) else None
+        answer = chat_entry.get("answer", "") if isinstance(chat_entry, dict) else ""
 
-            yield record
+        record: Dict[str, object] = {
+            "source_file": str(relative_path),
+            "model_prefix": model_prefix,
+            "question_id": question.get("question_id"),
+            "question_content": question.get("question_content"),
+            "iteration": question.get("iteration"),
+            "prompt_messages": prompt_messages,
+            "entity": entity,
+            "model_answer": answer,
+        }
 
+        # Attempt to capture prompt version info from filename, e.g. out_41-mini_v1_3.json
+        parts = json_path.stem.split("_v", maxsplit=1)
+        if len(parts) == 2:
+            record["file_suffix"] = parts[1]
 
-def preprocess(config_root: Path, output_path: Path, model_prefix: str, overwrite: bool) -> int:
-    """Run the preprocessing step and write JSON Lines output."""
+        records.append(record)
+    return records
 
-    if output_path.exists() and not overwrite:
+
+def iter_input_files(config_root: Path, model_prefix: str) -> Iterator[Path]:
+    for json_path in sorted(config_root.rglob("*.json")):
+        if model_prefix and not json_path.name.startswith(model_prefix):
+            continue
+        yield json_path
+
+
+def iter_survey_entries(config_root: Path, model_prefix: str) -> Iterator[Dict[str, object]]:
+    """Yield flattened survey question entries for the chosen model prefix."""
+
+    for json_path in iter_input_files(config_root, model_prefix):
+        yield from survey_entries(json_path, config_root, model_prefix)
+
+
+def file_digest(path: Path) -> str:
+    digest = hashlib.sha256()
+    with path.open("rb") as fh:
+        for block in iter(lambda: fh.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def manifest_path(output_path: Path) -> Path:
+    """The manifest of the files already processed into `output_path`."""
+
+    return output_path.with_name(output_path.name + ".manifest.json")
+
+
+def load_manifest(output_path: Path) -> Optional[Dict[str, object]]:
+    path = manifest_path(output_path)
+    if not path.exists():
+        return None
+    with path.open("r", encoding="utf-8") as fh:
+        manifest = json.load(fh)
+    if "files" not in manifest:
+        # written before the size of the output was recorded
+        manifest = {"files": manifest, "output_size": None}
+    return manifest
+
+
+def write_manifest(output_path: Path, manifest: Dict[str, object]) -> None:
+    tmp_manifest = manifest_path(output_path).with_suffix(".tmp")
+    with tmp_manifest.open("w", encoding="utf-8") as fh:
+        json.dump(manifest, fh)
+        fh.flush()
+        os.fsync(fh.fileno())
+    os.replace(tmp_manifest, manifest_path(output_path))
+
+
+def recover_output(output_path: Path, manifest: Dict[str, object]) -> bool:
+    """
+    Brings the output back to the state recorded by the manifest after an interrupted run: finishes the
+    pending rewrite, or truncates the records appended after the manifest was last written (their files
+    are not in the manifest, they are parsed again). Returns False when the output must be rebuilt.
+    """
+
+    pending = manifest.get("pending")
+    if pending and output_path.with_name(pending).exists():
+        os.replace(output_path.with_name(pending), output_path)
+    for stray in output_path.parent.glob(output_path.name + ".*.tmp"):
+        stray.unlink()
+
+    if not output_path.exists():
+        return False
+    size = manifest.get("output_size")
+    if size is None:
+        return True
+    actual = output_path.stat().st_size
+    if actual < size:
+        return False
+    if actual > size:
+        with output_path.open("r+b") as fh:
+            fh.truncate(size)
+    return True
+
+
+def scan_changes(config_root: Path, model_prefix: str, manifest: Dict[str, Dict[str, object]]) \
+        -> Tuple[List[Path], Set[str], Dict[str, Dict[str, object]]]:
+    """
+    Compares the input files with the manifest.
+    Returns the files to (re)parse, the relative paths whose records must be dropped from the output
+    (changed or deleted files) and the new manifest. A file is only hashed when its size or mtime changed.
+    """
+
+    to_parse: List[Path] = []
+    stale: Set[str] = set()
+    new_manifest: Dict[str, Dict[str, object]] = {}
+    for json_path in iter_input_files(config_root, model_prefix):
+        relative = str(json_path.relative_to(config_root))
+        stat = json_path.stat()
+        entry = {"size": stat.st_size, "mtime": stat.st_mtime_ns}
+        known = manifest.get(relative)
+        if known and known["size"] == entry["size"] and known["mtime"] == entry["mtime"]:
+            new_manifest[relative] = known
+            continue
+        entry["sha256"] = file_digest(json_path)
+        new_manifest[relative] = entry
+        if known:
+            if known["sha256"] == entry["sha256"]:
+                # touched but identical
+                continue
+            stale.add(relative)
+        to_parse.append(json_path)
+    # deleted files
+    stale.update(relative for relative in manifest if relative not in new_manifest)
+    return to_parse, stale, new_manifest
+
+
+def _parse_lines(json_path: Path, config_root: Path, model_prefix: str) -> List[str]:
+    return [json.dumps(record, ensure_ascii=False) + "\n"
+            for record in survey_entries(json_path, config_root, model_prefix)]
+
+
+def parse_files(paths: List[Path], config_root: Path, model_prefix: str, workers: int) -> Iterator[List[str]]:
+    """Yield the output lines of each file (in order), parsed by a process pool."""
+
+    if workers <= 1 or len(paths) <= 1:
+        for json_path in paths:
+            yield _parse_lines(json_path, config_root, model_prefix)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        yield from executor.map(_parse_lines, paths, repeat(config_root), repeat(model_prefix),
+                                chunksize=max(1, len(paths) // (workers * 8)))
+
+
+def preprocess(config_root: Path, output_path: Path, model_prefix: str, overwrite: bool,
+               workers: int = os.cpu_count() or 1) -> int:
+    """
+    Run the preprocessing step and write JSON Lines output.
+
+    The processed files are recorded in a manifest next to the output (path, size, mtime, content hash),
+    with the size of the output. When it exists, only the new and changed files are parsed: the records of
+    new files are appended in place, the output is only rewritten when the records of changed or deleted
+    files must be dropped. `overwrite` rebuilds everything.
+    Returns the number of records written by this run.
+    """
+
+    manifest = None if overwrite else load_manifest(output_path)
+    if output_path.exists() and manifest is None and not overwrite:
         raise FileExistsError(
             f"Output file already exists: {output_path}. Use --overwrite to replace it."
         )
+    if manifest is not None and not recover_output(output_path, manifest):
+        print(f"{output_path} doesn't match its manifest, rebuilding it")
+        manifest = None
 
     output_path.parent.mkdir(parents=True, exist_ok=True)
+    to_parse, stale, files = scan_changes(config_root, model_prefix, manifest["files"] if manifest else {})
+    print(f"{len(to_parse)} new or changed files, {len(files) - len(to_parse)} unchanged")
 
     count = 0
-    with output_path.open("w", encoding="utf-8") as out_f:
-        for record in iter_survey_entries(config_root, model_prefix):
-            out_f.write(json.dumps(record, ensure_ascii=False))
-            out_f.write("\n")
-            count += 1
+    if manifest is not None and not stale:
+        # only new files, their records are appended in place
+        with output_path.open("a", encoding="utf-8") as out_f:
+            for lines in parse_files(to_parse, config_root, model_prefix, workers):
+                out_f.writelines(lines)
+                count += len(lines)
+            out_f.flush()
+            os.fsync(out_f.fileno())
+        write_manifest(output_path, {"files": files, "output_size": output_path.stat().st_size})
+        return count
+
+    # the records of the changed and deleted files are dropped by rewriting the output
+    pending = f"{output_path.name}.{uuid.uuid4().hex[:8]}.tmp"
+    tmp_path = output_path.with_name(pending)
+    with tmp_path.open("w", encoding="utf-8") as out_f:
+        if manifest is not None:
+            # keep the records of the unchanged files
+            with output_path.open("r", encoding="utf-8") as in_f:
+                for line in in_f:
+                    if json.loads(line)["source_file"] not in stale:
+                        out_f.write(line)
+        for lines in parse_files(to_parse, config_root, model_prefix, workers):
+            out_f.writelines(lines)
+            count += len(lines)
+        out_f.flush()
+        os.fsync(out_f.fileno())
+    # the manifest goes first, an interrupted replace is finished by the next run (see `recover_output`)
+    write_manifest(output_path, {"files": files, "output_size": tmp_path.stat().st_size, "pending": pending})
+    os.replace(tmp_path, output_path)
 
     return count
 
@@ -120,6 +308,12 @@ def main() -> None:
         action="store_true",
         help="Replace the output file if it already exists.",
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Processes parsing the output files.",
+    )
 
     args = parser.parse_args()
 
@@ -129,9 +323,9 @@ def main() -> None:
     print(f"Scanning config directory: {config_root}")
     print(f"Writing merged dataset to: {output_path}")
 
-    total = preprocess(config_root, output_path, args.model_prefix, args.overwrite)
+    total = preprocess(config_root, output_path, args.model_prefix, args.overwrite, args.workers)
 
-    print(f"Done. Collected {total} survey entries.")
+    print(f"Done. Collected {total} new survey entries.")
 
 
 if __name__ == "__main__":  # pragma: no cover
@@ -0,0 +1,67 @@
+"""
+Throughput benchmark of the batch persons against the local mock of an OpenAI compatible server.
+
+The mock server (see `benchmarks.mock_server`) answering every request after `--latency` seconds is
+started in the process, then a few turns are generated for `batch_count` rooms with `AutoBatchPerson`
+(one `PersonVLLM` per room, called one after the other) and with `BatchedPersonVLLM` (shared client,
+concurrent calls).
+The answers per second are reported for each batch count. No model is needed.
+
+Usage (from the repository root):
+    python -m benchmarks.batch_throughput --batch-counts 1 2 4 8 16 32 --latency 0.05
+"""
+
+from __future__ import annotations
+
+import argparse
+import time
+from typing import List
+
+from benchmarks.mock_server import MockSettings, start_server
+from persons.batch.batched_person_vllm import BatchedPersonVLLM
+from persons.batch.batcher import AutoBatchPerson
+from persons.person_vllm import PersonVLLM
+from session_rooms.ChatEntry import ChatEntry
+
+
+def measure(batch_person, batch_count: int, turns: int) -> float:
+    """Returns the answers per second of `batch_person` over `turns` turns of `batch_count` rooms."""
+    scenario = "You discuss the statement: a general speed limit should apply on all motorways."
+    rooms: List[List[ChatEntry]] = [[] for _ in range(batch_count)]
+    start = time.perf_counter()
+    for _ in range(turns):
+        for room, entry in zip(rooms, batch_person.generate_answer(scenario, rooms, "v1")):
+            room.append(entry)
+    return batch_count * turns / (time.perf_counter() - start)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the throughput of the batch persons.")
+    parser.add_argument("--batch-counts", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--turns", type=int, default=5, help="Turns generated for every batch count.")
+    parser.add_argument("--latency", type=float, default=0.05, help="Latency of the mock server in seconds.")
+    args = parser.parse_args()
+
+    server = start_server(MockSettings(latency=f"fixed:{args.latency}", completion_tokens=2))
+    settings = {
+        "vllm_api_base": server.base_url,
+        "model": "stub",
+        # let the limiter open the window to the whole batch right away
+        "rate_limit": {"initial_concurrency": max(args.batch_counts)},
+    }
+
+    print(f"{'batch_count':>11} | {'AutoBatchPerson':>15} | {'BatchedPersonVLLM':>17} | speedup")
+    for batch_count in args.batch_counts:
+        stories = [f"background {i}" for i in range(batch_count)]
+        names = [f"Person {i}" for i in range(batch_count)]
+        auto = AutoBatchPerson(stories, names, "A", PersonVLLM, **settings)
+        batched = BatchedPersonVLLM(stories, names, "A", **settings)
+        auto_rate = measure(auto, batch_count, args.turns)
+        batched_rate = measure(batched, batch_count, args.turns)
+        print(f"{batch_count:>11} | {auto_rate:>11.1f} a/s | {batched_rate:>13.1f} a/s | "
+              f"{batched_rate / auto_rate:>6.1f}x")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+"""
+Micro-benchmark suite of the CPU hot path of a turn, with `SyntheticPerson`s (no network cost).
+
+For every number of persons of `--persons`, a conversation is grown turn by turn (as `SessionRoom.iterate`
+does) up to the largest of `--turns`. At each of `--turns`, the `--window` following turns are measured
+step by step, in microseconds per call:
+    - `host_selection`: `get_curr_person_and_move_to_next` of the host,
+    - `prompt_build`: `create_prompt` of the person of the turn,
+    - `survey_snapshot`: the `ChatSnapshot` of a survey question and the questionnaire prompt built on it,
+      per person,
+    - `entry_json`: `json.dumps` of the new `ChatEntry` (its `__json__`, through json_fix),
+    - `log_emit`: the `log.info(entry)` call, what the turn pays for the JSON lines log handler,
+    - `log_write`: the serialization and write of a record by the background writer of the handler.
+
+The results can be written as json (`--output`) and compared to a previous run (`--baseline`): the
+command fails when an operation got slower by more than `--tolerance`.
+
+Usage (from the repository root):
+    python -m benchmarks.hot_path --output hot_path.json
+    python -m benchmarks.hot_path --baseline hot_path.json
+    python -m benchmarks.hot_path --turns 10 100 --persons 2 --window 50
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+# `json_fix` enables the __json__ handler for the json module, as in main.py
+import json_fix  # noqa: F401
+
+from experiments.loggers.logger import CsvFileHandler
+from hosts import get_host_class
+from persons.call_stats import CallStats
+from persons.synthetic_person import SyntheticPerson
+from session_rooms.ChatEntry import ChatEntry
+from session_rooms.chat_log import ChatSnapshot
+from session_rooms.session_room import System
+
+OPERATIONS = ("host_selection", "prompt_build", "survey_snapshot", "entry_json", "log_emit", "log_write")
+SCENARIO = "You discuss the statement: a general speed limit should apply on all motorways."
+QUESTION = "How much do you agree with the statement, from 1 to 7?"
+
+
+def _timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def measure(persons_count: int, checkpoints: List[int], window: int, host_name: str, answer_words: int,
+            log_path: str) -> Dict[int, Dict[str, float]]:
+    """Returns the mean time (in microseconds) of every operation at each checkpoint."""
+    persons = [SyntheticPerson(f"background {i}", f"your background {i}", f"Person{i}",
+                               answer_words=answer_words, seed=0)
+               for i in range(persons_count)]
+    host = get_host_class(host_name)(persons, 0)
+    handler = CsvFileHandler(log_path)
+    logger = logging.getLogger("benchmarks.hot_path")
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    logger.addHandler(handler)
+
+    chat_room: List[ChatEntry] = []
+    results: Dict[int, Dict[str, float]] = {}
+    try:
+        for checkpoint in checkpoints:
+            while len(chat_room) < checkpoint:
+                person = host.get_curr_person_and_move_to_next()
+                chat_room.append(person.generate_answer(SCENARIO, chat_room, "v0"))
+
+            totals = dict.fromkeys(OPERATIONS, 0.0)
+            for _ in range(window):
+                person, seconds = _timed(host.get_curr_person_and_move_to_next)
+                totals["host_selection"] += seconds
+                prompt, seconds = _timed(person.create_prompt, SCENARIO, chat_room, "v0")
+                totals["prompt_build"] += seconds
+                stats = CallStats(person.api_base)
+                entry = ChatEntry(entity=person, prompt=prompt, answer=person.evaluate(prompt, stats), stats=stats)
+                chat_room.append(entry)
+
+                start = time.perf_counter()
+                survey_chat = ChatSnapshot(chat_room, overlay=[ChatEntry(System(), "", QUESTION)])
+                for survey_person in persons:
+                    survey_person.create_prompt(SCENARIO, survey_chat, "v0", is_questionnaire=True)
+                totals["survey_snapshot"] += (time.perf_counter() - start) / persons_count
+
+                _, seconds = _timed(json.dumps, entry)
+                totals["entry_json"] += seconds
+                _, seconds = _timed(logger.info, entry)
+                totals["log_emit"] += seconds
+            # the records of the window are queued, waiting for them measures the writer
+            _, seconds = _timed(handler.flush)
+            totals["log_write"] = seconds
+            results[checkpoint] = {operation: round(total / window * 1e6, 2) for operation, total in totals.items()}
+    finally:
+        logger.removeHandler(handler)
+        handler.close()
+    return results
+
+
+def regressions(results: Dict[str, dict], baseline: Dict[str, dict], tolerance: float) -> List[str]:
+    found = []
+    for persons, by_turns in results.items():
+        for turns, timings in by_turns.items():
+            previous = baseline.get(persons, {}).get(turns)
+            if previous is None:
+                continue
+            for operation, value in timings.items():
+                if operation in previous and value > previous[operation] * (1 + tolerance):
+                    found.append(f"{operation} ({persons} persons, {turns} turns): {value} us "
+                                 f"(baseline {previous[operation]} us)")
+    return found
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Micro-benchmark the CPU hot path of a turn.")
+    parser.add_argument("--turns", type=int, nargs="+", default=[10, 100, 1000, 10000],
+                        help="Conversation lengths at which the operations are measured.")
+    parser.add_argument("--persons", type=int, nargs="+", default=[2, 10, 50], help="Persons of the conversation.")
+    parser.add_argument("--window", type=int, default=20, help="Turns measured at each conversation length.")
+    parser.add_argument("--host", default="Round Robin Host", help="Host selecting the persons.")
+    parser.add_argument("--answer-words", type=int, default=30, help="Words of every synthetic answer.")
+    parser.add_argument("--output", type=str, default=None, help="Write the results as json to this path.")
+    parser.add_argument("--baseline", type=str, default=None, help="Results of a previous run to compare with.")
+    parser.add_argument("--tolerance", type=float, default=0.3, help="Allowed relative regression.")
+    args = parser.parse_args()
+
+    checkpoints = sorted(set(args.turns))
+    results: Dict[str, dict] = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for persons_count in args.persons:
+            timings = measure(persons_count, checkpoints, args.window, args.host, args.answer_words,
+                              os.path.join(directory, f"log_{persons_count}.jsonl"))
+            results[str(persons_count)] = {str(turns): timing for turns, timing in timings.items()}
+
+            print(f"{persons_count} persons, microseconds per call")
+            print(f"{'turns':>8} | " + " | ".join(f"{operation:>15}" for operation in OPERATIONS))
+            for turns, timing in timings.items():
+                print(f"{turns:>8} | " + " | ".join(f"{timing[operation]:>15.1f}" for operation in OPERATIONS))
+            print()
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump({"settings": {key: value for key, value in vars(args).items()
+                                    if key not in ("output", "baseline")},
+                       "results": results}, file, indent=4)
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as file:
+            found = regressions(results, json.load(file)["results"], args.tolerance)
+        for regression in found:
+            print(f"Regression: {regression}")
+        if found:
+            sys.exit(1)
+        print(f"No regression against {args.baseline} (tolerance {args.tolerance:.0%})")
+
+
+if __name__ == "__main__":  # pragma: no cover
+    main()
@@ -0,0 +1,176 @@
+"""
+Throughput benchmark of the JSON lines log handler (`CsvFileHandler`, used with `--json`).
+
+The same records are emitted through the current handler (queued, serialized and written in batches
+by a background thread) and through the previous implementation (a one-row pandas DataFrame appended
+with `to_json` on every record). The records/sec are measured from the first `emit` until every record
+is on disk, and the time spent in `emit` (what the logging thread pays) is reported separately.
+
+The written records must keep the schema of the previous implementation: the same log records are also
+handled by both handlers and their lines are compared (the command fails when they differ).
+
+Usage (from the repository root):
+    python -m benchmarks.log_handler --records 5000
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import math
+import os
+import sys
+import tempfile
+import time
+from typing import Any, Callable, List
+
+# `json_fix` enables the __json__ handler for the json module, as in main.py
+import json_fix  # noqa: F401
+
+from experiments.loggers.logger import CsvFileHandler, OurLogger
+from persons.fake_person import FakePerson
+from persons.person_vllm import PersonVLLM
+from session_rooms.ChatEntry import ChatEntry
+
+
+class _PandasHandler(CsvFileHandler):
+    """The previous `emit`: one DataFrame and one `to_json(mode='a')` per record."""
+
+    def emit(self, record):
+        import pandas as pd
+
+        try:
+            log_data = {
+                **record.__dict__,
+                'Level': record.levelname,
+                'Message': record.msg,
+                'Timestamp': record.created,
+            }
+            if hasattr(record, "kwargs"):
+                log_data.update(record.kwargs)
+                if not record.kwargs:
+                    # the module loggers were plain `logging.Logger`s (created before `OurLogger` was set), the
+                    # records logged without `extra` didn't have the field
+                    del log_data['kwargs']
+            df = pd.DataFrame([log_data])
+            df.to_json(self.baseFilename, mode='a', lines=True, orient="records", force_ascii=False)
+        except Exception:
+            self.handleError(record)
+
+
+def _text_records(logger: logging.Logger, count: int):
+    for i in range(count):
+        logger.info("turn %s", i, extra={"person": "Anna", "iteration": i, "tokens": [i, i + 1]})
+
+
+def _chat_entry_records(logger: logging.Logger, count: int):
+    person = PersonVLLM("background A", "your background A", "Anna")
+    prompt = person.create_prompt("You discuss the statement: a general speed limit should apply.", [], "v0")
+    for i in range(count):
+        logger.info(ChatEntry(entity=person, prompt=prompt, answer=f"Anna: answer {i}"))
+
+
+def _records(count: int) -> List[logging.LogRecord]:
+    """Log records of every kind emitted during a run, captured once so that both handlers get the same."""
+    records: List[logging.LogRecord] = []
+
+    class Capture(logging.Handler):
+        def emit(self, record):
+            records.append(record)
+
+    logger = OurLogger("benchmark.records")
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+    logger.addHandler(Capture())
+    _text_records(logger, count)
+    _chat_entry_records(logger, count)
+    fake_person = FakePerson("David", things_to_say=["I am David"])
+    logger.info(fake_person.generate_answer())
+    logger.info("Generating persons with", extra={"kwargs": {"class": "fake_person", "name": "David"}})
+    logger.warning("No SessionRoom using experiment default")
+    return records
+
+
+def _write(handler_cls, records: List[logging.LogRecord]) -> List[dict]:
+    fd, path = tempfile.mkstemp(suffix=".jsonl")
+    os.close(fd)
+    handler = handler_cls(path)
+    try:
+        for record in records:
+            handler.handle(record)
+        handler.close()
+        with open(path, "r", encoding="utf-8") as file:
+            return [json.loads(line) for line in file]
+    finally:
+        os.remove(path)
+
+
+def _differences(expected: Any, found: Any, path: str) -> List[str]:
+    if isinstance(expected, dict) and isinstance(found, dict):
+        if list(expected) != list(found):
+            return [f"{path}: keys {list(found)} instead of {list(expected)}"]
+        return [difference for key in expected
+                for difference in _differences(expected[key], found[key], f"{path}.{key}")]
+    if isinstance(expected, list) and isinstance(found, list) and len(expected) == len(found):
+        return [difference for i, (a, b) in enumerate(zip(expected, found))
+                for difference in _differences(a, b, f"{path}[{i}]")]
+    if isinstance(expected, float) and isinstance(found, (int, float)):
+        # pandas writes the floats with 10 decimals
+        return [] if math.isclose(expected, found, rel_tol=1e-9, abs_tol=1e-9) else [f"{path}: {found} instead of {expected}"]
+    return [] if expected == found else [f"{path}: {str(found)[:80]} instead of {str(expected)[:80]}"]
+
+
+def schema_differences(count: int = 3) -> List[str]:
+    """Compares the lines written by the current handler with those of the pandas one, for the same records."""
+    records = _records(count)
+    expected, found = _write(_PandasHandler, records), _write(CsvFileHandler, records)
+    if len(expected) != len(found):
+        return [f"{len(found)} records written instead of {len(expected)}"]
+    return [difference for i, (a, b) in enumerate(zip(expected, found))
+            for difference in _differences(a, b, f"record {i}")]
+
+
+def measure(handler_cls, emit_records: Callable[[logging.Logger, int], None], count: int) -> tuple[float, float]:
+    """Returns the records/sec until everything is written and the mean time of a log call (microseconds)."""
+    fd, path = tempfile.mkstemp(suffix=".jsonl")
+    os.close(fd)
+    logger = OurLogger(f"benchmark.{handler_cls.__name__}")
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+    handler = handler_cls(path)
+    logger.addHandler(handler)
+    try:
+        start = time.perf_counter()
+        emit_records(logger, count)
+        emitted = time.perf_counter()
+        handler.close()
+        total = time.perf_counter() - start
+    finally:
+        logger.removeHandler(handler)
+        os.remove(path)
+    return count / total, (emitted - start) / count * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the JSON lines log handler.")
+    parser.add_argument("--records", type=int, default=5000, help="Records emitted for every measure.")
+    args = parser.parse_args()
+
+    kinds: List[tuple[str, Callable]] = [("text + extra", _text_records), ("chat entry", _chat_entry_records)]
+    print(f"{'records':>12} | {'handler':>18} | {'records/sec':>11} | {'us per log call':>15}")
+    for kind, emit_records in kinds:
+        for name, handler_cls in (("pandas (before)", _PandasHandler), ("background writer", CsvFileHandler)):
+            rate, per_call = measure(handler_cls, emit_records, args.records)
+            print(f"{kind:>12} | {name:>18} | {rate:>11.0f} | {per_call:>15.1f}")
+
+    found = schema_differences()
+    for difference in found:
+        print(f"Schema difference: {difference}")
+    if found:
+        sys.exit(1)
+    print("Same records as the pandas handler")
+
+
+if __name__ == "__main__":
+    main()
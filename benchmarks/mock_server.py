@@ -0,0 +1,290 @@
+"""
+Local stand-in of an OpenAI compatible server (vLLM, OpenRouter), to load test SAUCE without a model.
+
+Implements `/v1/chat/completions` (streamed or not), `/v1/completions` (a prompt or a list of prompts),
+`/health` and `/v1/models`, plus `/stats` with the counters of the server. Every request waits for a
+latency drawn from the configured distribution, then generates its answer at `--tokens-per-second`.
+Errors (500) and throttling (429 with a Retry-After header) are injected with the given probabilities,
+and at most `--max-concurrency` requests are processed at once, the others queue (or are throttled with
+`--overflow reject`), as in a server with a fixed number of batch slots.
+
+Latency distributions:
+    fixed:<seconds>
+    uniform:<low>,<high>
+    lognormal:<median>,<sigma>
+    exponential:<mean>
+
+Usage (from the repository root), then use http://127.0.0.1:8001/v1 as the "vllm_api_base" of the persons:
+    python -m benchmarks.mock_server --port 8001 --latency lognormal:0.3,0.5 --tokens-per-second 80 \\
+        --rate-limit-rate 0.02 --error-rate 0.01 --max-concurrency 64
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Tuple
+
+_WORDS = ("I", "think", "that", "we", "should", "agree", "on", "a", "speed", "limit", "because", "it",
+          "saves", "lives", "and", "the", "evidence", "is", "clear")
+
+
+def parse_latency(spec: str) -> Callable[[random.Random], float]:
+    """Returns a sampler of the latency distribution `spec` (see the module documentation), in seconds."""
+    kind, _, values = spec.partition(":")
+    try:
+        parameters = [float(value) for value in values.split(",")] if values else []
+    except ValueError:
+        raise ValueError(f"Invalid latency distribution {spec}") from None
+    if kind == "fixed" and len(parameters) == 1:
+        return lambda rng: parameters[0]
+    if kind == "uniform" and len(parameters) == 2:
+        return lambda rng: rng.uniform(*parameters)
+    if kind == "lognormal" and len(parameters) == 2:
+        return lambda rng: rng.lognormvariate(math.log(parameters[0]), parameters[1])
+    if kind == "exponential" and len(parameters) == 1:
+        return lambda rng: rng.expovariate(1 / parameters[0]) if parameters[0] > 0 else 0.0
+    raise ValueError(f"Invalid latency distribution {spec}")
+
+
+class MockSettings:
+    def __init__(self, latency: str = "fixed:0.05", tokens_per_second: float = 0.0, completion_tokens: int = 20,
+                 error_rate: float = 0.0, rate_limit_rate: float = 0.0, retry_after: float = 0.0,
+                 max_concurrency: int = 0, overflow: str = "queue", seed: Optional[int] = None):
+        """
+        :param latency: distribution of the time before the first token (see `parse_latency`)
+        :param tokens_per_second: generation speed of each request, 0 for instant generation
+        :param completion_tokens: tokens (words) of every answer, bounded by the "max_tokens" of the request
+        :param error_rate: probability of answering a request with a 500
+        :param rate_limit_rate: probability of answering a request with a 429
+        :param retry_after: seconds of the Retry-After header of the 429 answers
+        :param max_concurrency: requests processed at once, 0 for unlimited
+        :param overflow: what happens to the requests above `max_concurrency`, "queue" or "reject" (429)
+        """
+        if overflow not in ("queue", "reject"):
+            raise ValueError("overflow must be 'queue' or 'reject'")
+        self.latency = parse_latency(latency)
+        self.tokens_per_second = tokens_per_second
+        self.completion_tokens = completion_tokens
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.max_concurrency = max_concurrency
+        self.overflow = overflow
+        self.seed = seed
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], settings: MockSettings):
+        super().__init__(address, _Handler)
+        self.settings = settings
+        self._rng = random.Random(settings.seed)
+        self._rng_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(settings.max_concurrency) if settings.max_concurrency else None
+        self._counters_lock = threading.Lock()
+        self.counters: Dict[str, int] = {
+            "requests": 0, "chat_completions": 0, "completions": 0, "prompts": 0, "completion_tokens": 0,
+            "errors": 0, "throttled": 0, "in_flight": 0, "max_in_flight": 0,
+        }
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.server_address[0]}:{self.server_address[1]}/v1"
+
+    def count(self, **increments: int):
+        with self._counters_lock:
+            for name, increment in increments.items():
+                self.counters[name] += increment
+            self.counters["max_in_flight"] = max(self.counters["max_in_flight"], self.counters["in_flight"])
+
+    def stats(self) -> Dict[str, int]:
+        with self._counters_lock:
+            return dict(self.counters)
+
+    def draw(self) -> Tuple[float, float]:
+        """A uniform draw (for the injected failures) and a latency."""
+        with self._rng_lock:
+            return self._rng.random(), max(0.0, self.settings.latency(self._rng))
+
+    def acquire_slot(self) -> bool:
+        if self._slots is None:
+            return True
+        return self._slots.acquire(blocking=self.settings.overflow == "queue")
+
+    def release_slot(self):
+        if self._slots is not None:
+            self._slots.release()
+
+
+def _answer(count: int, seed: int) -> List[str]:
+    return [_WORDS[(seed + index) % len(_WORDS)] for index in range(count)]
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: MockServer
+
+    def log_message(self, *args):
+        pass
+
+    def _send_json(self, status: int, payload: dict, headers: Optional[Dict[str, str]] = None):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_GET(self):
+        path = self.path.rstrip("/")
+        if path == "/health":
+            self._send_json(200, {"status": "ok"})
+        elif path == "/stats":
+            self._send_json(200, self.server.stats())
+        elif path == "/v1/models":
+            self._send_json(200, {"object": "list", "data": [{"id": "mock", "object": "model", "owned_by": "mock"}]})
+        else:
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+        path = self.path.rstrip("/")
+        if path not in ("/v1/chat/completions", "/v1/completions"):
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+            return
+        server = self.server
+        server.count(requests=1)
+        if not server.acquire_slot():
+            server.count(throttled=1)
+            self._throttle()
+            return
+        server.count(in_flight=1)
+        try:
+            self._complete(path, request)
+        finally:
+            server.count(in_flight=-1)
+            server.release_slot()
+
+    def _throttle(self):
+        self._send_json(429, {"error": {"message": "Rate limit reached", "type": "rate_limit_error"}},
+                        {"Retry-After": str(self.server.settings.retry_after)})
+
+    def _complete(self, path: str, request: dict):
+        server, settings = self.server, self.server.settings
+        draw, latency = server.draw()
+        if draw < settings.rate_limit_rate:
+            server.count(throttled=1)
+            self._throttle()
+            return
+        if draw < settings.rate_limit_rate + settings.error_rate:
+            server.count(errors=1)
+            self._send_json(500, {"error": {"message": "Injected server error", "type": "server_error"}})
+            return
+
+        chat = path == "/v1/chat/completions"
+        if chat:
+            prompts = [json.dumps(request.get("messages", []))]
+        else:
+            prompts = request.get("prompt") or [""]
+            prompts = prompts if isinstance(prompts, list) else [prompts]
+        tokens = min(settings.completion_tokens, request.get("max_tokens") or settings.completion_tokens)
+        prompt_tokens = sum(len(prompt) for prompt in prompts) // 4
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": tokens * len(prompts),
+                 "total_tokens": prompt_tokens + tokens * len(prompts)}
+        server.count(**{"chat_completions" if chat else "completions": 1, "prompts": len(prompts),
+                        "completion_tokens": tokens * len(prompts)})
+        time.sleep(latency)
+        if chat and request.get("stream"):
+            self._stream(request, tokens, usage)
+            return
+        if settings.tokens_per_second:
+            time.sleep(tokens / settings.tokens_per_second)
+        seed = server.counters["requests"]
+        if chat:
+            choices = [{"index": 0, "finish_reason": "stop",
+                        "message": {"role": "assistant", "content": " ".join(_answer(tokens, seed))}}]
+        else:
+            choices = [{"index": index, "finish_reason": "stop", "text": " ".join(_answer(tokens, seed + index))}
+                       for index in range(len(prompts))]
+        self._send_json(200, {"id": f"mock-{seed}", "object": "chat.completion" if chat else "text_completion",
+                              "created": int(time.time()), "model": request.get("model", "mock"),
+                              "choices": choices, "usage": usage})
+
+    def _stream(self, request: dict, tokens: int, usage: dict):
+        settings = self.server.settings
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        seed = self.server.counters["requests"]
+        base = {"id": f"mock-{seed}", "object": "chat.completion.chunk", "created": int(time.time()),
+                "model": request.get("model", "mock")}
+
+        def send(data: str):
+            event = f"data: {data}\n\n".encode()
+            self.wfile.write(f"{len(event):x}\r\n".encode() + event + b"\r\n")
+            self.wfile.flush()
+
+        for index, word in enumerate(_answer(tokens, seed)):
+            if index and settings.tokens_per_second:
+                time.sleep(1 / settings.tokens_per_second)
+            send(json.dumps({**base, "choices": [{"index": 0, "delta": {"content": word if not index else f" {word}"},
+                                                  "finish_reason": None}]}))
+        send(json.dumps({**base, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}))
+        if (request.get("stream_options") or {}).get("include_usage"):
+            send(json.dumps({**base, "choices": [], "usage": usage}))
+        send("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+
+
+def start_server(settings: Optional[MockSettings] = None, host: str = "127.0.0.1", port: int = 0) -> MockServer:
+    """Starts a server (on a free port by default) in a daemon thread, stop it with `shutdown()`."""
+    server = MockServer((host, port), settings or MockSettings())
+    threading.Thread(target=server.serve_forever, name="mock-server", daemon=True).start()
+    return server
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Mock OpenAI compatible server for load tests.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001, help="0 picks a free port (printed on start).")
+    parser.add_argument("--latency", default="fixed:0.05", help="Latency distribution before the first token.")
+    parser.add_argument("--tokens-per-second", type=float, default=0.0, help="0 generates the answers instantly.")
+    parser.add_argument("--completion-tokens", type=int, default=20, help="Words of every answer.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Probability of a 500 answer.")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Probability of a 429 answer.")
+    parser.add_argument("--retry-after", type=float, default=0.0, help="Retry-After of the 429 answers (seconds).")
+    parser.add_argument("--max-concurrency", type=int, default=0, help="Requests processed at once, 0 for no cap.")
+    parser.add_argument("--overflow", choices=["queue", "reject"], default="queue",
+                        help="What happens to the requests above --max-concurrency.")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    settings = MockSettings(args.latency, args.tokens_per_second, args.completion_tokens, args.error_rate,
+                            args.rate_limit_rate, args.retry_after, args.max_concurrency, args.overflow, args.seed)
+    server = MockServer((args.host, args.port), settings)
+    print(f"Listening on {server.base_url}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Micro-benchmark of the per-turn prompt building of the chat completion persons.
+
+It grows a conversation between two persons to `--turns` entries and measures how long each
+`create_prompt` call takes with the incremental prompt cache, compared to converting the whole
+chat list on every turn (the behaviour before the cache was added). No request is sent.
+
+Usage (from the repository root):
+    python -m benchmarks.prompt_build --turns 2000
+"""
+
+from __future__ import annotations
+
+import argparse
+import time
+from statistics import mean
+from typing import Callable, List
+
+from persons.person_vllm import PersonVLLM
+from session_rooms.ChatEntry import ChatEntry
+
+
+def _full_rebuild(person: PersonVLLM, scenario: str, chat_list: List[ChatEntry], prompt_version: str):
+    return person.prompt_setups(prompt_version, scenario, False) + [
+        person._chat_entry_to_message(chat_entry) for chat_entry in chat_list
+    ]
+
+
+def _cached(person: PersonVLLM, scenario: str, chat_list: List[ChatEntry], prompt_version: str):
+    return person.create_prompt(scenario, chat_list, prompt_version)
+
+
+def measure(build: Callable, turns: int, checkpoints: List[int], repeat: int) -> dict[int, float]:
+    """Returns the mean time (in microseconds) of a prompt build at each checkpoint."""
+    persons = [
+        PersonVLLM("background A", "your background A", "Anna"),
+        PersonVLLM("background B", "your background B", "Ben"),
+    ]
+    scenario = "You discuss the statement: a general speed limit should apply on all motorways."
+    chat_list: List[ChatEntry] = []
+    results: dict[int, float] = {}
+    for turn in range(1, turns + 1):
+        person = persons[turn % 2]
+        if turn in checkpoints:
+            samples = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                build(person, scenario, chat_list, "v1")
+                samples.append(time.perf_counter() - start)
+            results[turn] = mean(samples) * 1e6
+        else:
+            build(person, scenario, chat_list, "v1")
+        chat_list.append(ChatEntry(entity=person, prompt=None, answer=f"Answer number {turn} " * 5))
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the per-turn prompt building cost.")
+    parser.add_argument("--turns", type=int, default=2000, help="Length of the simulated conversation.")
+    parser.add_argument("--repeat", type=int, default=5, help="Repetitions of each measured turn.")
+    args = parser.parse_args()
+
+    checkpoints = sorted({t for t in (10, 100, 500, 1000, 2000, 5000, 10000) if t <= args.turns} | {args.turns})
+    # The cached build is measured on the turn itself, repeating it measures the steady state of the cache
+    full = measure(_full_rebuild, args.turns, checkpoints, args.repeat)
+    cached = measure(_cached, args.turns, checkpoints, 1)
+
+    print(f"{'turn':>8} {'full rebuild [us]':>18} {'incremental [us]':>18}")
+    for turn in checkpoints:
+        print(f"{turn:>8} {full[turn]:>18.1f} {cached[turn]:>18.1f}")
+
+
+if __name__ == "__main__":  # pragma: no cover
+    main()
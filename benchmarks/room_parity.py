@@ -0,0 +1,94 @@
+"""
+Parity check of the session rooms.
+
+`AsyncSessionRoom` overlaps the surveys with the conversation, but the persons which can't answer
+concurrently (`Person.CONCURRENT_CALLS`, e.g. `fake_person` and `synthetic_person`) must still be called in
+the order of `SessionRoom`: the survey of an iteration before the next turn. The same experiment is run in
+both rooms, with `fake_person`s reading a script (as test/test_config.json, with longer scripts) and with
+seeded `synthetic_person`s, and the transcripts and survey answers are compared. The command fails when
+they differ.
+
+Usage (from the repository root):
+    python -m benchmarks.room_parity
+    python -m benchmarks.room_parity --turns 40
+"""
+
+from __future__ import annotations
+
+import argparse
+import copy
+import json
+import logging
+import sys
+from typing import List, Tuple
+
+from experiments.experiment import Experiment
+
+ROOMS = ("base", "async")
+TEST_CONFIG = "test/test_config.json"
+
+
+def fake_person_config(turns: int) -> dict:
+    """test/test_config.json, with scripts long enough for `turns` turns and every survey."""
+    with open(TEST_CONFIG, "r", encoding="utf-8") as file:
+        config = json.load(file)
+    for person in config["persons"]:
+        person["things_to_say"] = [f"{person['name']} line {i}" for i in range(turns * 2)]
+    config["endType"]["max_num_msgs"] = turns
+    return config
+
+
+def synthetic_person_config(turns: int) -> dict:
+    config = fake_person_config(turns)
+    config["persons"] = [{"class": "synthetic_person", "name": person["name"], "background_story": "b",
+                          "you_background_story": "y", "seed": 1, "answer_words": [3, 12]}
+                         for person in config["persons"]]
+    return config
+
+
+def transcript(config: dict, session_room: str) -> Tuple[List[tuple], List[tuple]]:
+    """The (person, answer) of the turns and the (iteration, question, person, answer) of the surveys."""
+    config = copy.deepcopy(config)
+    config["sessionRoom"] = {"name": session_room}
+    output = Experiment.load_from_string(json.dumps(config), prompt_version="v0").run()
+    turns = [(entry.entity.name, entry.answer) for entry in output.chat_entry]
+    surveys = [(question.iteration, question.question_id, question.chat_entry.entity.name,
+                question.chat_entry.answer) for question in output.survey_question]
+    return turns, surveys
+
+
+def differences(config: dict) -> List[str]:
+    expected = transcript(config, ROOMS[0])
+    found = []
+    for session_room in ROOMS[1:]:
+        for kind, expected_records, records in zip(("turn", "survey answer"), expected,
+                                                   transcript(config, session_room)):
+            if len(records) != len(expected_records):
+                found.append(f"{session_room}: {len(records)} {kind}s instead of {len(expected_records)}")
+            for index, (record, expected_record) in enumerate(zip(records, expected_records)):
+                if record != expected_record:
+                    found.append(f"{session_room}: {kind} {index} is {record}, {ROOMS[0]} gives {expected_record}")
+                    break
+    return found
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Check that the session rooms give the same outputs.")
+    parser.add_argument("--turns", type=int, default=20, help="Turns of the conversations.")
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    failed = False
+    for name, config in (("fake_person", fake_person_config(args.turns)),
+                         ("synthetic_person", synthetic_person_config(args.turns))):
+        found = differences(config)
+        for difference in found:
+            print(f"{name}: {difference}")
+        print(f"{name}: {'different outputs' if found else 'same outputs'} in the {', '.join(ROOMS)} rooms")
+        failed = failed or bool(found)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":  # pragma: no cover
+    main()
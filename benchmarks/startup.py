@@ -0,0 +1,83 @@
+"""
+Start up benchmark of main.py.
+
+Every sweep starts `main.py` thousands of times (see run_iterations.py), so its fixed cost matters.
+This measures, in fresh interpreters:
+    - the import of `main` (and how many modules it loads),
+    - the wall time of a whole `main.py` run of a one turn `fake_person` experiment, i.e. the time to
+      the first turn plus writing the output, without any model call.
+
+Usage (from the repository root):
+    python -m benchmarks.startup --repeat 10
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from statistics import median
+from typing import List
+
+_IMPORT_MAIN = (
+    "import sys, time\n"
+    "start = time.perf_counter()\n"
+    "import main\n"
+    "print(time.perf_counter() - start, len(sys.modules))\n"
+)
+
+_CONFIG = {
+    "persons": [{"class": "fake_person", "name": "Anna", "things_to_say": ["Hello"]}],
+    "host": {"class": "Round Robin Host", "start_person_index": 0},
+    "endType": {"class": "iteration", "max_num_msgs": 1},
+    "experiment": {"scenario": "You discuss the statement: a general speed limit should apply.",
+                   "survey_questions": []},
+}
+
+
+def measure_import(repeat: int) -> tuple[List[float], int]:
+    """Returns the import times of `main` (in seconds) and the number of loaded modules."""
+    times, modules = [], 0
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, "-c", _IMPORT_MAIN], capture_output=True, text=True,
+                                check=True).stdout.split()
+        times.append(float(output[0]))
+        modules = int(output[1])
+    return times, modules
+
+
+def measure_first_turn(repeat: int) -> List[float]:
+    """Returns the wall times (in seconds) of a one turn `main.py` run."""
+    times = []
+    with tempfile.TemporaryDirectory() as directory:
+        config_path = os.path.join(directory, "config.json")
+        with open(config_path, "w") as file:
+            json.dump(_CONFIG, file)
+        command = [sys.executable, "main.py", config_path, "-o", os.path.join(directory, "out.json"),
+                   "--output-log", os.path.join(directory, "output.log"), "--no-console"]
+        for _ in range(repeat):
+            start = time.perf_counter()
+            subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+            times.append(time.perf_counter() - start)
+    return times
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the start up of main.py.")
+    parser.add_argument("--repeat", type=int, default=10, help="Fresh interpreters started for every measure.")
+    args = parser.parse_args()
+
+    import_times, modules = measure_import(args.repeat)
+    first_turn_times = measure_first_turn(args.repeat)
+    print(f"import main        : median {median(import_times) * 1000:7.1f} ms, "
+          f"min {min(import_times) * 1000:7.1f} ms ({modules} modules loaded)")
+    print(f"time to first turn : median {median(first_turn_times) * 1000:7.1f} ms, "
+          f"min {min(first_turn_times) * 1000:7.1f} ms (whole one turn fake_person run)")
+
+
+if __name__ == "__main__":
+    main()
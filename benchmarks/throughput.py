@@ -0,0 +1,218 @@
+"""
+End-to-end throughput benchmark against the local mock server (see `benchmarks.mock_server`).
+
+The mock server is started in its own process (its CPU isn't counted), then the same debate is run with:
+    - `session_room`: the base `SessionRoom` (`Experiment`),
+    - `async_session_room`: the `AsyncSessionRoom`,
+    - `batch_session_room`: the `BatchSessionRoom` (`BatchExperiment`) with `BatchedPersonVLLM` persons,
+    - `run_iterations`: a small sweep with the pooled runner of run_iterations.py.
+For each of them, the turns/sec, the calls/sec (as counted by the server) and the CPU time per turn of
+SAUCE (this process and its worker processes) are reported. The survey answers count as turns.
+
+The results can be written as json (`--output`) and compared to a previous run (`--baseline`): the
+command fails when the turns/sec dropped, or the CPU per turn grew, by more than `--tolerance`.
+
+Usage (from the repository root):
+    python -m benchmarks.throughput --turns 40 --latency fixed:0.02 --output throughput.json
+    python -m benchmarks.throughput --turns 40 --latency fixed:0.02 --baseline throughput.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import contextlib
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from pathlib import Path
+from typing import Callable, Dict, List
+
+SCENARIOS = ("session_room", "async_session_room", "batch_session_room", "run_iterations")
+
+
+def _persons(base_url: str, batch: int = 0) -> List[dict]:
+    persons = []
+    for name, story in (("Anna", "You support a general speed limit."), ("Ben", "You oppose a speed limit.")):
+        person = {"vllm_api_base": base_url, "model": "mock", "rate_limit": {"initial_concurrency": 64}}
+        if batch:
+            person.update({"class": "batched_person_vllm", "tag": name, "names": [f"{name}{i}" for i in range(batch)],
+                           "background_stories": [story] * batch})
+        else:
+            person.update({"class": "person_vllm", "name": name, "background_story": story,
+                           "you_background_story": story})
+        persons.append(person)
+    return persons
+
+
+def config(base_url: str, turns: int, session_room: str = "base", batch: int = 0) -> dict:
+    return {
+        "persons": _persons(base_url, batch),
+        "host": {"class": "Round Robin Host", "start_person_index": 0},
+        "endType": {"class": "iteration", "max_num_msgs": turns},
+        "sessionRoom": {"name": session_room},
+        "experiment": {
+            "scenario": "You discuss the statement: a general speed limit should apply on all motorways.",
+            "survey_questions": [{"id": "agree", "iterations": "always",
+                                  "question": "How much do you agree with the statement, from 1 to 7?"}],
+        },
+    }
+
+
+def _count_turns(outputs) -> int:
+    outputs = outputs if isinstance(outputs, list) else [outputs]
+    return sum(len(output.chat_entry) + len(output.survey_question) for output in outputs)
+
+
+def run_experiment(base_url: str, turns: int, session_room: str) -> int:
+    from experiments.experiment import Experiment
+
+    experiment = Experiment.load_from_string(json.dumps(config(base_url, turns, session_room)), prompt_version="v0")
+    return _count_turns(experiment.run())
+
+
+def run_batch_experiment(base_url: str, turns: int, batch: int) -> int:
+    from experiments.batch_experiment import BatchExperiment
+
+    experiment = BatchExperiment.load_from_string(json.dumps(config(base_url, turns, "batch", batch)),
+                                                  prompt_version="v0")
+    return _count_turns(experiment.run())
+
+
+def run_sweep(base_url: str, turns: int, runs: int, workers: int) -> int:
+    """Runs `runs` experiments with the pooled runner of run_iterations.py, in a temporary sweep tree."""
+    import run_iterations
+
+    with tempfile.TemporaryDirectory() as directory, contextlib.chdir(directory):
+        subdir = Path("config") / "question_0" / "Anna-Ben"
+        subdir.mkdir(parents=True)
+        for repetition in range(runs):
+            (subdir / f"config_{repetition}.json").write_text(json.dumps(config(base_url, turns)))
+        settings = (run_iterations.QUESTIONS, run_iterations.PROMPT_VERSION, run_iterations.REPETITIONS)
+        run_iterations.QUESTIONS, run_iterations.PROMPT_VERSION, run_iterations.REPETITIONS = [0], ["v0"], runs
+        try:
+            with contextlib.redirect_stdout(None):
+                run_iterations.all_questions_pooled("mock", max_workers=workers, resume=False)
+        finally:
+            run_iterations.QUESTIONS, run_iterations.PROMPT_VERSION, run_iterations.REPETITIONS = settings
+        turns_done = 0
+        for output_path in subdir.glob("out_*.json"):
+            output = json.loads(output_path.read_text())
+            turns_done += len(output["chat_entry"]) + len(output["survey_question"])
+        return turns_done
+
+
+def _server_stats(base_url: str) -> Dict[str, int]:
+    with urllib.request.urlopen(base_url.removesuffix("/v1") + "/stats") as response:
+        return json.load(response)
+
+
+def _cpu_seconds() -> float:
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return time.process_time() + children.ru_utime + children.ru_stime
+
+
+def measure(base_url: str, run: Callable[[], int]) -> Dict[str, float]:
+    calls = _server_stats(base_url)["requests"]
+    cpu = _cpu_seconds()
+    start = time.perf_counter()
+    turns = run()
+    seconds = time.perf_counter() - start
+    cpu = _cpu_seconds() - cpu
+    calls = _server_stats(base_url)["requests"] - calls
+    return {
+        "turns": turns,
+        "calls": calls,
+        "seconds": round(seconds, 3),
+        "turns_per_second": round(turns / seconds, 2),
+        "calls_per_second": round(calls / seconds, 2),
+        "cpu_ms_per_turn": round(1000 * cpu / max(turns, 1), 3),
+    }
+
+
+def regressions(results: Dict[str, dict], baseline: Dict[str, dict], tolerance: float) -> List[str]:
+    found = []
+    for scenario, result in results.items():
+        previous = baseline.get(scenario)
+        if previous is None:
+            continue
+        if result["turns_per_second"] < previous["turns_per_second"] * (1 - tolerance):
+            found.append(f"{scenario}: {result['turns_per_second']} turns/s (baseline {previous['turns_per_second']})")
+        if result["cpu_ms_per_turn"] > previous["cpu_ms_per_turn"] * (1 + tolerance):
+            found.append(f"{scenario}: {result['cpu_ms_per_turn']} ms CPU/turn "
+                         f"(baseline {previous['cpu_ms_per_turn']})")
+    return found
+
+
+def start_mock_server(args) -> tuple[subprocess.Popen, str]:
+    command = [sys.executable, "-m", "benchmarks.mock_server", "--port", "0", "--latency", args.latency,
+               "--tokens-per-second", str(args.tokens_per_second), "--rate-limit-rate", str(args.rate_limit_rate),
+               "--error-rate", str(args.error_rate), "--max-concurrency", str(args.max_concurrency), "--seed", "0"]
+    server = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    # "Listening on <base url>"
+    return server, server.stdout.readline().split()[-1]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the end-to-end throughput against the mock server.")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--turns", type=int, default=40, help="Conversation turns of every experiment.")
+    parser.add_argument("--batch", type=int, default=8, help="Rooms of the batch_session_room scenario.")
+    parser.add_argument("--runs", type=int, default=8, help="Experiments of the run_iterations scenario.")
+    parser.add_argument("--workers", type=int, default=4, help="Worker processes of the run_iterations scenario.")
+    parser.add_argument("--latency", default="fixed:0.02", help="Latency distribution of the mock server.")
+    parser.add_argument("--tokens-per-second", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--max-concurrency", type=int, default=0)
+    parser.add_argument("--output", type=str, default=None, help="Write the results as json to this path.")
+    parser.add_argument("--baseline", type=str, default=None, help="Results of a previous run to compare with.")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative regression.")
+    args = parser.parse_args()
+
+    # the imports (openai, the persons) are a fixed cost measured by benchmarks.startup, not per turn
+    import experiments.batch_experiment  # noqa: F401
+    import persons.batch.batched_person_vllm  # noqa: F401
+    import session_rooms.async_session_room  # noqa: F401
+
+    server, base_url = start_mock_server(args)
+    runs = {
+        "session_room": lambda: run_experiment(base_url, args.turns, "base"),
+        "async_session_room": lambda: run_experiment(base_url, args.turns, "async"),
+        "batch_session_room": lambda: run_batch_experiment(base_url, args.turns, args.batch),
+        "run_iterations": lambda: run_sweep(base_url, args.turns, args.runs, args.workers),
+    }
+    results = {}
+    try:
+        print(f"{'scenario':>18} | {'turns':>6} | {'calls':>6} | {'turns/s':>8} | {'calls/s':>8} | {'CPU/turn':>9}")
+        for scenario in args.scenarios:
+            result = results[scenario] = measure(base_url, runs[scenario])
+            print(f"{scenario:>18} | {result['turns']:>6} | {result['calls']:>6} | {result['turns_per_second']:>8.1f} | "
+                  f"{result['calls_per_second']:>8.1f} | {result['cpu_ms_per_turn']:>6.2f} ms")
+    finally:
+        server.terminate()
+        server.wait()
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump({"settings": {key: value for key, value in vars(args).items()
+                                    if key not in ("output", "baseline")},
+                       "results": results}, file, indent=4)
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as file:
+            found = regressions(results, json.load(file)["results"], args.tolerance)
+        for regression in found:
+            print(f"Regression: {regression}")
+        if found:
+            sys.exit(1)
+        print(f"No regression against {args.baseline} (tolerance {args.tolerance:.0%})")
+
+
+if __name__ == "__main__":
+    # the pool workers of run_iterations.py import the repository modules
+    os.environ["PYTHONPATH"] = os.pathsep.join(filter(None, [os.getcwd(), os.environ.get("PYTHONPATH")]))
+    main()
@@ -1,14 +1,16 @@
 from __future__ import annotations
-from typing import Type
+from pkgutil import resolve_name
+from typing import Type, TYPE_CHECKING
 import logging
-import end_types.end_type
-import end_types.message_num_type
+
+if TYPE_CHECKING:
+    import end_types.end_type
 
 logging.getLogger(__name__).setLevel(logging.DEBUG)
 
 
 def get_end_type_class(name: str) -> Type[end_types.end_type.EndType]:
     _dict = {
-        end_types.message_num_type.EndTypeNumMsgs.NAME: end_types.message_num_type.EndTypeNumMsgs
+        "iteration": "end_types.message_num_type:EndTypeNumMsgs"
     }
-    return _dict.get(name)
+    return resolve_name(_dict[name]) if name in _dict else None
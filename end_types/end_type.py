@@ -29,4 +29,16 @@ class EndType(ABC):
         :param session_room: that is running
         :return: if the experiment is finished
         """
-        raise NotImplementedError("This function need to be implemented")
\ No newline at end of file
+        raise NotImplementedError("This function need to be implemented")
+
+    def get_state(self) -> dict:
+        """
+        Returns the json serializable state (counters) of the end type, used to checkpoint a running session.
+        """
+        return {}
+
+    def set_state(self, state: dict):
+        """
+        Restores the state returned by `get_state`.
+        """
+        pass
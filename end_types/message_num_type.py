@@ -30,6 +30,12 @@ class EndTypeNumMsgs(EndType):
 
         return session_room.session_length >= self.max_num_msgs
 
+    def get_state(self) -> dict:
+        return {"current_msg_num": self.current_msg_num}
+
+    def set_state(self, state: dict):
+        self.current_msg_num = state.get("current_msg_num", self.current_msg_num)
+
     def __add__(self, other):
         """
         Override the `+` operator
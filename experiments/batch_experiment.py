@@ -88,8 +88,8 @@ class BatchExperiment(Experiment):
         return super()._load_session_room(session_room, experiment)
 
     @classmethod
-    def load_from_string(cls, config_string: str) -> BatchExperiment:
-        loaded_exp: BatchExperiment = super().load_from_string(config_string)
+    def load_from_string(cls, config_string: str, prompt_version: str = "v0") -> BatchExperiment:
+        loaded_exp: BatchExperiment = super().load_from_string(config_string, prompt_version)
         log.debug(f"Updating session room batch size to {loaded_exp.persons[0].batch_count}")
         loaded_exp.session_room.batch_size = loaded_exp.persons[0].batch_count
         return loaded_exp
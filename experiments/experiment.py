@@ -7,6 +7,7 @@ import json
 import logging
 from typing import Dict, List, Optional, TYPE_CHECKING
 from experiments.experiment_output import ExperimentOutput
+from experiments.hooks import hook_point
 from hosts import get_host_class
 from persons import get_person_class
 from end_types import get_end_type_class
@@ -111,6 +112,7 @@ class Experiment:
         return Experiment(persons, session_room, host, end, scenario, survey_questions)
 
     @classmethod
+    @hook_point("experiment.load")
     def load_from_string(cls, config_string: str, prompt_version: str):
         """
         Creates a new Experiment instance base on given string
@@ -148,7 +150,17 @@ class Experiment:
         else:
             survey_questions = experiment_type_obj.get("survey_questions", [])
 
+        response_cache_obj = exp_config.get("responseCache")
+        if response_cache_obj:
+            if not isinstance(response_cache_obj, dict):
+                raise TypeError("Invalid responseCache")
+            # The persons calling an LLM endpoint pick it up from their kwargs, the others ignore it
+            for p_dict in persons_obj:
+                p_dict.setdefault("response_cache", response_cache_obj)
         persons: List[Person] = cls._load_persons(persons_obj)
+        # the connections to the endpoints are opened before the first turn (when the persons ask for it)
+        for person in persons:
+            person.prewarm()
         session_room: SessionRoom = cls._load_session_room(session_room_obj, None)
         host: Host = cls._load_host(host_obj, persons)
         end: EndType = cls._load_end_type(end_type_obj)
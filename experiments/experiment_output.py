@@ -2,10 +2,13 @@ from __future__ import annotations
 
 import json
 
-from typing import TYPE_CHECKING
-from dataclasses import dataclass,asdict,field
+from typing import Dict, IO, Optional, TYPE_CHECKING
+from dataclasses import dataclass,field
+
+from experiments.hooks import hook_point
 
 if TYPE_CHECKING:
+    from experiments.output_sink import JsonlOutputSink, RoomOutputSink
     from experiments.survey_question import SurveyQuestion
     from session_rooms.ChatEntry import ChatEntry
 
@@ -14,9 +17,70 @@ if TYPE_CHECKING:
 class ExperimentOutput:
     chat_entry:list['ChatEntry'] = field(default_factory=list)
     survey_question: list['SurveyQuestion'] = field(default_factory=list)
+    # Write every prompt as its full message list instead of the compact shared form
+    full_prompts: bool = field(default=False, repr=False, compare=False)
+    # Optional sink the records are streamed to as soon as they are added. They are then not kept in memory
+    # (the lists stay empty), the output is read back from the stream
+    sink: Optional['JsonlOutputSink | RoomOutputSink'] = field(default=None, repr=False, compare=False)
+
+    def add_chat_entry(self, chat_entry: 'ChatEntry'):
+        if self.sink is None:
+            self.chat_entry.append(chat_entry)
+        else:
+            self.sink.write_chat_entry(chat_entry)
+
+    def add_survey_question(self, survey_question: 'SurveyQuestion'):
+        if self.sink is None:
+            self.survey_question.append(survey_question)
+        else:
+            self.sink.write_survey_question(survey_question)
+
+    def to_json(self, full_prompts: bool | None = None) -> dict:
+        """
+        Returns a json serializable representation of the output.
+        By default, the prompts are written in a compact form: each prompt refers to a node of the
+        "prompt_nodes" table, which holds the messages added since its parent node. This keeps the output
+        linear in the conversation length, `session_rooms.prompt_store.materialize_prompt` reads them back.
+        With a sink, the output is read back from its stream, in the form of prompts chosen by the sink.
+        """
+        if self.sink is not None:
+            return self.sink.read()
+        full_prompts = self.full_prompts if full_prompts is None else full_prompts
+        prompt_nodes: Dict[str, dict] | None = None if full_prompts else {}
+        output = {
+            "chat_entry": [entry.to_json(prompt_nodes) for entry in self.chat_entry],
+            "survey_question": [question.to_json(prompt_nodes) for question in self.survey_question],
+        }
+        if prompt_nodes:
+            output["prompt_nodes"] = prompt_nodes
+        return output
 
     def __json__(self):
-        return asdict(self)
+        return self.to_json()
+
+    def stats_summary(self) -> Dict[str, Dict[str, dict]]:
+        """
+        The call stats (tokens, latency percentiles, attempts) of the model backed entries, aggregated
+        per person and per endpoint (see `persons.call_stats.summarize_stats`).
+        """
+        from persons.call_stats import output_call_stats, summarize_stats
+
+        if self.sink is not None:
+            return summarize_stats(output_call_stats(self.to_json()))
+        entries = [*self.chat_entry]
+        for question in self.survey_question:
+            chat_entry = question.chat_entry
+            entries.extend(chat_entry if isinstance(chat_entry, list) else [chat_entry])
+        return summarize_stats((entry.entity.name, entry.stats.to_json())
+                               for entry in entries if entry is not None and entry.stats is not None)
+
+    @hook_point("output.write")
+    def dump(self, fp: IO[str], pretty: bool = True):
+        """
+        Writes the output as json to `fp` (the layout used by main.py).
+        """
+        pp_dict = {"indent": 4} if pretty else {}
+        json.dump(self.to_json(), fp, default=lambda obj: obj.__json__(), **pp_dict, ensure_ascii=False)
     
     @classmethod
     def from_json(cls,source:dict | str):
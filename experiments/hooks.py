@@ -0,0 +1,173 @@
+"""
+This file contains the named hook points of the hot path of a run, and the Chrome trace exporter built on them.
+
+The hook points wrap the functions decorated with `hook_point` (loading the experiment, the turns, the
+surveys, building the prompts, the LLM calls, writing the outputs and the logs). A `Hook` added with
+`add_hook` is told when each of them starts and ends, on the thread (or asyncio task) running it.
+Without hooks, the wrapper only checks that the hook list is empty before calling the function.
+
+`ChromeTracer` records the hook points as trace events, the written file opens in chrome://tracing or
+https://ui.perfetto.dev as a timeline (one track per thread / task):
+
+    tracer = ChromeTracer()
+    add_hook(tracer)
+    ...
+    tracer.write("trace.json")
+"""
+
+from __future__ import annotations
+
+import asyncio
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# The hook points, by name
+HOOK_POINTS = {
+    "experiment.load": "loading the experiment and its persons from the configuration",
+    "session.iterate": "a turn of the conversation",
+    "session.survey": "the survey questions of an iteration",
+    "person.create_prompt": "building the prompt of a person",
+    "llm.call": "a call to the LLM endpoint (rate limiter waits and retries included)",
+    "output.write": "serializing and writing the outputs",
+    "log.write": "serializing and writing a batch of log records (on the writer thread)",
+}
+
+
+class Hook:
+    """Base class of the hooks, called around every hook point."""
+
+    def enter(self, point: str, details: Dict[str, Any]) -> Any:
+        """
+        Called when a hook point starts, returns a token given back to `exit`.
+        :param details: of the call (e.g. the person), computed by the hook point
+        """
+
+    def exit(self, point: str, token: Any, error: Optional[BaseException]):
+        """Called when the hook point ends, with the error it raised if any."""
+
+
+# Replaced (never modified in place), so the wrappers can iterate it without a lock
+_hooks: Tuple[Hook, ...] = ()
+_hooks_lock = threading.Lock()
+
+
+def add_hook(hook: Hook):
+    global _hooks
+    with _hooks_lock:
+        _hooks = (*_hooks, hook)
+
+
+def remove_hook(hook: Hook):
+    global _hooks
+    with _hooks_lock:
+        _hooks = tuple(registered for registered in _hooks if registered is not hook)
+
+
+def _enter(point: str, details: Dict[str, Any]) -> List[Tuple[Hook, Any]]:
+    return [(hook, hook.enter(point, details)) for hook in _hooks]
+
+
+def _exit(point: str, entered: List[Tuple[Hook, Any]], error: Optional[BaseException]):
+    for hook, token in reversed(entered):
+        hook.exit(point, token, error)
+
+
+def hook_point(point: str, details: Optional[Callable[..., Dict[str, Any]]] = None):
+    """
+    Decorator making the calls of a function (or coroutine function) the hook point `point`.
+    :param details: called with the arguments of the function (only when there are hooks), returns the
+                    details given to the hooks
+    """
+    if point not in HOOK_POINTS:
+        raise ValueError(f"Unknown hook point {point}")
+
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                if not _hooks:
+                    return await fn(*args, **kwargs)
+                entered = _enter(point, details(*args, **kwargs) if details else {})
+                try:
+                    result = await fn(*args, **kwargs)
+                except BaseException as e:
+                    _exit(point, entered, e)
+                    raise
+                _exit(point, entered, None)
+                return result
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _hooks:
+                return fn(*args, **kwargs)
+            entered = _enter(point, details(*args, **kwargs) if details else {})
+            try:
+                result = fn(*args, **kwargs)
+            except BaseException as e:
+                _exit(point, entered, e)
+                raise
+            _exit(point, entered, None)
+            return result
+        return wrapper
+    return decorator
+
+
+class ChromeTracer(Hook):
+    """
+    Records the hook points as complete ("X") events of the Chrome trace event format.
+    The coroutines get a track per asyncio task, as their spans overlap on the event loop thread.
+    """
+
+    def __init__(self):
+        self._origin = time.perf_counter_ns()
+        self._pid = os.getpid()
+        self._events: List[dict] = []
+        self._tracks: Dict[Any, int] = {}
+        self._tracks_lock = threading.Lock()
+
+    def _now(self) -> float:
+        # microseconds, the unit of the trace events
+        return (time.perf_counter_ns() - self._origin) / 1000
+
+    def _track(self) -> int:
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            task = None
+        key = task if task is not None else threading.get_ident()
+        track = self._tracks.get(key)
+        if track is None:
+            with self._tracks_lock:
+                track = self._tracks.setdefault(key, len(self._tracks) + 1)
+                name = task.get_name() if task is not None else threading.current_thread().name
+                self._events.append({"name": "thread_name", "ph": "M", "pid": self._pid, "tid": track,
+                                     "args": {"name": name}})
+        return track
+
+    def enter(self, point: str, details: Dict[str, Any]) -> Any:
+        return self._track(), self._now(), details
+
+    def exit(self, point: str, token: Any, error: Optional[BaseException]):
+        track, start, details = token
+        args = {key: str(value) for key, value in details.items()}
+        if error is not None:
+            args["error"] = repr(error)
+        # appending to a list is atomic, the hook points of every thread add their events concurrently
+        self._events.append({"name": point, "cat": point.split(".")[0], "ph": "X", "pid": self._pid,
+                             "tid": track, "ts": start, "dur": self._now() - start, "args": args})
+
+    def to_json(self) -> dict:
+        return {"traceEvents": list(self._events), "displayTimeUnit": "ms"}
+
+    def write(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(self.to_json(), file)
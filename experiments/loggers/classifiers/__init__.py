@@ -1,13 +1,24 @@
+from pkgutil import resolve_name
 from typing import Type
 from experiments.loggers.classifiers.base_classifier import BaseClassifier
-from experiments.loggers.classifiers.zero_shot import ZeroShot
-from experiments.loggers.classifiers.regex_classifier import RegexClassifier
+
+# imported on first use, the zero-shot classifier loads transformers
+_KNOWN_CLASSIFIERS = {
+    BaseClassifier.NAME: "experiments.loggers.classifiers.base_classifier:BaseClassifier",
+    "ZeroShot": "experiments.loggers.classifiers.zero_shot:ZeroShot",
+    "Regex": "experiments.loggers.classifiers.regex_classifier:RegexClassifier",
+}
 
 
 def get_known_classifier(name: str) -> Type[BaseClassifier]:
-    known_classifier = {
-        BaseClassifier.NAME: BaseClassifier,
-        ZeroShot.NAME: ZeroShot,
-        RegexClassifier.NAME:RegexClassifier
-    }
-    return known_classifier.get(name)
+    path = _KNOWN_CLASSIFIERS.get(name)
+    return resolve_name(path) if path else None
+
+
+def __getattr__(name: str):
+    # `from experiments.loggers.classifiers import ZeroShot` keeps working, without the eager import
+    if name == "ZeroShot":
+        return get_known_classifier("ZeroShot")
+    if name == "RegexClassifier":
+        return get_known_classifier("Regex")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
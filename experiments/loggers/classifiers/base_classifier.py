@@ -1,6 +1,6 @@
 import logging
 from abc import ABC, abstractmethod
-from typing import Any, Optional
+from typing import Any, List, Optional
 
 
 class BaseClassifier(ABC):
@@ -13,4 +13,10 @@ class BaseClassifier(ABC):
     def classify(self, to_classify: Any, *args, **kwargs) -> Optional[dict]:
         raise NotImplementedError()
 
+    def classify_batch(self, to_classify: List[Any], *args, **kwargs) -> List[Optional[dict]]:
+        """
+        Classifies several inputs, returns one result per input (in order).
+        Override it when the classifier can process a batch faster than its inputs one by one.
+        """
+        return [self.classify(item, *args, **kwargs) for item in to_classify]
 
@@ -12,12 +12,14 @@ class RegexClassifier(BaseClassifier):
     def __init__(self, regex: str = None, *args, **kwargs):
         super().__init__(regex, *args, **kwargs)
         self.regex = kwargs.get("regex", regex)
+        # compiled once, `classify` runs for every logged message
+        self.pattern: Optional[re.Pattern] = re.compile(self.regex) if self.regex else None
 
     def classify(self, to_classify: Any, *args, **kwargs) -> Optional[dict]:
-        if not self.regex:
+        if self.pattern is None:
             self.logger.info("No regex given")
-        compiled_regex = re.compile(self.regex)
-        result = compiled_regex.findall(to_classify)
+            return None
+        result = self.pattern.findall(to_classify)
         result_dict = {
             "regex": self.regex,
             "classify": to_classify
@@ -1,5 +1,5 @@
 import warnings
-from typing import Any, Optional
+from typing import Any, List, Optional
 
 from .base_classifier import BaseClassifier
 
@@ -12,8 +12,12 @@ except Exception:
 class ZeroShot(BaseClassifier):
     NAME = "ZeroShot"
 
-    def __init__(self, model="facebook/bart-large-mnli", labels=[], *args, **kwargs):
+    def __init__(self, model="facebook/bart-large-mnli", labels=[], batch_size: int = 16, *args, **kwargs):
+        """
+        :param batch_size: how many texts go through the model at once in `classify_batch`
+        """
         super().__init__(model, labels, *args, **kwargs)
+        self.batch_size = kwargs.get("batch_size", batch_size)
         try:
             self.classifier: Optional[Pipeline] = pipeline("zero-shot-classification",
                                                            model=kwargs.get("model", model))
@@ -24,20 +28,35 @@ class ZeroShot(BaseClassifier):
         self.labels = kwargs.get("labels", labels)
 
     def classify(self, to_classify: Any, *args, **kwargs) -> Optional[dict]:
+        return self.classify_batch([to_classify])[0]
+
+    def classify_batch(self, to_classify: List[Any], *args, **kwargs) -> List[Optional[dict]]:
         if not self.classifier:
             self.logger.warning("No classifier")
-            return
-        if not isinstance(to_classify, str):
-            self.logger.error(f"received {type(to_classify)} which is not str")
-            return
-        result = self.classifier(to_classify, self.labels)
-        label_score_dict = dict(zip(result['labels'], result['scores']))
-        max_index = max(range(len(result['scores'])), key=result['scores'].__getitem__)
-        max_label = result['labels'][max_index]
-        max_score = result['scores'][max_index]
+            return [None] * len(to_classify)
+        results: List[Optional[dict]] = [None] * len(to_classify)
+        texts = {}
+        for index, text in enumerate(to_classify):
+            if isinstance(text, str):
+                texts[index] = text
+            else:
+                self.logger.error(f"received {type(text)} which is not str")
+        if not texts:
+            return results
+        # a single pipeline call, the model runs over `batch_size` texts at a time
+        outputs = self.classifier(list(texts.values()), self.labels, batch_size=self.batch_size)
+        if isinstance(outputs, dict):
+            outputs = [outputs]
+        for index, output in zip(texts, outputs):
+            results[index] = self._result(output)
+        return results
+
+    @staticmethod
+    def _result(output: dict) -> dict:
+        label_score_dict = dict(zip(output['labels'], output['scores']))
+        max_index = max(range(len(output['scores'])), key=output['scores'].__getitem__)
         return {
-            "max_label": max_label,
-            "max_score": max_score,
+            "max_label": output['labels'][max_index],
+            "max_score": output['scores'][max_index],
             **label_score_dict
         }
-
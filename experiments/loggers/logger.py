@@ -1,8 +1,11 @@
 from __future__ import annotations
+import json
 import logging
+import queue
 import threading
-from typing import List, Optional, TYPE_CHECKING
-import pandas as pd
+import time
+from typing import Any, List, Optional, TYPE_CHECKING
+from experiments.hooks import hook_point
 from experiments.loggers.classifiers import BaseClassifier
 
 
@@ -22,11 +25,73 @@ class OurLogger(logging.Logger):
         return record
 
 
+_SCALARS = (str, int, float, bool, type(None))
+
+
+def _jsonable(obj: Any, active: Optional[set] = None) -> Any:
+    """
+    Converts the objects logged in the records as pandas did when the records were written with
+    `DataFrame.to_json`: as their public, non callable attributes (sorted by name), even when they have a
+    `__json__` (which `json_fix` would otherwise use).
+    """
+    if isinstance(obj, _SCALARS):
+        return obj
+    if isinstance(obj, bytes):
+        return obj.decode("utf-8", errors="replace")
+    active = set() if active is None else active
+    if id(obj) in active:
+        raise ValueError("Circular reference detected")
+    active.add(id(obj))
+    try:
+        if isinstance(obj, dict):
+            return {key: _jsonable(value, active) for key, value in obj.items()}
+        if isinstance(obj, (list, tuple, set, frozenset)):
+            return [_jsonable(value, active) for value in obj]
+        attributes = {}
+        for name in dir(obj):
+            if name.startswith("_"):
+                continue
+            try:
+                value = getattr(obj, name)
+            except Exception:
+                continue
+            if not callable(value):
+                attributes[name] = _jsonable(value, active)
+        return attributes
+    finally:
+        active.discard(id(obj))
+
+
 class CsvFileHandler(logging.FileHandler):
-    def __init__(self, filename, mode='a', encoding=None, delay=False):
-        super().__init__(filename, mode, encoding, delay)
+    """
+    Writes the log records (with their `extra` fields) as JSON lines.
+
+    `emit` only snapshots the record and puts it on a queue; a background thread serializes the
+    queued records and appends them to the file in batches, every `flush_interval` seconds or as soon as
+    `batch_size` records are waiting. `flush` waits for the queued records to be written and `close`
+    (called by `logging.shutdown` at exit) writes the remaining ones.
+
+    The records logged with `extra={"do_classify": True, "classify": <text>}` get the results of the
+    `classifiers` attached by the same thread, right before being written: the texts of a batch are
+    classified together (`BaseClassifier.classify_batch`), so the logging thread never waits for a model.
+    """
+    _STOP = object()
+
+    def __init__(self, filename, mode='a', encoding=None, delay=False, flush_interval: float = 1.0,
+                 batch_size: int = 512):
+        """
+        :param flush_interval: the longest time (in seconds) a record waits before being written
+        :param batch_size: how many waiting records trigger a write
+        """
+        # the file is only opened by the writer thread
+        super().__init__(filename, mode, encoding or "utf-8", delay=True)
         self.__classifier: Optional[List[BaseClassifier]] = None
         self.__classifier_lock = threading.RLock()
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._writer: Optional[threading.Thread] = None
+        self._writer_lock = threading.Lock()
 
     @property
     def classifiers(self):
@@ -41,47 +106,125 @@ class CsvFileHandler(logging.FileHandler):
         with self.__classifier_lock:
             for classifier in v:
                 if isinstance(classifier, BaseClassifier):
-                    tmp(v)
+                    tmp.append(classifier)
             self.__classifier = tmp
 
     def add_classifier(self, classifier: BaseClassifier):
         with self.__classifier_lock:
             if isinstance(classifier, BaseClassifier):
+                if self.__classifier is None:
+                    self.__classifier = []
                 self.__classifier.append(classifier)
 
     def emit(self, record):
         try:
+            if record.exc_info and not record.exc_text:
+                # the traceback can only be formatted while it exists
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
             log_data = {
                 **record.__dict__,
                 'Level': record.levelname,
                 'Message': record.msg,
                 'Timestamp': record.created,
             }
+            if record.exc_info:
+                log_data['exc_info'] = None
 
             if hasattr(record,"kwargs"):
                 log_data.update(record.kwargs)
-                if record.kwargs.get('do_classify', False) and record.kwargs.get('classify'):
-                    self.classify(log_data)
-            df = pd.DataFrame([log_data])
-            df.to_json(self.baseFilename, mode='a', lines=True, orient="records", force_ascii=False)
+                if not record.kwargs:
+                    # the records logged without `extra` don't have the field
+                    del log_data['kwargs']
+            self._ensure_writer()
+            self._queue.put(log_data)
 
         except Exception:
             self.handleError(record)
 
-    def classify(self, log_data):
-        # Classification logic goes here
-        # Modify the log_data dictionary based on classification results
-        # For example, add a 'Classification' key-value pair
-        if not self.classifiers or len(self.classifiers) == 0:
-            print("Unable run it")
+    def _ensure_writer(self):
+        # not alive either after `close` or in a forked process
+        if self._writer is not None and self._writer.is_alive():
+            return
+        with self._writer_lock:
+            if self._writer is None or not self._writer.is_alive():
+                self._writer = threading.Thread(target=self._write_loop, name="log-jsonl-writer", daemon=True)
+                self._writer.start()
+
+    def _write_loop(self):
+        stop = False
+        while not stop:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size and batch[-1] is not self._STOP \
+                    and not isinstance(batch[-1], threading.Event):
+                try:
+                    batch.append(self._queue.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            records = [item for item in batch if item is not self._STOP and not isinstance(item, threading.Event)]
+            stop = batch[-1] is self._STOP
+            self._write_records(records)
+            for item in batch:
+                if isinstance(item, threading.Event):
+                    item.set()
+
+    @hook_point("log.write", lambda self, records: {"records": len(records)})
+    def _write_records(self, records: List[dict]):
+        try:
+            self.classify_records(records)
+        except Exception:
+            logging.getLogger(__name__).exception("Unable to classify the log records")
+        lines = []
+        for log_data in records:
+            try:
+                lines.append(json.dumps(_jsonable(log_data), ensure_ascii=False) + "\n")
+            except Exception:
+                logging.getLogger(__name__).debug("Unable to serialize a log record", exc_info=True)
+        if lines:
+            try:
+                if self.stream is None:
+                    self.stream = self._open()
+                self.stream.write("".join(lines))
+                self.stream.flush()
+            except Exception:
+                # the handler can't report to itself, the records of this batch are lost
+                import traceback
+                traceback.print_exc()
+
+    def flush(self):
+        """Waits until the records emitted so far are written."""
+        if self._writer is None or not self._writer.is_alive():
+            return
+        written = threading.Event()
+        self._queue.put(written)
+        written.wait()
+
+    def close(self):
+        writer = self._writer
+        if writer is not None and writer.is_alive():
+            self._queue.put(self._STOP)
+            writer.join()
+        super().close()
+
+    def classify(self, log_data: dict):
+        """Attaches the results of the classifiers to a single record (see `classify_records`)."""
+        self.classify_records([log_data])
+
+    def classify_records(self, records: List[dict]):
+        """
+        Attaches the results of every classifier to the records that ask for a classification.
+        Each classifier gets all the texts at once, in a single `classify_batch` call.
+        """
+        to_classify = [log_data for log_data in records
+                       if log_data.get('do_classify', False) and log_data.get('classify')]
+        classifiers = self.classifiers
+        if not to_classify or not classifiers:
             return
-        threads: List[threading.Thread] = []
-        for classifier in self.classifiers:
-            threads.append(
-                threading.Thread(target=lambda: log_data.update(classifier.classify(log_data.get('classify'))))
-            )
-            threads[-1].start()
-        [t.join() for t in threads]
+        texts = [log_data['classify'] for log_data in to_classify]
+        for classifier in classifiers:
+            for log_data, result in zip(to_classify, classifier.classify_batch(texts)):
+                if result:
+                    log_data.update(result)
 
     def fileExists(self):
         # Check if the file already exists
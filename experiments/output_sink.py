@@ -0,0 +1,284 @@
+"""
+This file contains the streaming writer of the experiment outputs.
+
+The records are appended to a JSONL file as soon as they are produced, so a crashed run keeps everything
+generated until the crash. `finalize` rebuilds the usual json layout of `ExperimentOutput` from it.
+
+Record types (one json object per line, with a "type" field):
+    - "prompt_node": a node of the compact prompts ("id", "parent", "messages"), always written before
+      the first record referring to it,
+    - "chat_entry" / "survey_question": the record in its `to_json` form, under "data", with the index of its
+      room under "room" for the batch runs (one shared stream for all the rooms).
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import Any, Callable, Dict, IO, List, Optional, TYPE_CHECKING
+
+from experiments.hooks import hook_point
+from session_rooms.prompt_store import skip_node_ids
+
+if TYPE_CHECKING:
+    from experiments.survey_question import SurveyQuestion
+    from session_rooms.ChatEntry import ChatEntry
+
+
+def _default(obj: Any):
+    return obj.__json__()
+
+
+def stream_path(output_path: str) -> str:
+    """The path of the stream file written while producing `output_path`."""
+    return f"{output_path}.stream.jsonl"
+
+
+class _StreamedPromptNodes:
+    """
+    Table of prompt nodes (as expected by `SharedPrompt.to_json`) which writes the new nodes to the stream
+    instead of keeping them, only the ids of the written nodes are remembered.
+    """
+
+    def __init__(self, write: Callable[[dict], None]):
+        self._written: set[str] = set()
+        self._write = write
+
+    def __contains__(self, node_id: str) -> bool:
+        return node_id in self._written
+
+    def __setitem__(self, node_id: str, node: dict):
+        self._written.add(node_id)
+        self._write({"type": "prompt_node", "id": node_id, **node})
+
+
+class JsonlOutputSink:
+    """
+    Appends the chat entries and survey questions of a run to a JSONL file.
+    Every record is flushed to the OS right away (it survives a crash of the process), and the file is
+    fsync-ed every `fsync_every` records or `fsync_interval` seconds (it survives a crash of the machine).
+    Nothing but the ids of the written prompt nodes is kept in memory.
+    """
+
+    def __init__(self, path: str, full_prompts: bool = False, fsync_every: int = 32, fsync_interval: float = 5.0,
+                 resume_offset: Optional[int] = None):
+        """
+        :param path: of the JSONL file, it is truncated
+        :param full_prompts: write every prompt as its full message list instead of the compact shared form
+        :param resume_offset: append to the existing file instead, after truncating it to this offset (in bytes),
+                              e.g. to the offset saved in the checkpoint of an interrupted run
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self._lock = threading.Lock()
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        self._prompt_nodes = None if full_prompts else _StreamedPromptNodes(self._write)
+        if resume_offset is None:
+            self._file: Optional[IO[str]] = open(path, "w", encoding="utf-8")
+            self.offset: int = 0
+        else:
+            self._resume(resume_offset)
+
+    def _resume(self, offset: int):
+        last_node_id = -1
+        with open(self.path, "r+b") as file:
+            file.truncate(offset)
+            file.seek(0)
+            for line in file:
+                record = json.loads(line)
+                if record["type"] == "prompt_node":
+                    if self._prompt_nodes is not None:
+                        self._prompt_nodes._written.add(record["id"])
+                    last_node_id = max(last_node_id, int(record["id"]))
+        # the nodes created from now on must not reuse the ids of the nodes already in the file
+        skip_node_ids(last_node_id)
+        self._file = open(self.path, "a", encoding="utf-8")
+        self.offset = offset
+
+    def room(self, index: int) -> RoomOutputSink:
+        """The sink of the room `index` of a batch run, its records are tagged with the room."""
+        return RoomOutputSink(self, index)
+
+    def _write(self, record: dict):
+        line = json.dumps(record, default=_default, ensure_ascii=False) + "\n"
+        self._file.write(line)
+        self.offset += len(line.encode("utf-8"))
+        self._unsynced += 1
+
+    def _commit(self):
+        self._file.flush()
+        if self._unsynced >= self.fsync_every or time.monotonic() - self._last_sync >= self.fsync_interval:
+            self.sync()
+
+    def sync(self):
+        if self._file is None or self._unsynced == 0:
+            return
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def _write_record(self, record_type: str, data: dict, room: Optional[int]):
+        record = {"type": record_type, "data": data}
+        if room is not None:
+            record["room"] = room
+        self._write(record)
+        self._commit()
+
+    @hook_point("output.write")
+    def write_chat_entry(self, chat_entry: ChatEntry, room: Optional[int] = None):
+        with self._lock:
+            self._write_record("chat_entry", chat_entry.to_json(self._prompt_nodes), room)
+
+    @hook_point("output.write")
+    def write_survey_question(self, survey_question: SurveyQuestion, room: Optional[int] = None):
+        with self._lock:
+            self._write_record("survey_question", survey_question.to_json(self._prompt_nodes), room)
+
+    def read(self) -> dict | List[dict]:
+        """The records written so far, in the json layout of `ExperimentOutput.to_json` (see `read_stream`)."""
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+        return read_stream(self.path)
+
+    def close(self):
+        with self._lock:
+            if self._file is None:
+                return
+            self.sync()
+            self._file.close()
+            self._file = None
+
+    def __enter__(self) -> JsonlOutputSink:
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class RoomOutputSink:
+    """The records of a room of a batch run, written to the stream shared by all the rooms."""
+
+    def __init__(self, sink: JsonlOutputSink, room: int):
+        self.sink = sink
+        self.room = room
+
+    def write_chat_entry(self, chat_entry: ChatEntry):
+        self.sink.write_chat_entry(chat_entry, room=self.room)
+
+    def write_survey_question(self, survey_question: SurveyQuestion):
+        self.sink.write_survey_question(survey_question, room=self.room)
+
+    def read(self) -> dict:
+        outputs = self.sink.read()
+        if isinstance(outputs, list) and self.room < len(outputs):
+            return outputs[self.room]
+        return {"chat_entry": [], "survey_question": []}
+
+
+@hook_point("output.write", lambda path, *args, **kwargs: {"path": path})
+def atomic_write_json(path: str, obj: Any, pretty: bool = True):
+    """Writes `obj` as json to `path` through a temporary file, so `path` is either complete or untouched."""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    pp_dict = {"indent": 4} if pretty else {}
+    # a unique temporary file, in case another write of `path` is interrupted by this one (e.g. from a signal handler)
+    fd, tmp_path = tempfile.mkstemp(dir=directory or ".", prefix=f"{os.path.basename(path)}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as file:
+            json.dump(obj, file, default=_default, **pp_dict, ensure_ascii=False)
+            file.flush()
+            os.fsync(file.fileno())
+        # mkstemp creates the file readable by the owner only
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _prompt_node_ids(data: dict) -> List[str]:
+    """The ids of the prompt nodes a chat entry or survey question record refers to."""
+    entries = data.get("chat_entry", data) if "question_id" in data else data
+    ids = []
+    for entry in entries if isinstance(entries, list) else [entries]:
+        prompt = entry.get("prompt") if isinstance(entry, dict) else None
+        if isinstance(prompt, dict) and prompt.get("node") is not None:
+            ids.append(prompt["node"])
+    return ids
+
+
+def _room_output(records: Dict[str, list], prompt_nodes: Dict[str, dict]) -> dict:
+    """The output of a room of a batch run, with the prompt nodes its records refer to."""
+    output = {"chat_entry": records["chat_entry"], "survey_question": records["survey_question"]}
+    used = {}
+    for data in (*records["chat_entry"], *records["survey_question"]):
+        for node_id in _prompt_node_ids(data):
+            while node_id is not None and node_id not in used:
+                used[node_id] = prompt_nodes[node_id]
+                node_id = prompt_nodes[node_id]["parent"]
+    if used:
+        # parents first, as in `ExperimentOutput.to_json`
+        output["prompt_nodes"] = {node_id: used[node_id] for node_id in prompt_nodes if node_id in used}
+    return output
+
+
+def read_stream(path: str) -> dict | List[dict]:
+    """
+    Rebuilds the json layout of `ExperimentOutput.to_json` from a stream file, or the list of the outputs of
+    the rooms for the stream of a batch run.
+    A truncated last line (the process died while writing it) is ignored.
+    """
+    output = {"chat_entry": [], "survey_question": []}
+    rooms: Dict[int, Dict[str, list]] = {}
+    prompt_nodes = {}
+    with open(path, "r", encoding="utf-8") as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                break
+            record_type = record.pop("type")
+            if record_type == "prompt_node":
+                prompt_nodes[record.pop("id")] = record
+            elif "room" in record:
+                room = rooms.setdefault(record["room"], {"chat_entry": [], "survey_question": []})
+                room[record_type].append(record["data"])
+            else:
+                output[record_type].append(record["data"])
+    if rooms:
+        return [_room_output(rooms.get(room, {"chat_entry": [], "survey_question": []}), prompt_nodes)
+                for room in range(max(rooms) + 1)]
+    if prompt_nodes:
+        output["prompt_nodes"] = prompt_nodes
+    return output
+
+
+def finalize(stream: str, output_path: str, pretty: bool = True, remove_stream: bool = True):
+    """Writes the output file of a stream (atomically), in the layout written by main.py."""
+    atomic_write_json(output_path, read_stream(stream), pretty=pretty)
+    if remove_stream:
+        os.remove(stream)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Rebuild the output json of a (crashed) run from its stream file")
+    parser.add_argument("stream", help="<output>.stream.jsonl file")
+    parser.add_argument("-o", "--output", help="Defaults to the stream path without the .stream.jsonl suffix")
+    parser.add_argument("--pretty-print", "-pp", dest="pp", action=argparse.BooleanOptionalAction, default=True)
+    args = parser.parse_args()
+    finalize(args.stream, args.output or args.stream.removesuffix(".stream.jsonl"), pretty=args.pp,
+             remove_stream=False)
@@ -1,5 +1,5 @@
 from __future__ import annotations
-from typing import TYPE_CHECKING
+from typing import Dict, Optional, TYPE_CHECKING
 from dataclasses import dataclass
 
 if TYPE_CHECKING:
@@ -13,3 +13,14 @@ class SurveyQuestion:
     iteration:int
     chat_entry:list[ChatEntry]
 
+    def to_json(self, prompt_nodes: Optional[Dict[str, dict]] = None) -> dict:
+        return {
+            "question_id": self.question_id,
+            "question_content": self.question_content,
+            "iteration": self.iteration,
+            "chat_entry": self.chat_entry.to_json(prompt_nodes) if hasattr(self.chat_entry, "to_json")
+            else self.chat_entry,
+        }
+
+    def __json__(self):
+        return self.to_json()
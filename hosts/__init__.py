@@ -1,20 +1,20 @@
 from __future__ import annotations
 from functools import cache
-from typing import Type
+from pkgutil import resolve_name
+from typing import Type, TYPE_CHECKING
 
-import hosts.host
-import hosts.random
-import hosts.round_robin
+if TYPE_CHECKING:
+    import hosts.host
 
 @cache
-def get_hosts()-> dict[str,Type[hosts.host.Host]]:
+def get_hosts()-> dict[str, str]:
+    """The hosts by name, as "module:class" paths imported on first use."""
     return {
-        hosts.round_robin.HostRoundRobin.NAME: hosts.round_robin.HostRoundRobin,
-        hosts.random.HostRandom.NAME: hosts.random.HostRandom
+        "Round Robin Host": "hosts.round_robin:HostRoundRobin",
+        "random": "hosts.random:HostRandom",
     }
 
 @cache
 def get_host_class(name: str) -> Type[hosts.host.Host]:
     known_hosts = get_hosts()
-    return known_hosts.get(name)
-
+    return resolve_name(known_hosts[name]) if name in known_hosts else None
@@ -22,3 +22,15 @@ class Host(ABC):
     @abstractmethod
     def get_curr_person_and_move_to_next(self) -> Person|BatchedPerson:
         raise NotImplementedError("This function not implemented")
+
+    def get_state(self) -> dict:
+        """
+        Returns the json serializable state of the host, used to checkpoint a running session.
+        """
+        return {"current_person_index": self.persons.index(self.current_person)}
+
+    def set_state(self, state: dict):
+        """
+        Restores the state returned by `get_state`.
+        """
+        self.current_person = self.persons[state["current_person_index"]]
@@ -25,5 +25,9 @@ class HostRoundRobin(Host):
         self.current_person = self.persons[self.current_person_index]
         return current_person
 
+    def set_state(self, state: dict):
+        super().set_state(state)
+        self.current_person_index = state["current_person_index"]
+
 
 
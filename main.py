@@ -2,6 +2,8 @@ from __future__ import annotations
 
 import logging
 import json
+import os
+import signal
 import warnings
 from datetime import datetime
 from pathlib import Path
@@ -13,7 +15,13 @@ import json_fix
 
 from experiments.batch_experiment import BatchExperiment
 from experiments.experiment import Experiment
+from experiments.hooks import ChromeTracer, add_hook
+from experiments.output_sink import JsonlOutputSink, atomic_write_json, finalize, stream_path
 from experiments.loggers.logger import ConsoleHandler, CsvFileHandler, OurLogger
+from persons.call_stats import output_call_stats, summarize_stats
+from persons.rate_limiter import limiter_metrics
+from persons.response_cache import response_cache_metrics
+from session_rooms.checkpoint import close_run_outputs, flush_on_sigterm, open_run_outputs
 
 
 def __init_logging_system(
@@ -69,9 +77,10 @@ def _arguments_parsing():
     parser.add_argument(
         "-o",
         "--output",
-        type=argparse.FileType(mode="w"),
+        type=str,
         default=str(Path("./output_files/out.json")),
-        help="Where to save the experiment output"
+        help="Where to save the experiment output. While running, the records are streamed to "
+             "<output>.stream.jsonl, which is turned into the output file at the end"
     )
     parser.add_argument(
         "--json",
@@ -120,6 +129,50 @@ def _arguments_parsing():
         default=True,
         help="Prints the results in pretty json format with indentation"
     )
+    parser.add_argument(
+        "--full-prompts",
+        dest="full_prompts",
+        action=argparse.BooleanOptionalAction,
+        default=False,
+        help="Write every prompt as its full message list instead of the compact shared form"
+    )
+    parser.add_argument(
+        "--resume",
+        action=argparse.BooleanOptionalAction,
+        default=False,
+        help="Continue an interrupted run from the checkpoint next to the output (<output>.checkpoint)"
+    )
+    parser.add_argument(
+        "--checkpoint-interval",
+        dest="checkpoint_interval",
+        type=float,
+        default=30.0,
+        help="The least seconds between two checkpoints, 0 for every turn and survey (the last state is also "
+             "saved on SIGTERM and at the end of the run)"
+    )
+    parser.add_argument(
+        "--limiter-metrics",
+        dest="limiter_metrics",
+        action=argparse.BooleanOptionalAction,
+        default=False,
+        help="Print the metrics of the LLM rate limiters (window, throttling, retries) at the end of the run"
+    )
+    parser.add_argument(
+        "--call-stats",
+        dest="call_stats",
+        nargs="?",
+        const="-",
+        default=None,
+        help="Print the tokens, latency percentiles and attempts of the model calls per person and endpoint "
+             "at the end of the run, or write them as json to the given path"
+    )
+    parser.add_argument(
+        "--trace",
+        type=str,
+        default=None,
+        help="Write a Chrome trace of the run (prompts, LLM calls, outputs and logs) to this path, "
+             "to open in chrome://tracing or https://ui.perfetto.dev"
+    )
     parser.add_argument(
         "-v",
         "--verbose",
@@ -148,6 +201,10 @@ if __name__ == '__main__':
     logger.info(f"open config from {arguments.config.name}")
     # with open(conf_path, 'r') as file:
     conf_json = json.load(arguments.config)
+    tracer = None
+    if arguments.trace:
+        tracer = ChromeTracer()
+        add_hook(tracer)
     logger.debug(f"Loaded {conf_json}")
     logger.info("Creating experiment object")
     experiment_cls = Experiment if not arguments.batch_mode else BatchExperiment
@@ -159,34 +216,82 @@ if __name__ == '__main__':
         exit(-1)
     logger.info("running experiment")
     experiment_output = None
+    # the records are streamed as they are produced, a crashed run keeps them (see experiments.output_sink)
+    if arguments.batch_mode:
+        # the batch rooms aren't checkpointed
+        sink = JsonlOutputSink(stream_path(arguments.output), full_prompts=arguments.full_prompts)
+        exp.session_room.output_sink = sink
+        checkpointer = None
+    else:
+        # the state is checkpointed along the stream, an interrupted run can continue with --resume
+        sink, checkpointer = open_run_outputs(exp.session_room, arguments.output, full_prompts=arguments.full_prompts,
+                                              resume=arguments.resume, checkpoint_interval=arguments.checkpoint_interval)
+    previous_sigterm_handler = flush_on_sigterm(checkpointer) if checkpointer is not None else None
     try:
         experiment_output = exp.run()
     except Exception:
         logger.exception("Unhandled exception while running experiment")
+    finally:
+        if previous_sigterm_handler is not None:
+            signal.signal(signal.SIGTERM, previous_sigterm_handler)
+        if checkpointer is not None:
+            checkpointer.write()
+        sink.close()
     if experiment_output:
-        pp_dict = {"indent": 4} if arguments.pp else {}
-        
-        json.dump(experiment_output, arguments.output, **pp_dict, ensure_ascii=False)
-
-        surveyQuestions = experiment_output.survey_question
+        if isinstance(experiment_output, list):
+            # batch experiments return one output per room: the list of the outputs of the rooms, from the stream shared by the rooms
+            finalize(sink.path, arguments.output, pretty=arguments.pp)
+        else:
+            # a resumed run only holds the records of this process, the output file is built from the whole stream
+            close_run_outputs(sink, checkpointer, output_path=arguments.output, pretty=arguments.pp)
 
+        # from the output file, the records of the run aren't kept in memory
+        with open(arguments.output, "r", encoding="utf-8") as output_file:
+            outputs = json.load(output_file)
 
         # for each agent get all the answers
         answers = {}
-        for surveyQuestion in surveyQuestions:
-            chat_entries = surveyQuestion.chat_entry
-            # If chat_entries is not a list, make it a list
-            if not isinstance(chat_entries, list):
-                chat_entries = [chat_entries]
-            for chat_entry in chat_entries:
-                name = chat_entry.entity.name
-                answer = chat_entry.answer
-                if name not in answers:
-                    answers[name] = []
-                answers[name].append(answer)
+        for output in outputs if isinstance(outputs, list) else [outputs]:
+            for surveyQuestion in output["survey_question"]:
+                chat_entries = surveyQuestion["chat_entry"]
+                # If chat_entries is not a list, make it a list
+                if not isinstance(chat_entries, list):
+                    chat_entries = [chat_entries]
+                for chat_entry in chat_entries:
+                    entity = chat_entry["entity"]
+                    name = entity.get("name") if isinstance(entity, dict) else entity
+                    answer = chat_entry["answer"]
+                    if name not in answers:
+                        answers[name] = []
+                    answers[name].append(answer)
 
 
         
         print("Survey Answers:")
         for name, ans in answers.items():
             print(f"{name}: {ans}") 
+
+    if arguments.call_stats and os.path.exists(arguments.output):
+        # from the output file, which also holds the records of the previous processes of a resumed run
+        with open(arguments.output, "r", encoding="utf-8") as output_file:
+            call_stats = summarize_stats(output_call_stats(json.load(output_file)))
+        if arguments.call_stats == "-":
+            print("Model calls:")
+            print(json.dumps(call_stats, indent=4))
+        else:
+            atomic_write_json(arguments.call_stats, call_stats)
+
+    if arguments.limiter_metrics:
+        print("Rate limiters:")
+        print(json.dumps(limiter_metrics(), indent=4))
+
+    for cache_path, cache_metrics in response_cache_metrics().items():
+        print(f"Response cache {cache_path}: {cache_metrics['hits']} hits, {cache_metrics['deduplicated']} "
+              f"deduplicated, {cache_metrics['misses']} misses (hit rate {cache_metrics['hit_rate']})")
+
+    if tracer is not None:
+        # the log records still queued are written first, so that their spans are in the trace
+        for handler in logger.handlers:
+            handler.flush()
+        tracer.write(arguments.trace)
+        print(f"Trace written to {arguments.trace}")
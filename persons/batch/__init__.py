@@ -1,10 +1,10 @@
 from __future__ import annotations
-from typing import Type
 from functools import cache
-from .batch_person import BatchedPerson
 
 
 @cache
-def get_batch_dict() -> dict[str, Type[BatchedPerson]]:
+def get_batch_dict() -> dict[str, str]:
+    """The batch persons by type, as "module:class" paths (see `persons.get_person_class`)."""
     return {
+        "batched_person_vllm": "persons.batch.batched_person_vllm:BatchedPersonVLLM",
     }
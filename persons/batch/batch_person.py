@@ -33,18 +33,26 @@ class BatchedPerson(ABC):
         self.background_stories = background_stories
         self.names = names
         self.tag = tag
+        # The background stories addressed to the person ("You ..."), the background stories by default
+        self.you_background_stories: list[str] = kwargs.get("you_background_stories") or background_stories
         if len(background_stories) != len(names):
             raise ValueError("Each batch person must have the same number of stories and names")
+        if len(self.you_background_stories) != len(names):
+            raise ValueError("Each batch person must have the same number of you background stories and names")
 
     @property
     def batch_count(self) -> int:
         return len(self.background_stories)
 
+    def prewarm(self):
+        """Same as `Person.prewarm`, for the whole batch."""
+
     @abstractmethod
     def generate_answer(
             self, experiment_scenario: str, chat_lists: BatchChatList,*args,**kwargs) -> list[ChatEntry]:
         """
         Receives the current session state and returns the next ChatEntry for each
-        of the chat lists in `chat_lists`.
+        of the chat lists in `chat_lists` (in the same order).
+        The chat lists can be `ChatSnapshot` views, which should be treated as read only sequences.
         """
         raise NotImplementedError()
@@ -0,0 +1,86 @@
+"""
+This file contains the native batch version of `PersonVLLM`, for OpenAI compatible endpoints (vLLM).
+"""
+
+from __future__ import annotations
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING
+
+from persons.call_stats import CallStats
+from persons.http_clients import get_client
+from persons.person_vllm import PersonVLLM
+from session_rooms.ChatEntry import ChatEntry
+from .batch_person import BatchedPerson
+
+if TYPE_CHECKING:
+    from session_rooms.ChatEntry import BatchChatList
+
+log = logging.getLogger(__name__)
+
+
+class BatchedPersonVLLM(BatchedPerson):
+    """
+    Answers for the person of every room of a `BatchSessionRoom` at once.
+
+    Each room keeps its own `PersonVLLM` (the prompt caches follow a single conversation), but they
+    share one client, so one connection pool and the rate limiter of the endpoint.
+    The prompts of all the rooms are built first and then sent concurrently, or as a single
+    `/v1/completions` request when a "chat_template" is configured (see `PersonVLLM`).
+    """
+    PERSON_TYPE = "batched_person_vllm"
+
+    def __init__(self,
+                 background_stories: list[str],
+                 names: list[str],
+                 tag: str,
+                 prompt_version: str = "v0",
+                 max_workers: int = 64,
+                 *args, **kwargs):
+        """
+        :param prompt_version: of the prompts, when not given on each call
+        :param max_workers: upper bound of the requests in flight for this batch (the rate limiter of the
+                            endpoint can lower it further)
+        """
+        super().__init__(background_stories, names, tag,
+                         you_background_stories=kwargs.pop("you_background_stories", None))
+        api_base = kwargs.get("vllm_api_base", "http://localhost:8001/v1")
+        self.client = kwargs.pop("client", None) or get_client(api_base, "EMPTY", **(kwargs.get("http_client") or {}))
+        self.max_workers = max_workers
+        self.persons_instances: list[PersonVLLM] = [
+            PersonVLLM(story, you_story, name, prompt_version, client=self.client, **kwargs)
+            for story, you_story, name in zip(self.background_stories, self.you_background_stories, self.names)
+        ]
+
+    def prewarm(self):
+        # every room uses the same client
+        self.persons_instances[0].prewarm()
+
+    def generate_answer(self, experiment_scenario: str, chat_lists: BatchChatList,
+                        prompt_version: str | None = None, is_questionnaire: bool = False,
+                        *args, **kwargs) -> list[ChatEntry]:
+        prompts = [
+            person.create_prompt(experiment_scenario, chat_list,
+                                 prompt_version or person.prompt_version, is_questionnaire)
+            for person, chat_list in zip(self.persons_instances, chat_lists)
+        ]
+        # Every room uses the same endpoint and model, the first person sends the batched request
+        first = self.persons_instances[0]
+        if len(prompts) > 1 and first._chat_template_tokenizer() is not None:
+            # a single request, its stats are shared by the answers
+            stats = [CallStats(first.api_base, batch_size=len(prompts))] * len(prompts)
+            answers = [
+                person._clean_answer(text)
+                for person, text in zip(self.persons_instances, first._complete_prompts(prompts, stats[0]))
+            ]
+        else:
+            stats = [CallStats(first.api_base) for _ in prompts]
+            with ThreadPoolExecutor(max_workers=max(1, min(self.max_workers, len(prompts))),
+                                    thread_name_prefix="batch-vllm") as executor:
+                answers = list(executor.map(lambda person, prompt, prompt_stats: person.evaluate(prompt, prompt_stats),
+                                            self.persons_instances, prompts, stats))
+        return [
+            ChatEntry(entity=person, prompt=prompt, answer=answer, stats=prompt_stats)
+            for person, prompt, answer, prompt_stats in zip(self.persons_instances, prompts, answers, stats)
+        ]
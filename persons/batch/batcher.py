@@ -17,14 +17,20 @@ class AutoBatchPerson(BatchedPerson):
                  person_class: Type[Person],
                  person_kwargs: dict = None,
                  *args, **kwargs):
-        super().__init__(background_stories, names, tag, )
+        super().__init__(background_stories, names, tag,
+                         you_background_stories=kwargs.pop("you_background_stories", None))
         p_kwargs = person_kwargs.copy() if person_kwargs else {}
         self.persons_instances = [
-            person_class(background_story=person_info[0], name=person_info[1], **{**kwargs, **p_kwargs, })
-            for person_info in zip(self.background_stories, self.names)]
+            person_class(background_story=story, you_background_story=you_story, name=name,
+                         **{**kwargs, **p_kwargs, })
+            for story, you_story, name in zip(self.background_stories, self.you_background_stories, self.names)]
+
+    def prewarm(self):
+        for person in self.persons_instances:
+            person.prewarm()
 
     def generate_answer(self, experiment_scenario: str, chat_lists: BatchChatList, *args, **kwargs) -> list[ChatEntry]:
         chat_entries = []
         for (person, chat_list) in zip(self.persons_instances, chat_lists):
-            chat_entries.append(person.generate_answer(experiment_scenario, chat_list))
+            chat_entries.append(person.generate_answer(experiment_scenario, chat_list, *args, **kwargs))
         return chat_entries
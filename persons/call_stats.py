@@ -0,0 +1,132 @@
+"""
+This file contains the accounting of the calls to the LLM endpoints.
+
+Every model backed `ChatEntry` carries the `CallStats` of the call that produced it (tokens, latency,
+time to first token, attempts), and `summarize_stats` aggregates them per person and per endpoint.
+"""
+
+from __future__ import annotations
+
+import math
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+
+@dataclass
+class CallStats:
+    endpoint: str
+    model: Optional[str] = None
+    prompt_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
+    # prompt tokens served from the prefix cache of the server, when it reports them
+    cached_tokens: Optional[int] = None
+    # seconds from the call to the response, including the waits of the rate limiter and the retries
+    latency: Optional[float] = None
+    # seconds from the call to the first generated token, only measured for streamed requests
+    ttft: Optional[float] = None
+    # requests sent, 0 when the response came from the response cache or an offline batch
+    attempts: int = 0
+    # prompts answered by the same request (batched completions), the tokens are those of the whole request
+    batch_size: int = 1
+    started: float = field(default_factory=time.monotonic, repr=False, compare=False)
+
+    def first_token(self):
+        if self.ttft is None:
+            self.ttft = time.monotonic() - self.started
+
+    def finish(self, response: Any):
+        """Records the latency and the usage reported in `response`."""
+        self.latency = time.monotonic() - self.started
+        usage = getattr(response, "usage", None)
+        if usage is None:
+            return
+        self.prompt_tokens = usage.prompt_tokens
+        self.completion_tokens = usage.completion_tokens
+        details = getattr(usage, "prompt_tokens_details", None)
+        if details is not None:
+            self.cached_tokens = details.cached_tokens
+
+    def to_json(self) -> dict:
+        stats = asdict(self)
+        del stats["started"]
+        return stats
+
+    def __json__(self):
+        return self.to_json()
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """Nearest rank percentile of `values` (sorted), None when empty."""
+    if not values:
+        return None
+    return values[max(0, math.ceil(q / 100 * len(values)) - 1)]
+
+
+class _Summary:
+    def __init__(self):
+        self.calls = 0
+        self.attempts = 0
+        self.prompt_tokens = 0.0
+        self.completion_tokens = 0.0
+        self.cached_tokens = 0.0
+        self.latencies: List[float] = []
+        self.ttfts: List[float] = []
+
+    def add(self, stats: dict):
+        self.calls += 1
+        # the tokens and attempts of a batched request are split between its prompts
+        batch_size = stats.get("batch_size") or 1
+        self.attempts += (stats.get("attempts") or 0) / batch_size
+        self.prompt_tokens += (stats.get("prompt_tokens") or 0) / batch_size
+        self.completion_tokens += (stats.get("completion_tokens") or 0) / batch_size
+        self.cached_tokens += (stats.get("cached_tokens") or 0) / batch_size
+        if stats.get("latency") is not None:
+            self.latencies.append(stats["latency"])
+        if stats.get("ttft") is not None:
+            self.ttfts.append(stats["ttft"])
+
+    def to_json(self) -> dict:
+        summary = {
+            "calls": self.calls,
+            "attempts": round(self.attempts),
+            "prompt_tokens": round(self.prompt_tokens),
+            "completion_tokens": round(self.completion_tokens),
+            "cached_tokens": round(self.cached_tokens),
+        }
+        for name, values in (("latency", self.latencies), ("ttft", self.ttfts)):
+            values.sort()
+            summary[name] = {f"p{q}": percentile(values, q) for q in (50, 95, 99)}
+        return summary
+
+
+def output_call_stats(outputs: dict | List[dict]) -> Iterator[Tuple[Optional[str], dict]]:
+    """
+    Yield the (person name, call stats) of every entry of an output (or of the outputs of a batch run),
+    in the layout written by main.py.
+    """
+    for output in outputs if isinstance(outputs, list) else [outputs]:
+        entries = list(output.get("chat_entry") or [])
+        for question in output.get("survey_question") or []:
+            chat_entry = question.get("chat_entry")
+            entries.extend(chat_entry if isinstance(chat_entry, list) else [chat_entry or {}])
+        for entry in entries:
+            if entry.get("stats"):
+                entity = entry.get("entity")
+                yield (entity.get("name") if isinstance(entity, dict) else entity), entry["stats"]
+
+
+def summarize_stats(call_stats: Iterable[Tuple[Optional[str], dict]]) -> Dict[str, Dict[str, dict]]:
+    """
+    Aggregates (person name, call stats) pairs per person and per endpoint, with the p50/p95/p99 of the
+    latency and of the time to first token.
+    """
+    persons: Dict[str, _Summary] = {}
+    endpoints: Dict[str, _Summary] = {}
+    for name, stats in call_stats:
+        persons.setdefault(str(name), _Summary()).add(stats)
+        endpoints.setdefault(stats["endpoint"], _Summary()).add(stats)
+    return {
+        "persons": {name: summary.to_json() for name, summary in persons.items()},
+        "endpoints": {endpoint: summary.to_json() for endpoint, summary in endpoints.items()},
+    }
@@ -0,0 +1,520 @@
+"""
+This file contains the shared base class of the persons that talk to an OpenAI compatible
+chat completion endpoint (vLLM, OpenRouter).
+"""
+
+from __future__ import annotations
+
+import logging
+import warnings
+from abc import ABC, abstractmethod
+from typing import Any, Awaitable, Callable, Dict, List, Literal, Sequence, Tuple, cast
+from openai.types import Completion
+from openai.types.chat import (
+    ChatCompletion,
+    ChatCompletionMessageParam,
+    ChatCompletionAssistantMessageParam as AssistantMessage,
+    ChatCompletionUserMessageParam as UserMessage,
+)
+from experiments.hooks import hook_point
+from persons import load_environment
+from persons.call_stats import CallStats
+from persons.context_window import ContextWindow
+from persons.person import Person
+from persons.http_clients import prewarm
+from persons.prompt_cache import PromptCache
+from persons.offline_batch import active_offline_batch
+from persons.rate_limiter import AdaptiveLimiter, get_rate_limiter
+from persons.response_cache import ResponseCache, get_response_cache
+from session_rooms.ChatEntry import ChatEntry
+from session_rooms.prompt_store import SharedPrompt
+from session_rooms.session_room import System
+
+log = logging.getLogger(__name__)
+
+load_environment()
+
+
+def _dump_response(response: Any) -> str | None:
+    """Only the responses holding an answer are cached."""
+    if not response or not response.choices:
+        return None
+    return response.model_dump_json()
+
+
+class _StreamedCompletion:
+    """Rebuilds the `ChatCompletion` of a streamed chat completion from its chunks."""
+
+    def __init__(self, stats: CallStats):
+        self.stats = stats
+        self.parts: List[str] = []
+        self.chunk: Any = None
+        self.finish_reason: str | None = None
+        self.usage: Any = None
+
+    def add(self, chunk: Any):
+        self.chunk = chunk
+        if chunk.usage is not None:
+            self.usage = chunk.usage
+        for choice in chunk.choices:
+            if choice.delta.content:
+                self.stats.first_token()
+                self.parts.append(choice.delta.content)
+            if choice.finish_reason:
+                self.finish_reason = choice.finish_reason
+
+    def result(self) -> ChatCompletion:
+        return ChatCompletion.model_validate({
+            "id": getattr(self.chunk, "id", ""),
+            "object": "chat.completion",
+            "created": getattr(self.chunk, "created", 0),
+            "model": getattr(self.chunk, "model", ""),
+            "choices": [{
+                "index": 0,
+                "finish_reason": self.finish_reason or "stop",
+                "message": {"role": "assistant", "content": "".join(self.parts)},
+            }],
+            "usage": self.usage.model_dump() if self.usage is not None else None,
+        })
+
+
+class ChatCompletionPerson(Person, ABC):
+    """
+    Base class for persons backed by a chat completion API.
+    Sub classes only need to provide the clients (`client`, `aclient`), the endpoint (`api_base`) and
+    the request parameters (`_request_kwargs`), building the prompt, calling the endpoint through the
+    process-wide rate limiter and parsing the answer is shared.
+    """
+    api_base: str
+    # The answers only depend on the prompt, the clients and the rate limiter are thread safe
+    CONCURRENT_CALLS = True
+
+    def __init__(
+        self,
+        background_story: str,
+        you_background_story: str,
+        name: str,
+        prompt_version: str = "v0",
+        *args,
+        **kwargs,
+    ):
+        super().__init__(background_story, you_background_story, name)
+        self.prompt_version = prompt_version
+        # Settings of the endpoint's `AdaptiveLimiter`, only the first person of an endpoint sets them
+        self._rate_limit_settings: dict = kwargs.get("rate_limit") or {}
+        # Settings of the endpoint's shared client (`http_clients.ClientSettings`), the first person sets them
+        self._http_client_settings: dict = kwargs.get("http_client") or {}
+        # Settings of the (opt-in) `ResponseCache`, injected from the "responseCache" of the configuration
+        self._response_cache_settings: dict | None = kwargs.get("response_cache")
+        self.seed: int | None = kwargs.get("seed")
+        if self._response_cache_settings and self.seed is None:
+            log.warning(f"The responses of {name} are cached without a seed: the repetitions of the experiment "
+                        f"will all replay the same answers, set a \"seed\" per repetition to sample new ones")
+        # Stream the chat completions, only to measure the time to first token of the calls (see `CallStats`)
+        self.stream: bool = kwargs.get("stream", False)
+        # Tokenizer whose chat template renders the prompts, so several of them can be sent as a single
+        # `/v1/completions` request (see `generate_answers`). A tokenizer name or "auto" for the model's one
+        self.chat_template: str | None = kwargs.get("chat_template")
+        # Unlike chat completions, the completions endpoint defaults to 16 tokens
+        self.completion_max_tokens: int = kwargs.get("completion_max_tokens", 512)
+        self._tokenizer = None
+        # Settings of the `ContextWindow` bounding the prompt tokens, the whole conversation is sent without it
+        self._context_window_settings: dict | None = kwargs.get("context_window")
+        self._context_window: ContextWindow | None = None
+        # Messages of the conversation so far, only the new entries are converted on each turn
+        self._prompt_cache = PromptCache(self._chat_entry_to_message,
+                                         self._count_entry_tokens if self._context_window_settings else None)
+        # The system messages only depend on (prompt_version, experiment_scenario, is_questionnaire)
+        self._prompt_setups_cache: Dict[Tuple[str, str, bool], List[ChatCompletionMessageParam]] = {}
+        self._prompt_setups_tokens: Dict[Tuple[str, str, bool], int] = {}
+
+    def generate_answer(
+        self,
+        experiment_scenario: str,
+        chat_list: List[ChatEntry],
+        prompt_version: str | None = None,
+        is_questionnaire: bool = False,
+    ) -> ChatEntry:
+        if prompt_version is None:
+            prompt_version = self.prompt_version
+        messages: SharedPrompt = self.create_prompt(
+            experiment_scenario, chat_list, prompt_version, is_questionnaire
+        )
+
+        stats = CallStats(self.api_base)
+        answer = self.evaluate(messages, stats)
+
+        return ChatEntry(entity=self, prompt=messages, answer=answer, stats=stats)
+
+    async def agenerate_answer(
+        self,
+        experiment_scenario: str,
+        chat_list: List[ChatEntry],
+        prompt_version: str | None = None,
+        is_questionnaire: bool = False,
+    ) -> ChatEntry:
+        if prompt_version is None:
+            prompt_version = self.prompt_version
+        messages: SharedPrompt = self.create_prompt(
+            experiment_scenario, chat_list, prompt_version, is_questionnaire
+        )
+
+        stats = CallStats(self.api_base)
+        answer = await self.aevaluate(messages, stats)
+
+        return ChatEntry(entity=self, prompt=messages, answer=answer, stats=stats)
+
+    def generate_answers(
+        self,
+        experiment_scenario: str,
+        chat_lists: Sequence[List[ChatEntry]],
+        prompt_version: str | None = None,
+        is_questionnaire: bool = False,
+    ) -> List[ChatEntry]:
+        """
+        Answers several chats in a single round-trip: as one `/v1/completions` request with the list of
+        prompts when a chat template is configured, otherwise as one chat completion request after the other
+        (the rooms dispatch the chats themselves then, see `batches_answers`).
+        """
+        if prompt_version is None:
+            prompt_version = self.prompt_version
+        prompts = [
+            self.create_prompt(experiment_scenario, chat_list, prompt_version, is_questionnaire)
+            for chat_list in chat_lists
+        ]
+        if len(prompts) > 1 and self._chat_template_tokenizer() is not None:
+            # a single request, its stats are shared by the answers
+            stats = [CallStats(self.api_base, batch_size=len(prompts))] * len(prompts)
+            answers = [self._clean_answer(text) for text in self._complete_prompts(prompts, stats[0])]
+        else:
+            stats = [CallStats(self.api_base) for _ in prompts]
+            answers = [self.evaluate(prompt, prompt_stats) for prompt, prompt_stats in zip(prompts, stats)]
+        return [ChatEntry(entity=self, prompt=prompt, answer=answer, stats=prompt_stats)
+                for prompt, answer, prompt_stats in zip(prompts, answers, stats)]
+
+    async def agenerate_answers(
+        self,
+        experiment_scenario: str,
+        chat_lists: Sequence[List[ChatEntry]],
+        prompt_version: str | None = None,
+        is_questionnaire: bool = False,
+    ) -> List[ChatEntry]:
+        if prompt_version is None:
+            prompt_version = self.prompt_version
+        prompts = [
+            self.create_prompt(experiment_scenario, chat_list, prompt_version, is_questionnaire)
+            for chat_list in chat_lists
+        ]
+        if len(prompts) > 1 and self._chat_template_tokenizer() is not None:
+            stats = [CallStats(self.api_base, batch_size=len(prompts))] * len(prompts)
+            answers = [self._clean_answer(text) for text in await self._acomplete_prompts(prompts, stats[0])]
+        else:
+            stats = [CallStats(self.api_base) for _ in prompts]
+            answers = [await self.aevaluate(prompt, prompt_stats) for prompt, prompt_stats in zip(prompts, stats)]
+        return [ChatEntry(entity=self, prompt=prompt, answer=answer, stats=prompt_stats)
+                for prompt, answer, prompt_stats in zip(prompts, answers, stats)]
+
+    @property
+    def batches_answers(self) -> bool:
+        return self._chat_template_tokenizer() is not None
+
+    def evaluate(self, messages: List[ChatCompletionMessageParam], stats: CallStats | None = None) -> str:
+        """Returns the answer to `messages`, the call is accounted in `stats` when given."""
+        return self._parse_answer(self._complete(messages, stats))
+
+    async def aevaluate(self, messages: List[ChatCompletionMessageParam], stats: CallStats | None = None) -> str:
+        return self._parse_answer(await self._acomplete(messages, stats))
+
+    def prewarm(self):
+        # opens the "prewarm" connections of the shared client, once per endpoint
+        prewarm(self.api_base, getattr(self, "api_key", None), **self._http_client_settings)
+
+    @property
+    def rate_limiter(self) -> AdaptiveLimiter:
+        return get_rate_limiter(self.api_base, **self._rate_limit_settings)
+
+    @property
+    def response_cache(self) -> ResponseCache | None:
+        if not self._response_cache_settings:
+            return None
+        return get_response_cache(**self._response_cache_settings)
+
+    @abstractmethod
+    def _request_kwargs(self, messages: Sequence[ChatCompletionMessageParam]) -> dict:
+        """
+        Returns the keyword arguments of `chat.completions.create` for `messages`.
+        """
+        raise NotImplementedError()
+
+    @staticmethod
+    def _estimate_tokens(request: dict) -> int:
+        """Rough estimation of the tokens of a request (4 characters per token), used by the rate limiter."""
+        if "messages" in request:
+            characters = sum(len(str(message.get("content") or "")) for message in request["messages"])
+            prompts = 1
+        else:
+            characters = sum(len(prompt) for prompt in request["prompt"])
+            prompts = len(request["prompt"])
+        return characters // 4 + (request.get("max_tokens") or 100) * prompts
+
+    def _record_usage(self, response: Any, estimated: int):
+        usage = getattr(response, "usage", None)
+        if usage is not None:
+            self.rate_limiter.record_tokens(usage.total_tokens, estimated)
+
+    def _request(self, messages: Sequence[ChatCompletionMessageParam]) -> dict:
+        request = self._request_kwargs(messages)
+        if self.seed is not None:
+            request.setdefault("seed", self.seed)
+        self._preflight(messages, request)
+        return request
+
+    @property
+    def context_window(self) -> ContextWindow | None:
+        if self._context_window is None and self._context_window_settings:
+            self._context_window = ContextWindow(**{"model": self._request_kwargs([])["model"],
+                                                    **self._context_window_settings})
+        return self._context_window
+
+    def _count_entry_tokens(self, chat_entry: ChatEntry) -> int:
+        return self.context_window.count_entry(chat_entry)
+
+    def _preflight(self, messages: Sequence[ChatCompletionMessageParam], request: dict):
+        """Raises `ContextOverflowError` instead of sending a prompt which can't fit in the context of the model."""
+        tokens = getattr(messages, "tokens", None)
+        if tokens is not None and self.context_window is not None:
+            self.context_window.check(tokens, request.get("max_tokens"))
+
+    def _attempt(self, create: Callable[..., Any], stats: CallStats) -> Callable[..., Any]:
+        """Wraps `create` to count the requests sent (one per attempt of the rate limiter) and stream them."""
+        def attempt(**request):
+            stats.attempts += 1
+            if not self.stream or "messages" not in request:
+                return create(**request)
+            streamed = _StreamedCompletion(stats)
+            for chunk in create(**request, stream=True, stream_options={"include_usage": True}):
+                streamed.add(chunk)
+            return streamed.result()
+        return attempt
+
+    def _aattempt(self, create: Callable[..., Awaitable[Any]], stats: CallStats) -> Callable[..., Awaitable[Any]]:
+        async def attempt(**request):
+            stats.attempts += 1
+            if not self.stream or "messages" not in request:
+                return await create(**request)
+            streamed = _StreamedCompletion(stats)
+            async for chunk in await create(**request, stream=True, stream_options={"include_usage": True}):
+                streamed.add(chunk)
+            return streamed.result()
+        return attempt
+
+    @hook_point("llm.call", lambda self, create, url, *args, **kwargs: {"person": self.name, "url": url})
+    def _call(self, create: Callable[..., Any], url: str, request: dict, load: Callable[[str], Any],
+              stats: CallStats | None = None) -> Any:
+        """
+        Sends `request` with `create` through the rate limiter (or reads the response from the cache).
+        In offline batch mode, the response comes from the results of the previous waves instead.
+        :param url: of the endpoint, as used in the batch files
+        :param stats: where the usage, latency and attempts of the call are recorded
+        """
+        stats = stats or CallStats(self.api_base)
+        stats.model = request.get("model")
+        offline = active_offline_batch()
+        if offline is not None:
+            response = offline.complete(self.api_base, url, request, load)
+            stats.finish(response)
+            return response
+
+        def send():
+            estimated = self._estimate_tokens(request)
+            response = self.rate_limiter.call(self._attempt(create, stats), tokens=estimated, **request)
+            self._record_usage(response, estimated)
+            return response
+
+        cache = self.response_cache
+        if cache is None:
+            response = send()
+        else:
+            response = cache.call(ResponseCache.key(self.api_base, request), send, _dump_response, load)
+        stats.finish(response)
+        return response
+
+    @hook_point("llm.call", lambda self, create, url, *args, **kwargs: {"person": self.name, "url": url})
+    async def _acall(self, create: Callable[..., Awaitable[Any]], url: str, request: dict,
+                     load: Callable[[str], Any], stats: CallStats | None = None) -> Any:
+        """
+        Same as `_call` for the asynchronous client.
+        """
+        stats = stats or CallStats(self.api_base)
+        stats.model = request.get("model")
+        offline = active_offline_batch()
+        if offline is not None:
+            response = offline.complete(self.api_base, url, request, load)
+            stats.finish(response)
+            return response
+
+        async def send():
+            estimated = self._estimate_tokens(request)
+            response = await self.rate_limiter.acall(self._aattempt(create, stats), tokens=estimated, **request)
+            self._record_usage(response, estimated)
+            return response
+
+        cache = self.response_cache
+        if cache is None:
+            response = await send()
+        else:
+            response = await cache.acall(ResponseCache.key(self.api_base, request), send, _dump_response, load)
+        stats.finish(response)
+        return response
+
+    def _complete(self, messages: Sequence[ChatCompletionMessageParam], stats: CallStats | None = None) -> Any:
+        """
+        Sends `messages` to the chat completion endpoint and returns the raw response.
+        """
+        return self._call(self.client.chat.completions.create, "/v1/chat/completions", self._request(messages),
+                          ChatCompletion.model_validate_json, stats)
+
+    async def _acomplete(self, messages: Sequence[ChatCompletionMessageParam], stats: CallStats | None = None) -> Any:
+        """
+        Same as `_complete` but using the asynchronous client.
+        """
+        return await self._acall(self.aclient.chat.completions.create, "/v1/chat/completions",
+                                 self._request(messages),
+                                 ChatCompletion.model_validate_json, stats)
+
+    # region batched completions
+    def _chat_template_tokenizer(self):
+        """The tokenizer rendering the prompts for the completions endpoint, None if there is no chat template."""
+        if self.chat_template is None:
+            return None
+        if self._tokenizer is None:
+            try:
+                from transformers import AutoTokenizer
+            except ImportError:
+                warnings.warn("transformers not installed, can't apply the chat template, "
+                              "the prompts are sent as separate chat completions")
+                self.chat_template = None
+                return None
+            name = self._request_kwargs([])["model"] if self.chat_template == "auto" else self.chat_template
+            self._tokenizer = AutoTokenizer.from_pretrained(name)
+        return self._tokenizer
+
+    def _completions_request(self, prompts: Sequence[Sequence[ChatCompletionMessageParam]]) -> dict:
+        tokenizer = self._chat_template_tokenizer()
+        request = self._request(prompts[0])
+        del request["messages"]
+        request.setdefault("max_tokens", self.completion_max_tokens)
+        for prompt in prompts:
+            self._preflight(prompt, request)
+        request["prompt"] = [
+            tokenizer.apply_chat_template(list(prompt), tokenize=False, add_generation_prompt=True)
+            for prompt in prompts
+        ]
+        return request
+
+    @staticmethod
+    def _split_completions(response: Any, count: int) -> List[str | None]:
+        """The text generated for each prompt of a batched completions response, in the order of the prompts."""
+        texts: List[str | None] = [None] * count
+        for choice in (response.choices if response else []):
+            texts[choice.index] = choice.text
+        return texts
+
+    def _complete_prompts(self, prompts: Sequence[Sequence[ChatCompletionMessageParam]],
+                          stats: CallStats | None = None) -> List[str | None]:
+        """
+        Sends every prompt in a single `/v1/completions` request, so the server schedules them (and their
+        shared prefix) together.
+        """
+        response = self._call(self.client.completions.create, "/v1/completions", self._completions_request(prompts),
+                              Completion.model_validate_json, stats)
+        return self._split_completions(response, len(prompts))
+
+    async def _acomplete_prompts(self, prompts: Sequence[Sequence[ChatCompletionMessageParam]],
+                                 stats: CallStats | None = None) -> List[str | None]:
+        response = await self._acall(self.aclient.completions.create, "/v1/completions",
+                                     self._completions_request(prompts),
+                                     Completion.model_validate_json, stats)
+        return self._split_completions(response, len(prompts))
+    # endregion
+
+    def _parse_answer(self, response: Any) -> str:
+        output = (response.choices[0].message.content or "") if response and response.choices else ""
+        return self._clean_answer(output)
+
+    def _clean_answer(self, output: str | None) -> str:
+        # remove the "Me: " prefix from the answer
+        return (
+            (output or "").strip().removeprefix("Me: ").removeprefix(f"{self.name}: ").strip()
+        )
+
+    # TODO: Choose the best prompt and prompt structure (should it all be in system?)
+    @hook_point("person.create_prompt", lambda self, *args, **kwargs: {"person": self.name})
+    def create_prompt(
+        self,
+        experiment_scenario: str,
+        chat_list: List[ChatEntry],
+        prompt_version: str,
+        is_questionnaire: bool = False,
+    ) -> SharedPrompt:
+        """
+        Creates a prompt with the past conversation in the format expected by OpenAI Chat API.
+        The returned conversation is a (read only, structurally shared) list of entries, which
+        follows the format described at
+        https://help.openai.com/en/articles/7042661-chatgpt-api-transition-guide.
+
+        In particular, the "role" property has 3 values, which we use as follows:
+            - "system": Only used in the first / last entries to set up the person instance identity.
+            - "assistant": Used for messages generated by the person instance.
+            - "user": Used for messages generated by other persons. Each entry can consist of
+              messages from multiple persons, by concatenating the format "{name}: {content}\n".
+        """
+
+        system_key = (prompt_version, experiment_scenario, is_questionnaire)
+        prompt_setups = self._prompt_setups_cache.get(system_key)
+        if prompt_setups is None:
+            assert prompt_version in [
+                "v0",
+                "v1",
+                "v2",
+            ], f"Unknown prompt version {prompt_version}. Please use v0, v1 or v2."
+            prompt_version_literal: Literal["v0", "v1", "v2"] = cast(
+                Literal["v0", "v1", "v2"], prompt_version
+            )
+            prompt_setups = super().prompt_setups(
+                experiment_scenario=experiment_scenario,
+                prompt_version=prompt_version_literal,
+                is_questionnaire=is_questionnaire,
+            )
+            self._prompt_setups_cache[system_key] = prompt_setups
+
+        # The survey question is not part of the conversation, so it must not be kept in the cache
+        context_window = self.context_window
+        if context_window is None:
+            return SharedPrompt(prompt_setups, self._prompt_cache.messages(chat_list, commit=not is_questionnaire))
+
+        # Only the most recent turns fitting in the budget are sent, the survey question being the last entry
+        setups_tokens = self._prompt_setups_tokens.get(system_key)
+        if setups_tokens is None:
+            setups_tokens = self._prompt_setups_tokens[system_key] = context_window.count_messages(prompt_setups)
+        start, node, tokens = self._prompt_cache.window(chat_list, context_window.budget(setups_tokens),
+                                                        context_window.keep_ratio, commit=not is_questionnaire)
+        if start:
+            return SharedPrompt(context_window.with_note(prompt_setups, start), node,
+                                setups_tokens + context_window.note_tokens + tokens)
+        return SharedPrompt(prompt_setups, node, setups_tokens + tokens)
+
+    def _chat_entry_to_message(self, chat_entry: ChatEntry) -> ChatCompletionMessageParam:
+        if isinstance(chat_entry.entity, System):  # System message
+            return UserMessage(role="user", content=chat_entry.answer)
+        elif chat_entry.entity.name == self.name:  # This person's message
+            return AssistantMessage(
+                role="assistant",
+                content=f"{chat_entry.answer}\n",
+            )
+        else:  # Other person's message
+            # Concatenate the name and content of the other person's message
+            return UserMessage(
+                role="user",
+                content=f"{chat_entry.answer}\n",
+            )
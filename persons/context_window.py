@@ -0,0 +1,123 @@
+"""
+This file contains the token budget of the prompts of the chat completion persons (the "context_window"
+setting of a person).
+
+The tokens of the entries are counted once with a local tokenizer (the model's one by default, needs
+transformers, otherwise estimated from the characters) and cached in the `ChatEntry`, so the window of the
+conversation that fits the budget is found without re-tokenizing the history. The prompts keep the system
+message, the survey question and the most recent turns, the older turns are dropped (see `PromptCache.window`).
+"""
+
+from __future__ import annotations
+
+import warnings
+from functools import cache
+from typing import Any, Dict, List, Optional, Sequence, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from openai.types.chat import ChatCompletionMessageParam
+    from session_rooms.ChatEntry import ChatEntry
+
+# Tokens of the chat template around the content of every message (role, separators)
+MESSAGE_OVERHEAD = 4
+
+
+class ContextOverflowError(ValueError):
+    """Raised instead of sending a request which can't fit in the context of the model."""
+
+
+@cache
+def _load_tokenizer(name: str):
+    """The tokenizers are shared by every person of the process, None when it can't be loaded."""
+    try:
+        from transformers import AutoTokenizer
+    except ImportError:
+        warnings.warn("transformers not installed, the tokens of the prompts are estimated (4 characters per token)")
+        return None
+    try:
+        return AutoTokenizer.from_pretrained(name)
+    except Exception as e:
+        warnings.warn(f"Unable to load the tokenizer {name} ({e}), the tokens of the prompts are estimated "
+                      f"(4 characters per token)")
+        return None
+
+
+def omitted_note(count: int) -> str:
+    """Appended to the system message when the first `count` messages of the conversation are left out."""
+    return f"\n(The first {count} messages of the conversation are not shown.)"
+
+
+class ContextWindow:
+    """
+    Token budget of the prompts of a person.
+    """
+
+    def __init__(self, max_tokens: int, reserved_tokens: int = 512, tokenizer: Optional[str] = "auto",
+                 keep_ratio: float = 0.75, model: Optional[str] = None):
+        """
+        :param max_tokens: the context length of the model
+        :param reserved_tokens: kept free for the answer
+        :param tokenizer: the tokenizer counting the tokens, "auto" for the one of `model`, None to estimate them
+        :param keep_ratio: when the conversation overflows, the oldest turns are dropped until it only takes this
+                           share of its budget. Dropping several turns at once keeps the prompt prefix (and the
+                           prefix cache of the server) unchanged during the following turns
+        """
+        if not 0 < keep_ratio <= 1:
+            raise ValueError(f"keep_ratio must be in (0, 1], got {keep_ratio}")
+        self.max_tokens = max_tokens
+        self.reserved_tokens = reserved_tokens
+        self.keep_ratio = keep_ratio
+        self.tokenizer_name: Optional[str] = model if tokenizer == "auto" else tokenizer
+        self._tokenizer = _load_tokenizer(self.tokenizer_name) if self.tokenizer_name else None
+        # the counts cached in the entries are those of a tokenizer
+        self.key = self.tokenizer_name if self._tokenizer is not None else "estimate"
+        self.note_tokens = self.count_text(omitted_note(10 ** 9))
+        if self.reserved_tokens + self.note_tokens >= self.max_tokens:
+            raise ValueError(f"The context window ({max_tokens} tokens) is smaller than the reserved tokens")
+
+    def count_text(self, text: str) -> int:
+        """Tokens of a message with the content `text`."""
+        if self._tokenizer is None:
+            return len(text) // 4 + MESSAGE_OVERHEAD
+        return len(self._tokenizer.encode(text, add_special_tokens=False)) + MESSAGE_OVERHEAD
+
+    def count_entry(self, chat_entry: ChatEntry) -> int:
+        counts = chat_entry.token_counts
+        count = counts.get(self.key)
+        if count is None:
+            count = counts[self.key] = self.count_text(chat_entry.answer or "")
+        return count
+
+    def count_messages(self, messages: Sequence[ChatCompletionMessageParam]) -> int:
+        return sum(self.count_text(str(message.get("content") or "")) for message in messages)
+
+    def budget(self, head_tokens: int) -> int:
+        """Tokens left to the conversation after the head of the prompt (system message and omitted note)."""
+        return self.max_tokens - self.reserved_tokens - head_tokens - self.note_tokens
+
+    def with_note(self, head: List[ChatCompletionMessageParam], omitted: int) -> List[ChatCompletionMessageParam]:
+        """The head of a prompt whose first `omitted` messages are left out."""
+        if not omitted or not head:
+            return head
+        first: Dict[str, Any] = dict(head[0])
+        first["content"] = f"{first.get('content') or ''}{omitted_note(omitted)}"
+        return [first, *head[1:]]
+
+    def check(self, prompt_tokens: int, max_tokens: Optional[int] = None):
+        """
+        Pre-flight check of a request, raises `ContextOverflowError` when it can't fit in the context.
+        :param max_tokens: of the request, if any
+        """
+        if prompt_tokens + (max_tokens or 0) > self.max_tokens:
+            raise ContextOverflowError(f"The prompt ({prompt_tokens} tokens, {max_tokens or 0} for the answer) "
+                                       f"exceeds the context window of {self.max_tokens} tokens")
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_tokenizer"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.key != "estimate":
+            self._tokenizer = _load_tokenizer(self.tokenizer_name)
@@ -13,7 +13,7 @@ class FakePerson(Person):
     PERSON_TYPE = "fake_person"
 
     def __init__(self, name: str, *args, **kwargs):
-        super().__init__("unused_background_story", name)
+        super().__init__("unused_background_story", "unused_you_background_story", name)
         assert "things_to_say" in kwargs, "You must tell a fake person exactly what to say."
         self.things_to_say = kwargs.get("things_to_say")
         self.things_to_say_idx = 0
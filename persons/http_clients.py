@@ -0,0 +1,140 @@
+"""
+This file contains the process-wide registry of the OpenAI clients used by the persons.
+
+A client (and so its connection pool) is shared by every person calling the same endpoint with the same
+API key, instead of one per person: the rooms of a process reuse the same keep-alive connections, with
+no extra TCP/TLS handshakes. The persons only keep a reference to the shared client.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, DefaultHttpxClient, OpenAI
+
+log = logging.getLogger(__name__)
+
+
+class ClientSettings:
+    """Connection pool limits and timeouts of the clients of an endpoint."""
+
+    def __init__(self, max_connections: int = 1000, max_keepalive_connections: int = 100,
+                 keepalive_expiry: float = 30.0, timeout: float = 600.0, connect_timeout: float = 5.0,
+                 prewarm: int = 0, *args, **kwargs):
+        """
+        :param max_connections: upper bound of the open connections of the pool
+        :param max_keepalive_connections: idle connections kept open for the next requests
+        :param keepalive_expiry: seconds after which an idle connection is closed, longer than the usual gap
+                                 between two turns so the connections survive it
+        :param timeout: of a request (read, write and waiting for a connection of the pool), in seconds
+        :param connect_timeout: of opening a connection, in seconds
+        :param prewarm: connections opened when the experiment is loaded (see `prewarm`)
+        """
+        self.limits = httpx.Limits(max_connections=max_connections,
+                                   max_keepalive_connections=max_keepalive_connections,
+                                   keepalive_expiry=keepalive_expiry)
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self.prewarm = prewarm
+
+
+# (base url, api key)
+_ClientKey = Tuple[str, str]
+
+__settings: Dict[_ClientKey, ClientSettings] = {}
+__clients: Dict[_ClientKey, OpenAI] = {}
+__http_clients: Dict[_ClientKey, httpx.Client] = {}
+# the asynchronous clients are bound to the event loop they were first used in
+__async_clients: Dict[Tuple[_ClientKey, asyncio.AbstractEventLoop], AsyncOpenAI] = {}
+__prewarmed: set[_ClientKey] = set()
+__clients_lock = threading.Lock()
+
+
+def _forget_clients():
+    # a forked process (e.g. a worker of run_iterations.py) must not reuse the keep-alive connections of its
+    # parent, the responses would be read by whichever process reads the socket first
+    global __clients_lock
+    __clients.clear()
+    __http_clients.clear()
+    __async_clients.clear()
+    __prewarmed.clear()
+    __clients_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_forget_clients)
+
+
+def _settings(key: _ClientKey, settings: dict) -> ClientSettings:
+    # called with the lock held, the settings of the first call win (as for the rate limiters)
+    if key not in __settings:
+        __settings[key] = ClientSettings(**settings)
+    return __settings[key]
+
+
+def get_client(base_url: str, api_key: Optional[str], **settings) -> OpenAI:
+    """
+    Returns the process-wide client of (`base_url`, `api_key`), creating it with `settings`
+    (see `ClientSettings`) on first use.
+    """
+    key = (base_url, api_key or "EMPTY")
+    with __clients_lock:
+        client = __clients.get(key)
+        if client is None:
+            client_settings = _settings(key, settings)
+            http_client = DefaultHttpxClient(limits=client_settings.limits, timeout=client_settings.timeout)
+            # retries are done by the rate limiter, so it can back off and adapt the concurrency
+            client = OpenAI(api_key=key[1], base_url=base_url, max_retries=0, timeout=client_settings.timeout,
+                            http_client=http_client)
+            __clients[key] = client
+            __http_clients[key] = http_client
+        return client
+
+
+def get_async_client(base_url: str, api_key: Optional[str], **settings) -> AsyncOpenAI:
+    """Asynchronous version of `get_client`, one client per event loop (must be called from a running loop)."""
+    key = (base_url, api_key or "EMPTY")
+    loop = asyncio.get_running_loop()
+    with __clients_lock:
+        client = __async_clients.get((key, loop))
+        if client is None:
+            # the clients of the loops that were closed (e.g. by the previous `asyncio.run`) can't be used anymore
+            for stale in [stale for stale in __async_clients if stale[1].is_closed()]:
+                del __async_clients[stale]
+            client_settings = _settings(key, settings)
+            client = AsyncOpenAI(api_key=key[1], base_url=base_url, max_retries=0, timeout=client_settings.timeout,
+                                 http_client=DefaultAsyncHttpxClient(limits=client_settings.limits,
+                                                                     timeout=client_settings.timeout))
+            __async_clients[(key, loop)] = client
+        return client
+
+
+def prewarm(base_url: str, api_key: Optional[str], **settings):
+    """
+    Opens `prewarm` connections (see `ClientSettings`) of the client of (`base_url`, `api_key`) so the
+    first turns don't pay the connection set up. Only done once per client, failures are ignored.
+    """
+    client = get_client(base_url, api_key, **settings)
+    key = (base_url, api_key or "EMPTY")
+    with __clients_lock:
+        connections = __settings[key].prewarm
+        if connections <= 0 or key in __prewarmed:
+            return
+        __prewarmed.add(key)
+        http_client = __http_clients[key]
+
+    def touch(_):
+        try:
+            # any answer leaves an open keep-alive connection in the pool
+            http_client.head(str(client.base_url))
+        except httpx.HTTPError as e:
+            log.debug(f"Unable to prewarm a connection to {base_url}: {e}")
+
+    # concurrent requests, each one needs its own connection
+    with ThreadPoolExecutor(max_workers=connections, thread_name_prefix="prewarm") as executor:
+        list(executor.map(touch, range(connections)))
+    log.info(f"Opened {connections} connections to {base_url}")
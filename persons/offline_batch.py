@@ -0,0 +1,194 @@
+"""
+This file contains the offline (wave-synchronous) batch mode of the chat completion persons.
+
+In this mode no request is sent to a server. The experiments are replayed from the results received so far:
+every request whose result is known is answered from the store, the first unknown one is recorded and
+stops the experiment (`PendingRequest`). After every experiment of a sweep was replayed, the recorded
+requests are written as one JSONL file in the OpenAI batch API format, to be processed offline (by the
+batch API, a batch inference job or `process_batch_file`). Its results file is ingested on the next wave,
+which advances every experiment by (at least) one more turn.
+
+All the state lives in the batch directory, so a sweep can be stopped and resumed at any wave boundary.
+"""
+
+from __future__ import annotations
+
+import glob
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional
+
+from persons.response_cache import ResponseCache
+
+log = logging.getLogger(__name__)
+
+
+class PendingRequest(BaseException):
+    """
+    Raised when a request has no result yet in offline batch mode.
+    It derives from BaseException so that the error handling of the persons (which turns failed calls
+    into empty answers) doesn't swallow it, the whole experiment must stop until the next wave.
+    """
+
+    def __init__(self, custom_id: str):
+        super().__init__(f"Request {custom_id} is waiting for the next batch")
+        self.custom_id = custom_id
+
+
+class OfflineRequestError(Exception):
+    """The offline batch returned an error for the request."""
+
+
+class OfflineBatch:
+    """
+    Results store and pending requests of the offline batch mode, backed by `batch_dir`:
+        - requests_<wave>.jsonl: the requests of each wave (OpenAI batch input format),
+        - results_<wave>.jsonl: their results (OpenAI batch output format), all of them are ingested.
+    """
+
+    def __init__(self, batch_dir: str):
+        os.makedirs(batch_dir, exist_ok=True)
+        self.batch_dir = batch_dir
+        self.results: Dict[str, dict] = {}
+        self.pending: Dict[str, dict] = {}
+        # Repetition of the experiment being replayed, it tells apart the requests without a seed
+        # (which would otherwise get the same id, and result, in every repetition)
+        self.repetition: Optional[int] = None
+        self._lock = threading.Lock()
+        for path in sorted(glob.glob(os.path.join(batch_dir, "results_*.jsonl"))):
+            self.ingest(path)
+
+    @property
+    def wave(self) -> int:
+        """The index of the next requests file."""
+        return len(glob.glob(os.path.join(self.batch_dir, "requests_*.jsonl")))
+
+    def unanswered_requests(self) -> Optional[str]:
+        """The requests file of the last wave if its results weren't received yet."""
+        if self.wave == 0:
+            return None
+        path = os.path.join(self.batch_dir, f"requests_{self.wave - 1:04d}.jsonl")
+        return None if os.path.exists(self.results_path(path)) else path
+
+    @staticmethod
+    def results_path(requests_path: str) -> str:
+        """The results file matching a requests file."""
+        directory, name = os.path.split(requests_path)
+        return os.path.join(directory, name.replace("requests_", "results_", 1))
+
+    def ingest(self, results_path: str) -> int:
+        """Adds the results of `results_path` to the store, returns how many were read."""
+        count = 0
+        with open(results_path, "r", encoding="utf-8") as file:
+            for line in file:
+                if line.strip():
+                    result = json.loads(line)
+                    self.results[result["custom_id"]] = result
+                    count += 1
+        log.info(f"Ingested {count} results from {results_path}")
+        return count
+
+    def request_id(self, base_url: str, request: dict) -> str:
+        """The custom_id of `request` in the batch files."""
+        if "seed" in request or self.repetition is None:
+            return ResponseCache.key(base_url, request)
+        return ResponseCache.key(base_url, {**request, "repetition": self.repetition})
+
+    def complete(self, base_url: str, url: str, request: dict, load: Callable[[str], Any]) -> Any:
+        """
+        Returns the response of `request` from the store, or records it and raises `PendingRequest`.
+        :param url: of the endpoint relative to `base_url` (e.g. "/v1/chat/completions")
+        """
+        custom_id = self.request_id(base_url, request)
+        result = self.results.get(custom_id)
+        if result is None:
+            with self._lock:
+                self.pending[custom_id] = {"custom_id": custom_id, "method": "POST", "url": url, "body": request}
+            raise PendingRequest(custom_id)
+        response = result.get("response") or {}
+        if result.get("error") or response.get("status_code", 200) != 200:
+            raise OfflineRequestError(f"Request {custom_id} failed in the batch: "
+                                      f"{result.get('error') or response.get('body')}")
+        return load(json.dumps(response["body"]))
+
+    def write_requests(self) -> Optional[str]:
+        """Writes the pending requests as the file of the next wave and returns its path (None if nothing is pending)."""
+        if not self.pending:
+            return None
+        path = os.path.join(self.batch_dir, f"requests_{self.wave:04d}.jsonl")
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            for request in self.pending.values():
+                file.write(json.dumps(request, ensure_ascii=False) + "\n")
+        os.replace(tmp_path, path)
+        self.pending = {}
+        return path
+
+    @contextmanager
+    def activate(self) -> Iterator[OfflineBatch]:
+        """Routes the requests of every chat completion person of the process to this store."""
+        global _active
+        previous, _active = _active, self
+        try:
+            yield self
+        finally:
+            _active = previous
+
+
+_active: Optional[OfflineBatch] = None
+
+
+def active_offline_batch() -> Optional[OfflineBatch]:
+    """The store requests are routed to, None when not in offline batch mode."""
+    return _active
+
+
+def process_batch_file(requests_path: str, results_path: str, base_url: str, api_key: str = "EMPTY",
+                       max_workers: int = 32) -> str:
+    """
+    Local stand-in of a batch job: sends every request of `requests_path` to the OpenAI compatible
+    server at `base_url` and writes the results in the batch output format to `results_path`.
+    """
+    import httpx
+
+    with open(requests_path, "r", encoding="utf-8") as file:
+        requests = [json.loads(line) for line in file if line.strip()]
+    root = base_url.rstrip("/").removesuffix("/v1")
+
+    with httpx.Client(timeout=httpx.Timeout(600.0, connect=10.0),
+                      headers={"Authorization": f"Bearer {api_key}"}) as client:
+        def run(request: dict) -> dict:
+            try:
+                response = client.post(root + request["url"], json=request["body"])
+                return {"custom_id": request["custom_id"], "error": None,
+                        "response": {"status_code": response.status_code, "body": response.json()}}
+            except Exception as e:
+                return {"custom_id": request["custom_id"], "response": None,
+                        "error": {"message": str(e)}}
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(run, requests))
+
+    tmp_path = f"{results_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as file:
+        for result in results:
+            file.write(json.dumps(result, ensure_ascii=False) + "\n")
+    os.replace(tmp_path, results_path)
+    return results_path
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Process an offline batch requests file against a local server")
+    parser.add_argument("requests", help="requests_<wave>.jsonl file")
+    parser.add_argument("--results", help="Output file, defaults to the matching results_<wave>.jsonl")
+    parser.add_argument("--base-url", default="http://localhost:8001/v1")
+    parser.add_argument("--workers", type=int, default=32)
+    args = parser.parse_args()
+    results_file = args.results or OfflineBatch.results_path(args.requests)
+    print(process_batch_file(args.requests, results_file, args.base_url, max_workers=args.workers))
@@ -1,18 +1,20 @@
 from __future__ import annotations
 
+import asyncio
 import copy
 import logging
 from abc import ABC, abstractmethod
-from typing import Any, Tuple, List, Union, Literal, Optional
-from openai.types.chat import (
-    ChatCompletionMessageParam,
-    ChatCompletionSystemMessageParam,
-)
+from typing import Any, Tuple, List, Union, Literal, Optional, Sequence
 
 # protect cyclic imports caused from typing
 from typing import TYPE_CHECKING
 
 if TYPE_CHECKING:
+    # only for the annotations, importing openai takes longer than the rest of the start up
+    from openai.types.chat import (
+        ChatCompletionMessageParam,
+        ChatCompletionSystemMessageParam,
+    )
     from session_rooms.ChatEntry import ChatEntry
 
 log = logging.getLogger(__name__)
@@ -20,6 +22,9 @@ log = logging.getLogger(__name__)
 
 class Person(ABC):
     PERSON_TYPE = None
+    # Whether the answers of a person can be generated from several threads (or tasks) at once. The persons
+    # with a state (replaying a script, asking a human, ...) can't, the session rooms call them one at a time
+    CONCURRENT_CALLS = False
 
     def __init__(self, background_story: str, you_background_story: str, name: str, *args, **kwargs):
         self.background_story: str = background_story
@@ -41,6 +46,69 @@ class Person(ABC):
         """
         raise NotImplementedError()
 
+    async def agenerate_answer(
+        self,
+        experiment_scenario: str,
+        chat_list: List[ChatEntry],
+        prompt_version: str,
+        is_questionnaire: bool = False,
+    ) -> Union[ChatEntry, None]:
+        """
+        Asynchronous version of `generate_answer`, used by the asynchronous session room.
+        By default, the blocking `generate_answer` is run in a worker thread, persons with a
+        native asynchronous backend should override it.
+        """
+        return await asyncio.to_thread(
+            self.generate_answer, experiment_scenario, chat_list, prompt_version, is_questionnaire
+        )
+
+    @property
+    def batches_answers(self) -> bool:
+        """
+        Whether `generate_answers` sends the chats in a single request. With "survey_batching", the rooms only
+        call it for these persons (and the stateful ones), the chats of the others are dispatched one by one
+        within the bound of the room (see `survey_workers`).
+        """
+        return False
+
+    def generate_answers(
+        self,
+        experiment_scenario: str,
+        chat_lists: Sequence[List[ChatEntry]],
+        prompt_version: str,
+        is_questionnaire: bool = False,
+    ) -> List[Union[ChatEntry, None]]:
+        """
+        Answers several independent chats at once (e.g. every survey question triggered at the same
+        iteration), returns the answers in the order of `chat_lists`.
+        By default, `generate_answer` is called for each chat, persons able to send them in a single
+        request should override it.
+        """
+        return [
+            self.generate_answer(experiment_scenario, chat_list, prompt_version, is_questionnaire)
+            for chat_list in chat_lists
+        ]
+
+    async def agenerate_answers(
+        self,
+        experiment_scenario: str,
+        chat_lists: Sequence[List[ChatEntry]],
+        prompt_version: str,
+        is_questionnaire: bool = False,
+    ) -> List[Union[ChatEntry, None]]:
+        """
+        Asynchronous version of `generate_answers`.
+        """
+        return await asyncio.to_thread(
+            self.generate_answers, experiment_scenario, chat_lists, prompt_version, is_questionnaire
+        )
+
+    def prewarm(self):
+        """
+        Called once when the experiment is loaded, before the first turn. Persons talking to a remote
+        endpoint can open their connections here, by default nothing is done.
+        """
+
     def __deepcopy__(self, memodict={}):
         log.debug("We don't allow deep copies of person")
         return copy.copy(self)
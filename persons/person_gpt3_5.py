@@ -5,6 +5,7 @@ import os
 import openai
 from typing import Dict, List, Tuple, Any
 
+from persons import load_environment
 from persons.person import Person
 from session_rooms.session_room import System
 
@@ -13,6 +14,7 @@ from typing import TYPE_CHECKING
 
 from session_rooms.ChatEntry import ChatEntry
 
+load_environment()
 
 
 class Person3_5(Person):
@@ -4,20 +4,14 @@ This file contains a Person implementation which utilises the OpenRouter API wit
 
 from __future__ import annotations
 import os
-from openai import OpenAI
-from typing import List, Literal, cast
-from openai.types.chat import (
-    ChatCompletionMessageParam,
-    ChatCompletionSystemMessageParam as SysMessage,
-    ChatCompletionAssistantMessageParam as AssistantMessage,
-    ChatCompletionUserMessageParam as UserMessage,
-)
-from persons.person import Person
-from session_rooms.ChatEntry import ChatEntry
-from session_rooms.session_room import System
+from openai import AsyncOpenAI, OpenAI
+from typing import List
+from openai.types.chat import ChatCompletionMessageParam
+from persons.chat_completion_person import ChatCompletionPerson
+from persons.http_clients import get_async_client, get_client
 
 
-class PersonOpenRouterCompletion(Person):
+class PersonOpenRouterCompletion(ChatCompletionPerson):
     PERSON_TYPE = "person_open_router_completion"
     MODEL_NAME = "openai/gpt-4o-mini"
     MODEL_NAME = "openai/gpt-4.1-mini"
@@ -43,82 +37,24 @@ class PersonOpenRouterCompletion(Person):
         *args,
         **kwargs,
     ):
-        super().__init__(background_story,you_background_story, name)
+        super().__init__(background_story, you_background_story, name, prompt_version, **kwargs)
 
         self.model_name = PersonOpenRouterCompletion.MODEL_NAME
-        self.client = OpenAI(
-            api_key=os.getenv("OPENROUTER_API_KEY"),
-            base_url="https://openrouter.ai/api/v1",
-        )
-
-    def generate_answer(
-        self,
-        experiment_scenario: str,
-        chat_list: List[ChatEntry],
-        prompt_version: str,
-        is_questionnaire: bool = False,
-    ):
-        generated_prompt: List[ChatCompletionMessageParam] = self.create_prompt(
-            experiment_scenario, chat_list, prompt_version, is_questionnaire
-        )
-
-        full_response = self.client.chat.completions.create(
-            model=self.model_name,
-            messages=generated_prompt,
-            max_tokens=100,
-            n=1,
-            temperature=0.1,
-        )
-        # Retrieve the generated response (updated for new OpenAI package)
-        output_text: str | None = full_response.choices[0].message.content
-        parsed_answer = output_text if output_text else ""
-
-        parsed_answer = (
-            parsed_answer.removeprefix("Me: ").removeprefix(f"{self.name}: ").strip()
-        )
-
-        return ChatEntry(entity=self, prompt=generated_prompt, answer=parsed_answer)
-
-    def create_prompt(
-        self,
-        experiment_scenario: str,
-        chat_list: List[ChatEntry],
-        prompt_version: str,
-        is_questionnaire: bool = False,
-    ) -> List[ChatCompletionMessageParam]:
-
-
-        assert prompt_version in [
-            "v0",
-            "v1",
-            "v2",
-        ], f"Unknown prompt version {prompt_version}. Please use v0, v1 or v2."
-        prompt_version_literal: Literal["v0", "v1", "v2"] = cast(
-            Literal["v0", "v1", "v2"], prompt_version
-        )
-        conversation: List[ChatCompletionMessageParam] = super().prompt_setups(
-            experiment_scenario=experiment_scenario,
-            prompt_version=prompt_version_literal,
-            is_questionnaire=is_questionnaire,
-        )
-
-        for chat_entry in chat_list:
-            if isinstance(chat_entry.entity, System):  # System message
-                conversation.append(UserMessage(role="user", content=chat_entry.answer))
-            elif chat_entry.entity.name == self.name:  # This person's message
-                conversation.append(
-                    AssistantMessage(
-                        role="assistant",
-                        content=f"{chat_entry.answer}\n",
-                    )
-                )
-            else:  # Other person's message
-                # Concatenate the name and content of the other person's message
-                conversation.append(
-                    UserMessage(
-                        role="user",
-                        content=f"{chat_entry.answer}\n",
-                    )
-                )
-
-        return conversation
+        self.api_base = "https://openrouter.ai/api/v1"
+        self.api_key = os.getenv("OPENROUTER_API_KEY")
+        # The client (and its connection pool) of the endpoint is shared by all the persons of the process
+        self.client: OpenAI = get_client(self.api_base, self.api_key, **self._http_client_settings)
+
+    @property
+    def aclient(self) -> AsyncOpenAI:
+        # The asynchronous client is bound to the running event loop
+        return get_async_client(self.api_base, self.api_key, **self._http_client_settings)
+
+    def _request_kwargs(self, messages: List[ChatCompletionMessageParam]) -> dict:
+        return {
+            "model": self.model_name,
+            "messages": list(messages),
+            "max_tokens": 100,
+            "n": 1,
+            "temperature": 0.1,
+        }
@@ -9,6 +9,7 @@ import os
 import openai
 from typing import List
 
+from persons import load_environment
 from persons.person import Person
 
 # Protect cyclic imports caused from typing
@@ -17,6 +18,7 @@ from typing import TYPE_CHECKING
 if TYPE_CHECKING:
     from session_rooms.ChatEntry import ChatEntry
 
+load_environment()
 
 
 class PersonOpenAiCompletion(Person):
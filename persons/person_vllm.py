@@ -1,22 +1,19 @@
+from __future__ import annotations
+
 import logging
-from typing import List, cast, Literal
-from openai import OpenAI
-from openai.types.chat import (
-    ChatCompletionMessageParam,
-    ChatCompletionSystemMessageParam as SysMessage,
-    ChatCompletionAssistantMessageParam as AssistantMessage,
-    ChatCompletionUserMessageParam as UserMessage,
-)
-from persons.person import Person
-from session_rooms.session_room import ChatEntry
-from session_rooms.session_room import System
-import time
+from typing import Any, List
+from openai import AsyncOpenAI, OpenAI
+from openai.types.chat import ChatCompletionMessageParam
+from persons.call_stats import CallStats
+from persons.chat_completion_person import ChatCompletionPerson
+from persons.context_window import ContextOverflowError
+from persons.http_clients import get_async_client, get_client
 
 
 log = logging.getLogger(__name__)
 
 
-class PersonVLLM(Person):
+class PersonVLLM(ChatCompletionPerson):
     PERSON_TYPE = "person_vllm"
 
     def __init__(
@@ -28,120 +25,67 @@ class PersonVLLM(Person):
         *args,
         **kwargs,
     ):
-        super().__init__(background_story,you_background_story, name)
+        super().__init__(background_story, you_background_story, name, prompt_version, **kwargs)
         self.api_base: str = kwargs.get("vllm_api_base", "http://localhost:8001/v1")
         
         # self.model: str = kwargs.get(
         #     "model", "mistralai/Mistral-Small-3.1-24B-Instruct-2503"
         # )
         self.model: str = kwargs.get("model", "openai/gpt-oss-120b")
-        self.client = OpenAI(
-            api_key="EMPTY",  # vLLM usually ignores this, but required by the client
-            base_url=self.api_base,
-        )
-
-        self.prompt_version = prompt_version
-
-    def generate_answer(
-        self,
-        experiment_scenario: str,
-        chat_list: list[ChatEntry],
-        prompt_version: str | None = None,
-        is_questionnaire: bool = False,
-    ):
-        if prompt_version is None:
-            prompt_version = self.prompt_version
-        messages: List[ChatCompletionMessageParam] = self.create_prompt(
-            experiment_scenario, chat_list, prompt_version, is_questionnaire
-        )
-        
-        answer = self.evaluate(messages)
-
-        return ChatEntry(entity=self, prompt=messages, answer=answer)
-
-    def evaluate(self, messages: List[ChatCompletionMessageParam], max_new_tokens=100):
-
-        cnt = 0
-        max_cnt = 3
-        response = None
-
-        while response is None:
-
-            
-            try:
-                response = self.client.chat.completions.create(
-                    model=self.model,
-                    messages=messages,
-                    n=1,
-                    temperature=0.1,
-                )
-            except Exception as e:
-                # wait for 2 seconds and try again
-                log.error(f"Error while calling vLLM API: {e}. Retrying...")
-                log.error(f"Messages: {messages}")
-                time.sleep(15)
-                cnt += 1
-
-                if cnt >= max_cnt:
-                    log.error(f"Failed to get response from vLLM API after {max_cnt} attempts.")
-                    break
-
-
-
-        output = (response.choices[0].message.content or "") if response.choices else ""
-        # remove the "Me: " prefix from the answer
-        return (
-            output.strip().removeprefix("Me: ").removeprefix(f"{self.name}: ").strip()
-        )
-
-    # TODO: Choose the best prompt and prompt structure (should it all be in system?)
-    def create_prompt(
-        self, experiment_scenario: str, chat_list: List[ChatEntry], prompt_version: str, is_questionnaire: bool = False
-    ) -> List[ChatCompletionMessageParam]:
-        """
-        Creates a prompt with the past conversation in the format expected by OpenAI Chat API.
-        The returned conversation is a list of entries, which follows the format described at
-        https://help.openai.com/en/articles/7042661-chatgpt-api-transition-guide.
-
-        In particular, the "role" property has 3 values, which we use as follows:
-            - "system": Only used in the first / last entries to set up the person instance identity.
-            - "assistant": Used for messages generated by the person instance.
-            - "user": Used for messages generated by other persons. Each entry can consist of
-              messages from multiple persons, by concatenating the format "{name}: {content}\n".
-        """
-
-        assert prompt_version in [
-            "v0",
-            "v1",
-            "v2",
-        ], f"Unknown prompt version {prompt_version}. Please use v0, v1 or v2."
-        prompt_version_literal: Literal["v0", "v1", "v2"] = cast(
-            Literal["v0", "v1", "v2"], prompt_version
-        )
-        conversation: List[ChatCompletionMessageParam] = super().prompt_setups(
-            experiment_scenario=experiment_scenario,
-            prompt_version=prompt_version_literal,
-            is_questionnaire=is_questionnaire,
-        )
-
-        for chat_entry in chat_list:
-            if isinstance(chat_entry.entity, System):  # System message
-                conversation.append(UserMessage(role="user", content=chat_entry.answer))
-            elif chat_entry.entity.name == self.name:  # This person's message
-                # person's message
-                conversation.append(
-                    AssistantMessage(
-                        role="assistant",
-                        content=f"{chat_entry.answer}\n",
-                    )
-                )
-            else:  # Other person's message
-                # Concatenate the name and content of the other person's message
-                conversation.append(
-                    UserMessage(
-                        role="user",
-                        content=f"{chat_entry.answer}\n",
-                    )
-                )
-
-        return conversation
+        # vLLM usually ignores the API key, but it is required by the client
+        self.api_key = "EMPTY"
+        # The client (and its connection pool) of the endpoint is shared by all the persons of the process
+        self.client: OpenAI = kwargs.get("client") or get_client(self.api_base, self.api_key,
+                                                                 **self._http_client_settings)
+
+    @property
+    def aclient(self) -> AsyncOpenAI:
+        # The asynchronous client is bound to the running event loop
+        return get_async_client(self.api_base, self.api_key, **self._http_client_settings)
+
+    def _request_kwargs(self, messages: List[ChatCompletionMessageParam]) -> dict:
+        return {
+            "model": self.model,
+            "messages": list(messages),
+            "n": 1,
+            "temperature": 0.1,
+        }
+
+    def _complete(self, messages: List[ChatCompletionMessageParam], stats: CallStats | None = None) -> Any:
+        try:
+            return super()._complete(messages, stats)
+        except ContextOverflowError:
+            # raised by the pre-flight check, an empty answer would hide that the prompt can't fit
+            raise
+        except Exception as e:
+            log.error(f"Failed to get response from vLLM API: {e}")
+            log.error(f"Messages: {list(messages)}")
+            return None
+
+    async def _acomplete(self, messages: List[ChatCompletionMessageParam], stats: CallStats | None = None) -> Any:
+        try:
+            return await super()._acomplete(messages, stats)
+        except ContextOverflowError:
+            raise
+        except Exception as e:
+            log.error(f"Failed to get response from vLLM API: {e}")
+            log.error(f"Messages: {list(messages)}")
+            return None
+
+    def _complete_prompts(self, prompts, stats: CallStats | None = None) -> List[str | None]:
+        try:
+            return super()._complete_prompts(prompts, stats)
+        except ContextOverflowError:
+            raise
+        except Exception as e:
+            log.error(f"Failed to get batched response from vLLM API: {e}")
+            return [None] * len(prompts)
+
+    async def _acomplete_prompts(self, prompts, stats: CallStats | None = None) -> List[str | None]:
+        try:
+            return await super()._acomplete_prompts(prompts, stats)
+        except ContextOverflowError:
+            raise
+        except Exception as e:
+            log.error(f"Failed to get batched response from vLLM API: {e}")
+            return [None] * len(prompts)
@@ -0,0 +1,139 @@
+"""
+This file contains the incremental prompt cache used by the chat completion persons.
+"""
+
+from __future__ import annotations
+
+import threading
+from bisect import bisect_left
+from typing import Callable, List, Optional, Sequence, Tuple, TYPE_CHECKING
+
+from session_rooms.prompt_store import PromptNode
+
+if TYPE_CHECKING:
+    from openai.types.chat import ChatCompletionMessageParam
+    from session_rooms.ChatEntry import ChatEntry
+
+
+class PromptCache:
+    """
+    Append-only view of the chat, as messages from the point of view of a single person.
+
+    The session room only ever appends to the chat, so each call only needs to convert the
+    `ChatEntry` objects added since the previous call. The cached messages are reused as long as the
+    given chat list is a pure extension of what was cached (checked by identity of the first and
+    last cached entries), otherwise the cache is rebuilt from scratch.
+
+    The messages are kept as a `PromptNode` chain, so the returned prompts share their prefix with
+    the prompts of the previous turns instead of copying it.
+
+    Calls with `commit=False` (used for the survey questions, which append a question that is not
+    part of the conversation) reuse the cache but never extend it.
+
+    With a token budget (`window`), only the most recent entries that fit in it are kept.
+    """
+
+    def __init__(self, to_message: Callable[[ChatEntry], ChatCompletionMessageParam],
+                 count_tokens: Optional[Callable[[ChatEntry], int]] = None):
+        """
+        :param count_tokens: counts the tokens of an entry, needed to get windows within a token budget
+        """
+        self._to_message = to_message
+        self._count_tokens = count_tokens
+        self._node: Optional[PromptNode] = None
+        # the node holds the messages of the entries from `_start` to `_seen` (excluded) of the chat
+        self._start: int = 0
+        self._seen: int = 0
+        # `_totals[i]` is the token count of the first i entries of the chat (only with `count_tokens`)
+        self._totals: List[int] = [0]
+        self._first: Optional[ChatEntry] = None
+        self._last: Optional[ChatEntry] = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._node.length if self._node else 0
+
+    def messages(self, chat_list: Sequence[ChatEntry], commit: bool = True) -> Optional[PromptNode]:
+        """
+        Returns the node holding the messages of every entry in `chat_list` (None for an empty chat).
+        :param chat_list: the chat to convert
+        :param commit: whether the converted entries should be kept for the following calls
+        """
+        return self.window(chat_list, commit=commit)[1]
+
+    def window(self, chat_list: Sequence[ChatEntry], budget: Optional[int] = None, keep_ratio: float = 1.0,
+               commit: bool = True) -> Tuple[int, Optional[PromptNode], Optional[int]]:
+        """
+        Returns (start, node, tokens): the node holds the messages of the entries of `chat_list` from `start` on,
+        and `tokens` is their token count (None without `count_tokens`).
+
+        The start of the window only moves forward when the entries since the current start exceed `budget`
+        tokens: the oldest entries are then dropped until the rest takes `keep_ratio` of the budget (the last
+        entry is always kept). Between these moves, the prompts of the successive turns share their prefix.
+        """
+        with self._lock:
+            start, node, seen, totals = self._start, self._node, self._seen, self._totals
+            if not self._is_extension(chat_list, seen):
+                if commit:
+                    self.clear()
+                start, node, seen, totals = 0, None, 0, [0]
+            end = len(chat_list)
+            # totals of the entries not counted yet, `totals + added` are the totals of the whole chat
+            added: List[int] = []
+            if self._count_tokens is not None:
+                total = totals[-1]
+                for i in range(seen, end):
+                    total += self._count_tokens(chat_list[i])
+                    added.append(total)
+                if commit:
+                    totals.extend(added)
+                    added = []
+
+            def total_before(i: int) -> int:
+                return totals[i] if i < len(totals) else added[i - len(totals)]
+
+            node_start = start
+            if budget is not None and total_before(end) - total_before(start) > budget:
+                target = total_before(end) - int(budget * keep_ratio)
+                first = bisect_left(totals, target)
+                if first == len(totals):
+                    first += bisect_left(added, target)
+                start = max(start, min(first, end - 1))
+
+            first_new = seen
+            if start != node_start:
+                node, first_new = None, start
+            new_messages = [self._to_message(chat_list[i]) for i in range(first_new, end)]
+            if new_messages:
+                node = node.extend(new_messages) if node else PromptNode(None, new_messages)
+            if commit and end:
+                self._node = node
+                self._start = start
+                self._seen = end
+                self._totals = totals
+                self._first = chat_list[0]
+                self._last = chat_list[-1]
+            tokens = total_before(end) - total_before(start) if self._count_tokens is not None else None
+            return start, node, tokens
+
+    def clear(self):
+        self._node = None
+        self._start = 0
+        self._seen = 0
+        self._totals = [0]
+        self._first = None
+        self._last = None
+
+    def _is_extension(self, chat_list: Sequence[ChatEntry], seen: int) -> bool:
+        if seen == 0:
+            return True
+        return len(chat_list) >= seen and chat_list[0] is self._first and chat_list[seen - 1] is self._last
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
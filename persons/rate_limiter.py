@@ -0,0 +1,308 @@
+"""
+This file contains the process-wide rate limiter and adaptive concurrency controller shared by the
+persons calling an LLM endpoint.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import random
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+log = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    Classic token bucket: `rate` units are added every second, up to `capacity`.
+    Not thread safe on its own, the `AdaptiveLimiter` lock protects it.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate: float = rate
+        self.capacity: float = capacity if capacity is not None else rate
+        self._level: float = self.capacity
+        self._updated: float = time.monotonic()
+
+    def _refill(self, now: float):
+        self._level = min(self.capacity, self._level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until `amount` units are available (0 if they are available now)."""
+        self._refill(now)
+        # A request larger than the whole bucket is let through once the bucket is full
+        amount = min(amount, self.capacity)
+        if self._level >= amount:
+            return 0.0
+        return (amount - self._level) / self.rate
+
+    def take(self, amount: float):
+        """Takes `amount` units, the level can become negative (e.g. when correcting an estimate)."""
+        self._level -= amount
+
+
+class AdaptiveLimiter:
+    """
+    Limits the calls to a single endpoint with:
+        - token buckets on the requests per second and the (estimated) tokens per minute,
+        - an AIMD concurrency window: it grows by `increase` for every window of successful calls while the
+          latency stays under `latency_target`, and it is multiplied by `decrease` on every 429/5xx.
+    Throttled calls are retried with exponential backoff, or after the `Retry-After` the server asked for
+    (at most `max_backoff`). Only in the latter case are the other calls paused as well: no call is started
+    until then.
+
+    It can be used from threads (`call`) and from asyncio tasks (`acall`) at the same time.
+    """
+
+    def __init__(self,
+                 requests_per_second: Optional[float] = None,
+                 tokens_per_minute: Optional[float] = None,
+                 initial_concurrency: int = 8,
+                 min_concurrency: int = 1,
+                 max_concurrency: int = 256,
+                 increase: float = 1.0,
+                 decrease: float = 0.5,
+                 latency_target: Optional[float] = None,
+                 max_retries: int = 3,
+                 backoff: float = 1.0,
+                 max_backoff: float = 60.0,
+                 *args, **kwargs):
+        """
+        :param requests_per_second: request rate limit (None for unlimited)
+        :param tokens_per_minute: limit of prompt + completion tokens per minute (None for unlimited)
+        :param initial_concurrency: starting concurrency window
+        :param min_concurrency: lower bound of the window
+        :param max_concurrency: upper bound of the window
+        :param increase: additive increase of the window per window of successful calls
+        :param decrease: multiplicative decrease of the window when throttled
+        :param latency_target: the window only grows while the call latency (seconds) stays below it
+        :param max_retries: how many times a throttled or failed call is retried
+        :param backoff: first backoff in seconds, doubled on every retry
+        :param max_backoff: upper bound of a single backoff
+        """
+        if not 1 <= min_concurrency <= max_concurrency:
+            raise ValueError("Expected 1 <= min_concurrency <= max_concurrency")
+        self._lock = threading.Lock()
+        self._slot_freed = threading.Condition(self._lock)
+        self._requests = TokenBucket(requests_per_second) if requests_per_second else None
+        self._tokens = TokenBucket(tokens_per_minute / 60, tokens_per_minute) if tokens_per_minute else None
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.window: float = float(min(max(initial_concurrency, min_concurrency), max_concurrency))
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_target = latency_target
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+        self.in_flight: int = 0
+        self._paused_until: float = 0.0
+        self._latency_ewma: Optional[float] = None
+        self._counters: Dict[str, int] = {
+            "calls": 0,
+            "successes": 0,
+            "throttled": 0,
+            "server_errors": 0,
+            "connection_errors": 0,
+            "retries": 0,
+            "failures": 0,
+            "tokens": 0,
+        }
+
+    # region acquiring
+    def _try_acquire(self, tokens: float) -> float:
+        """Takes a slot if possible and returns 0, otherwise returns how long to wait before trying again."""
+        now = time.monotonic()
+        if now < self._paused_until:
+            return self._paused_until - now
+        if self.in_flight >= int(self.window):
+            return -1.0  # wait for a slot to be freed
+        wait = 0.0
+        if self._requests:
+            wait = max(wait, self._requests.wait_time(1, now))
+        if self._tokens and tokens:
+            wait = max(wait, self._tokens.wait_time(tokens, now))
+        if wait > 0:
+            return wait
+        if self._requests:
+            self._requests.take(1)
+        if self._tokens and tokens:
+            self._tokens.take(tokens)
+        self.in_flight += 1
+        self._counters["calls"] += 1
+        return 0.0
+
+    def acquire(self, tokens: float = 0):
+        with self._lock:
+            while True:
+                wait = self._try_acquire(tokens)
+                if wait == 0:
+                    return
+                self._slot_freed.wait(timeout=None if wait < 0 else wait)
+
+    async def aacquire(self, tokens: float = 0):
+        while True:
+            with self._lock:
+                wait = self._try_acquire(tokens)
+            if wait == 0:
+                return
+            # asyncio tasks can't wait on the condition, so they poll
+            await asyncio.sleep(0.01 if wait < 0 else wait)
+
+    def release(self, latency: Optional[float] = None, throttled: bool = False,
+                retry_after: Optional[float] = None):
+        with self._lock:
+            self.in_flight -= 1
+            if throttled:
+                self.window = max(self.min_concurrency, self.window * self.decrease)
+                if retry_after:
+                    self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+            elif latency is not None:
+                self._latency_ewma = latency if self._latency_ewma is None \
+                    else 0.8 * self._latency_ewma + 0.2 * latency
+                if self.latency_target is None or latency <= self.latency_target:
+                    self.window = min(self.max_concurrency, self.window + self.increase / max(self.window, 1.0))
+            self._slot_freed.notify_all()
+
+    def record_tokens(self, used: int, estimated: float = 0):
+        """Corrects the token bucket with the actual usage reported by the server."""
+        with self._lock:
+            self._counters["tokens"] += used
+            if self._tokens:
+                self._tokens.take(used - estimated)
+    # endregion
+
+    # region calling
+    def _classify(self, error: BaseException) -> tuple[str | None, Optional[float]]:
+        """Returns which kind of retryable error `error` is (None if it shouldn't be retried) and its Retry-After."""
+        status = getattr(error, "status_code", None)
+        retry_after = None
+        response = getattr(error, "response", None)
+        if response is not None:
+            header = response.headers.get("retry-after")
+            try:
+                retry_after = float(header) if header is not None else None
+            except ValueError:
+                retry_after = None
+            if retry_after is not None:
+                # a bogus header mustn't stall the whole endpoint, it also pauses the other calls (see `release`)
+                retry_after = min(self.max_backoff, max(0.0, retry_after))
+        if status == 429:
+            return "throttled", retry_after
+        if status is not None and status >= 500:
+            return "server_errors", retry_after
+        if status is None and type(error).__name__ in ("APIConnectionError", "APITimeoutError"):
+            return "connection_errors", None
+        return None, None
+
+    def _backoff(self, attempt: int, retry_after: Optional[float]) -> float:
+        if retry_after is not None:
+            return min(self.max_backoff, retry_after)
+        return min(self.max_backoff, self.backoff * 2 ** attempt) * (0.5 + random.random() / 2)
+
+    def _after_error(self, error: BaseException, attempt: int) -> Optional[float]:
+        """Releases the slot of a failed call and returns the backoff, or None if the error must be raised."""
+        kind, retry_after = self._classify(error)
+        self.release(throttled=kind in ("throttled", "server_errors"), retry_after=retry_after)
+        if kind is None:
+            return None
+        with self._lock:
+            self._counters[kind] += 1
+            if attempt >= self.max_retries:
+                self._counters["failures"] += 1
+                return None
+            self._counters["retries"] += 1
+        backoff = self._backoff(attempt, retry_after)
+        log.warning(f"LLM call failed ({error}), retrying in {backoff:.1f}s "
+                    f"(attempt {attempt + 1}/{self.max_retries}, window {self.window:.1f})")
+        return backoff
+
+    def _after_success(self, started: float):
+        latency = time.monotonic() - started
+        self.release(latency=latency)
+        with self._lock:
+            self._counters["successes"] += 1
+
+    def call(self, fn: Callable[..., Any], *args, tokens: float = 0, **kwargs) -> Any:
+        """Calls `fn(*args, **kwargs)` within the limits, retrying on throttling and server errors."""
+        attempt = 0
+        while True:
+            self.acquire(tokens)
+            started = time.monotonic()
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                backoff = self._after_error(e, attempt)
+                if backoff is None:
+                    raise
+                time.sleep(backoff)
+                attempt += 1
+                continue
+            except BaseException:
+                # cancelled, interrupted or exiting (SIGTERM): the slot must not stay taken
+                self.release()
+                raise
+            self._after_success(started)
+            return result
+
+    async def acall(self, fn: Callable[..., Awaitable[Any]], *args, tokens: float = 0, **kwargs) -> Any:
+        """Asynchronous version of `call`, `fn` must return an awaitable."""
+        attempt = 0
+        while True:
+            await self.aacquire(tokens)
+            started = time.monotonic()
+            try:
+                result = await fn(*args, **kwargs)
+            except Exception as e:
+                backoff = self._after_error(e, attempt)
+                if backoff is None:
+                    raise
+                await asyncio.sleep(backoff)
+                attempt += 1
+                continue
+            except BaseException:
+                # cancelled, interrupted or exiting (SIGTERM): the slot must not stay taken
+                self.release()
+                raise
+            self._after_success(started)
+            return result
+    # endregion
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {
+                "window": round(self.window, 2),
+                "in_flight": self.in_flight,
+                "latency_ewma": self._latency_ewma,
+                **self._counters,
+            }
+
+
+__limiters: Dict[str, AdaptiveLimiter] = {}
+__limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(endpoint: str, **settings) -> AdaptiveLimiter:
+    """
+    Returns the process-wide limiter of `endpoint`, creating it with `settings` on first use
+    (the settings of later calls are ignored).
+    """
+    with __limiters_lock:
+        limiter = __limiters.get(endpoint)
+        if limiter is None:
+            limiter = AdaptiveLimiter(**settings)
+            __limiters[endpoint] = limiter
+        return limiter
+
+
+def limiter_metrics() -> Dict[str, dict]:
+    """The metrics of every limiter of the process, by endpoint."""
+    with __limiters_lock:
+        return {endpoint: limiter.metrics() for endpoint, limiter in __limiters.items()}
@@ -0,0 +1,225 @@
+"""
+This file contains the persistent, content-addressed cache of the LLM responses shared by the persons
+calling a chat completion endpoint.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+log = logging.getLogger(__name__)
+
+
+class ResponseCache:
+    """
+    SQLite backed cache of the chat completion responses, keyed by the hash of everything that defines
+    a request: the endpoint, the model, the messages and the sampling parameters (including the seed).
+    Without a seed, the repetitions of an experiment therefore all get the first cached response.
+
+    Identical requests that are in flight at the same time are deduplicated (single-flight): only the
+    first one is sent to the server, the others wait for its response.
+    When the stored responses exceed `max_size_mb`, the least recently used ones are evicted.
+
+    Several processes can share the same file (e.g. the workers of run_iterations.py), the
+    deduplication of in-flight requests is however only done within a process.
+    """
+
+    def __init__(self, path: str = "cache/responses.sqlite", max_size_mb: float = 1024, *args, **kwargs):
+        """
+        :param path: of the SQLite file, its directory is created if needed
+        :param max_size_mb: size of the stored responses above which the oldest ones are evicted
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.max_size: int = int(max_size_mb * 1024 * 1024)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, response TEXT NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+        self._size: int = self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        self._in_flight: Dict[str, Future] = {}
+        self._ain_flight: Dict[str, asyncio.Future] = {}
+        self._counters: Dict[str, int] = {"hits": 0, "misses": 0, "deduplicated": 0, "stored": 0, "evicted": 0}
+
+    @staticmethod
+    def key(base_url: str, request: dict) -> str:
+        """The cache key of `request` (the keyword arguments of `chat.completions.create`) sent to `base_url`."""
+        canonical = json.dumps({"base_url": base_url, **request}, sort_keys=True, separators=(",", ":"),
+                               ensure_ascii=False, default=str)
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    # region storage
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            return self._get(key)
+
+    def _get(self, key: str) -> Optional[str]:
+        row = self._connection.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is not None:
+            self._connection.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+        return row[0] if row else None
+
+    def put(self, key: str, response: str):
+        size = len(response.encode("utf-8"))
+        with self._lock:
+            previous = self._connection.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responses (key, response, size, last_used) VALUES (?, ?, ?, ?)",
+                (key, response, size, time.time()),
+            )
+            self._size += size - (previous[0] if previous else 0)
+            self._counters["stored"] += 1
+            if self._size > self.max_size:
+                self._evict()
+
+    def _evict(self):
+        """Deletes the least recently used responses until the cache is back to 90% of its maximal size."""
+        target = self.max_size * 0.9
+        rows = self._connection.execute("SELECT key, size FROM responses ORDER BY last_used").fetchall()
+        evicted = []
+        for key, size in rows:
+            if self._size <= target:
+                break
+            evicted.append((key,))
+            self._size -= size
+        self._connection.executemany("DELETE FROM responses WHERE key = ?", evicted)
+        self._counters["evicted"] += len(evicted)
+        log.info(f"Evicted {len(evicted)} responses from {self.path}")
+    # endregion
+
+    # region calling
+    def call(self, key: str, fn: Callable[[], Any], dump: Callable[[Any], Optional[str]],
+             load: Callable[[str], Any]) -> Any:
+        """
+        Returns the cached response of `key`, or calls `fn` and caches its result.
+        :param dump: serializes a response (None if it must not be cached, e.g. a failed call)
+        :param load: deserializes a cached response
+        """
+        # the store is read under the same lock as the in-flight requests: a response stored by a leader is
+        # either found here or its request is still in flight
+        with self._lock:
+            future = self._in_flight.get(key)
+            cached = self._get(key) if future is None else None
+            leader = future is None and cached is None
+            if leader:
+                future = self._in_flight[key] = Future()
+        if cached is not None:
+            self._count("hits")
+            return load(cached)
+        if not leader:
+            self._count("deduplicated")
+            return future.result()
+
+        self._count("misses")
+        try:
+            result = fn()
+        except BaseException as e:
+            with self._lock:
+                del self._in_flight[key]
+            future.set_exception(e)
+            raise
+        future.set_result(result)
+        try:
+            serialized = dump(result)
+            if serialized is not None:
+                self.put(key, serialized)
+        finally:
+            # only once the response is stored, otherwise an identical request could miss both
+            with self._lock:
+                del self._in_flight[key]
+        return result
+
+    async def acall(self, key: str, fn: Callable[[], Awaitable[Any]], dump: Callable[[Any], Optional[str]],
+                    load: Callable[[str], Any]) -> Any:
+        """Asynchronous version of `call`, the deduplication is done between the tasks of the running loop."""
+        # nothing is awaited between the lookups and the registration of the request, as in `call`
+        future = self._ain_flight.get(key)
+        if future is not None:
+            self._count("deduplicated")
+            return await asyncio.shield(future)
+        cached = self.get(key)
+        if cached is not None:
+            self._count("hits")
+            return load(cached)
+
+        self._count("misses")
+        future = self._ain_flight[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            del self._ain_flight[key]
+            future.cancel()
+            raise
+        except BaseException as e:
+            del self._ain_flight[key]
+            future.set_exception(e)
+            # the exception is raised here, the waiting tasks (if any) retrieve it on their own
+            future.exception()
+            raise
+        future.set_result(result)
+        try:
+            serialized = dump(result)
+            if serialized is not None:
+                self.put(key, serialized)
+        finally:
+            # only once the response is stored, otherwise an identical request could miss both
+            del self._ain_flight[key]
+        return result
+    # endregion
+
+    def _count(self, counter: str):
+        with self._lock:
+            self._counters[counter] += 1
+
+    def metrics(self) -> dict:
+        with self._lock:
+            lookups = self._counters["hits"] + self._counters["misses"] + self._counters["deduplicated"]
+            saved = self._counters["hits"] + self._counters["deduplicated"]
+            return {
+                **self._counters,
+                "hit_rate": round(saved / lookups, 4) if lookups else None,
+                "size_mb": round(self._size / 1024 / 1024, 2),
+            }
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+__caches: Dict[str, ResponseCache] = {}
+__caches_lock = threading.Lock()
+
+
+def get_response_cache(path: str = "cache/responses.sqlite", **settings) -> ResponseCache:
+    """
+    Returns the process-wide cache stored at `path`, opening it with `settings` on first use
+    (the settings of later calls are ignored).
+    """
+    with __caches_lock:
+        cache = __caches.get(path)
+        if cache is None:
+            cache = ResponseCache(path, **settings)
+            __caches[path] = cache
+        return cache
+
+
+def response_cache_metrics() -> Dict[str, dict]:
+    """The metrics of every response cache opened by the process, by path."""
+    with __caches_lock:
+        return {path: cache.metrics() for path, cache in __caches.items()}
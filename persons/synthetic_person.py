@@ -0,0 +1,117 @@
+"""
+This file contains a synthetic Person, which answers with generated text instead of calling an endpoint.
+
+Unlike `FakePerson`, it never runs out of things to say, so it can hold conversations of any length,
+and it goes through the same prompt building, answer parsing and call accounting as the persons backed
+by an LLM: it is meant for benchmarking the CPU cost of SAUCE itself, without any network cost.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import random
+import time
+from typing import Any, List, Sequence
+from openai.types.chat import ChatCompletion, ChatCompletionMessageParam
+from persons.call_stats import CallStats
+from persons.chat_completion_person import ChatCompletionPerson
+
+# The words of the generated answers
+VOCABULARY = (
+    "the", "a", "speed", "limit", "road", "safety", "freedom", "people", "drive", "should", "would", "could",
+    "never", "always", "think", "believe", "agree", "disagree", "because", "however", "but", "and", "or",
+    "we", "you", "they", "it", "is", "are", "not", "more", "less", "accidents", "emissions", "time",
+    "cars", "motorway", "germany", "rules", "law", "evidence", "studies", "show", "that", "this", "point",
+    "fair", "reasonable", "argument", "cost", "lives", "fast", "slow", "traffic", "fuel", "noise",
+)
+
+
+class SyntheticPerson(ChatCompletionPerson):
+    PERSON_TYPE = "synthetic_person"
+    # The answers are drawn from a single random generator, so that a run is reproducible
+    CONCURRENT_CALLS = False
+
+    def __init__(
+        self,
+        background_story: str,
+        you_background_story: str,
+        name: str,
+        prompt_version: str = "v0",
+        *args,
+        **kwargs,
+    ):
+        super().__init__(background_story, you_background_story, name, prompt_version, **kwargs)
+        self.api_base: str = kwargs.get("api_base", "synthetic")
+        self.model: str = kwargs.get("model", "synthetic")
+        # Words of an answer, a number or a [min, max] range
+        answer_words = kwargs.get("answer_words", 30)
+        self.answer_words: tuple[int, int] = ((answer_words, answer_words) if isinstance(answer_words, int)
+                                              else (answer_words[0], answer_words[1]))
+        # Seconds slept by every call, to model the latency of an endpoint
+        self.latency: float = kwargs.get("latency", 0.0)
+        # The answers of a person only depend on the seed and its name
+        self._random = random.Random(f"{self.seed or 0}:{name}")
+
+    def prewarm(self):
+        pass
+
+    def _request_kwargs(self, messages: Sequence[ChatCompletionMessageParam]) -> dict:
+        return {
+            "model": self.model,
+            "messages": list(messages),
+            "max_tokens": self.answer_words[1],
+        }
+
+    def _is_survey(self, messages: Sequence[ChatCompletionMessageParam]) -> bool:
+        # the prompts of the questionnaires start with the system message of a questionnaire (followed by a
+        # note when the context window left turns out)
+        head = getattr(messages, "head", None)
+        return bool(head) and any(
+            is_questionnaire and setups and head[0]["content"].startswith(setups[0]["content"])
+            for (_, _, is_questionnaire), setups in self._prompt_setups_cache.items()
+        )
+
+    def _synthesize(self, messages: Sequence[ChatCompletionMessageParam], stats: CallStats | None) -> ChatCompletion:
+        request = self._request(messages)
+        if self._is_survey(messages):
+            # the surveys ask for a rating
+            content = str(self._random.randint(1, 7))
+        else:
+            content = " ".join(self._random.choices(VOCABULARY, k=self._random.randint(*self.answer_words)))
+        prompt_tokens = sum(len(str(message.get("content") or "")) for message in request["messages"]) // 4
+        completion_tokens = len(content) // 4 + 1
+        response = ChatCompletion.model_validate({
+            "id": "synthetic",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": self.model,
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+        })
+        if stats is not None:
+            stats.model = self.model
+            stats.finish(response)
+        return response
+
+    def _complete(self, messages: Sequence[ChatCompletionMessageParam], stats: CallStats | None = None) -> Any:
+        if self.latency:
+            time.sleep(self.latency)
+        return self._synthesize(messages, stats)
+
+    async def _acomplete(self, messages: Sequence[ChatCompletionMessageParam], stats: CallStats | None = None) -> Any:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self._synthesize(messages, stats)
+
+    def _complete_prompts(self, prompts, stats: CallStats | None = None) -> List[str | None]:
+        # a single (batched) request
+        if self.latency:
+            time.sleep(self.latency)
+        return [self._parse_answer(self._synthesize(prompt, stats)) for prompt in prompts]
+
+    async def _acomplete_prompts(self, prompts, stats: CallStats | None = None) -> List[str | None]:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return [self._parse_answer(self._synthesize(prompt, stats)) for prompt in prompts]
@@ -1,26 +1,38 @@
 import os
 import subprocess
 import argparse
-from concurrent.futures import ThreadPoolExecutor
+import logging
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 QUESTIONS = [0,1,2,3,4]
 MAX_WORKERS = 20
 PROMPT_VERSION = ["v0", "v1", "v2"]
 REPETITIONS = 5
+# continue the interrupted runs from their checkpoint (see session_rooms.checkpoint)
+RESUME = True
 
 
 def get_subdirs(directory):
     return [entry.path for entry in os.scandir(directory) if entry.is_dir()]
 
 
-def run_experiment(subdir: str, prompt_version: str, repetition: int, llm_name: str) -> None:
-    print(f"+++++++Repetition {repetition}: {subdir} ({prompt_version}) +++++++")
+def get_paths(subdir: str, prompt_version: str, repetition: int, llm_name: str) -> tuple[str, str]:
     config_path = os.path.join(subdir, f"config_{repetition}.json")
     output_out = os.path.join(
         subdir, f"out_{llm_name}_{prompt_version}_{repetition}.json"
     )
+    return config_path, output_out
+
+
+def should_run(output_out: str) -> bool:
+    return not os.path.exists(output_out) or os.path.getsize(output_out) == 0
+
+
+def run_experiment(subdir: str, prompt_version: str, repetition: int, llm_name: str) -> None:
+    print(f"+++++++Repetition {repetition}: {subdir} ({prompt_version}) +++++++")
+    config_path, output_out = get_paths(subdir, prompt_version, repetition, llm_name)
 
-    if not os.path.exists(output_out) or os.path.getsize(output_out) == 0:
+    if should_run(output_out):
 
         command = [
             "python",
@@ -32,27 +44,178 @@ def run_experiment(subdir: str, prompt_version: str, repetition: int, llm_name:
             "--pretty-print",
             "--prompt-version",
             prompt_version,
+            "--resume" if RESUME else "--no-resume",
         ]
         subprocess.run(command)
     else:
         print(f"Skipping {output_out}, already exists and is not empty.")
 
 
+def _init_worker() -> None:
+    """
+    Runs once in every worker process of the pool: pays the imports, the `load_dotenv` and the logging
+    setup a single time instead of once per experiment.
+    """
+    import main
+    # `json_fix` enables the __json__ handler for the json module, as in main.py
+    import json_fix  # noqa: F401
+    import experiments.experiment  # noqa: F401
+
+    os.makedirs("output_files", exist_ok=True)
+    getattr(main, "__init_logging_system")(
+        log_path=os.path.join("logs", "output.log"),
+        json_df_save=True,
+        json_df_path=os.path.join("output_files", "output.json"),
+        console_show=False,
+        level=logging.WARNING,
+    )
+
+
+def run_experiment_in_process(config_path: str, output_out: str, prompt_version: str, resume: bool = RESUME) -> bool:
+    """
+    Same as running main.py on `config_path`, but inside the current (pre-warmed) process.
+    :param resume: continue from the checkpoint of an interrupted run of the same output, if any
+    :return: whether the output was written
+    """
+    from experiments.experiment import Experiment
+    from session_rooms.checkpoint import close_run_outputs, open_run_outputs
+
+    logger = logging.getLogger()
+    try:
+        with open(config_path, "r") as file:
+            exp = Experiment.load_from_string(file.read(), prompt_version=prompt_version)
+    except Exception:
+        logger.exception(f"Unable to load experiment {config_path}")
+        return False
+
+    experiment_output = None
+    sink, checkpointer = open_run_outputs(exp.session_room, output_out, resume=resume)
+    try:
+        experiment_output = exp.run()
+    except Exception:
+        logger.exception(f"Unhandled exception while running experiment {config_path}")
+    finally:
+        checkpointer.write()
+        sink.close()
+    if not experiment_output:
+        return False
+
+    close_run_outputs(sink, checkpointer, output_path=output_out, pretty=True)
+    return True
+
+
+def _pooled_experiment(subdir: str, prompt_version: str, repetition: int, llm_name: str, resume: bool = RESUME) -> None:
+    print(f"+++++++Repetition {repetition}: {subdir} ({prompt_version}) +++++++")
+    config_path, output_out = get_paths(subdir, prompt_version, repetition, llm_name)
+    if not run_experiment_in_process(config_path, output_out, prompt_version, resume=resume):
+        print(f"Failed {output_out}")
+    from persons.response_cache import response_cache_metrics
+    for cache_path, metrics in response_cache_metrics().items():
+        # cumulative over the runs of this worker
+        print(f"Response cache {cache_path} (pid {os.getpid()}): hit rate {metrics['hit_rate']}")
+
+
+def iterate_runs():
+    for repetition in range(REPETITIONS):
+        for q_index in QUESTIONS:
+            directory = f"config/question_{q_index}"
+            print(f"+++++++ QUESTION {q_index} +++++++")
+            subdirs = get_subdirs(directory)
+            for subdir in subdirs:
+                for version in PROMPT_VERSION:
+                    yield subdir, version, repetition
+
 
 def all_questions(llm_name: str):
     with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        for repetition in range(REPETITIONS):
-            for q_index in QUESTIONS:
-                directory = f"config/question_{q_index}"
-                print(f"+++++++ QUESTION {q_index} +++++++")
-                subdirs = get_subdirs(directory)
-                for subdir in subdirs:
-                    for version in PROMPT_VERSION:
-                        executor.submit(run_experiment, subdir, version, repetition, llm_name)
+        for subdir, version, repetition in iterate_runs():
+            executor.submit(run_experiment, subdir, version, repetition, llm_name)
+
+
+def all_questions_pooled(llm_name: str, max_workers: int = MAX_WORKERS, resume: bool = RESUME):
+    """
+    Runs the sweep in a pool of long-lived worker processes instead of one `python main.py` per run.
+    The skip-if-exists check and the output paths are the same as in `all_questions`.
+    """
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker) as executor:
+        futures = []
+        for subdir, version, repetition in iterate_runs():
+            _, output_out = get_paths(subdir, version, repetition, llm_name)
+            if not should_run(output_out):
+                print(f"Skipping {output_out}, already exists and is not empty.")
+                continue
+            futures.append(executor.submit(_pooled_experiment, subdir, version, repetition, llm_name, resume))
+        for future in futures:
+            future.result()
+
+
+def all_questions_offline(llm_name: str, batch_dir: str, local_base_url: str | None = None):
+    """
+    Runs the sweep in offline batch mode (see `persons.offline_batch`): every wave replays the unfinished
+    experiments from the results received so far and writes the requests they are waiting for as one
+    batch file. With `local_base_url`, the batch files are processed against that server until the
+    sweep is done, otherwise a single wave is run and this function should be called again once the
+    results of the batch are next to its requests.
+    """
+    from persons.offline_batch import OfflineBatch, PendingRequest
+
+    _init_worker()
+    store = OfflineBatch(batch_dir)
+    while True:
+        waiting = store.unanswered_requests()
+        if waiting is not None:
+            if local_base_url is None:
+                print(f"Waiting for the results of {waiting} ({OfflineBatch.results_path(waiting)})")
+                return
+            from persons.offline_batch import process_batch_file
+            store.ingest(process_batch_file(waiting, OfflineBatch.results_path(waiting), local_base_url))
+
+        done = pending = 0
+        with store.activate():
+            for subdir, version, repetition in iterate_runs():
+                config_path, output_out = get_paths(subdir, version, repetition, llm_name)
+                if not should_run(output_out):
+                    continue
+                store.repetition = repetition
+                try:
+                    if run_experiment_in_process(config_path, output_out, version):
+                        done += 1
+                except PendingRequest:
+                    pending += 1
+        requests_path = store.write_requests()
+        print(f"Wave {store.wave - 1 if requests_path else store.wave}: {done} experiments finished, "
+              f"{pending} waiting")
+        if requests_path is None:
+            return
+        print(f"Wrote the requests of the next wave to {requests_path}")
+        if local_base_url is None:
+            return
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--llm-name", type=str, required=True, help="Name of the LLM used")
+    parser.add_argument(
+        "--runner",
+        choices=["pool", "subprocess", "offline"],
+        default="pool",
+        help="'pool' runs the experiments in long-lived worker processes, "
+             "'subprocess' starts a new `python main.py` for every run, "
+             "'offline' runs one wave of the offline batch mode (see --batch-dir)",
+    )
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS, help="How many experiments run at once")
+    parser.add_argument("--batch-dir", default="batches",
+                        help="Directory of the requests_<wave>.jsonl / results_<wave>.jsonl files of the offline mode")
+    parser.add_argument("--local-batch-url", default=None,
+                        help="Process the offline batches against this OpenAI compatible server until the sweep is done")
+    parser.add_argument("--resume", action=argparse.BooleanOptionalAction, default=RESUME,
+                        help="Continue the interrupted runs from their checkpoint instead of starting them over")
     args = parser.parse_args()
-    all_questions(args.llm_name)
+    if args.runner == "offline":
+        all_questions_offline(args.llm_name, args.batch_dir, args.local_batch_url)
+    elif args.runner == "pool":
+        all_questions_pooled(args.llm_name, args.workers, args.resume)
+    else:
+        MAX_WORKERS = args.workers
+        RESUME = args.resume
+        all_questions(args.llm_name)
@@ -1,11 +1,14 @@
 from __future__ import annotations
 
-from dataclasses import dataclass
-from typing import Any, TYPE_CHECKING, Union
+from dataclasses import asdict, dataclass, field, is_dataclass
+from typing import Any, Dict, Optional, TYPE_CHECKING, Union
 
 from termcolor import colored
 
+from session_rooms.prompt_store import SharedPrompt
+
 if TYPE_CHECKING:
+    from persons.call_stats import CallStats
     from persons.person import Person
     from session_rooms.session_room import System
 
@@ -18,6 +21,10 @@ class ChatEntry:
     # The original embedding from the mind of the agent who generated this entry.
     original_embedding: Any = None
     time: str = None
+    # Tokens, latency and attempts of the model call which generated the answer (model backed persons only)
+    stats: Optional['CallStats'] = None
+    # Tokens of the answer, by tokenizer, counted once for the context windows of the persons (see `ContextWindow`)
+    token_counts: Dict[str, int] = field(default_factory=dict, repr=False, compare=False)
 
     def __str__(self):
         name = self.entity.name if hasattr(self.entity,"name") else self.entity.get("name")
@@ -32,9 +39,35 @@ class ChatEntry:
     def __repr__(self):
         return self.__str__()
 
+    def to_json(self, prompt_nodes: Optional[Dict[str, dict]] = None) -> dict:
+        """
+        Returns a json serializable representation of the entry (without copying it, unlike `asdict`).
+        :param prompt_nodes: when given, a `SharedPrompt` is written in its compact form referring to this
+        table of prompt nodes, otherwise the full message list is written.
+        """
+        entity = self.entity
+        if not hasattr(entity, "__json__") and is_dataclass(entity):
+            entity = asdict(entity)
+        prompt = self.prompt
+        if isinstance(prompt, SharedPrompt):
+            prompt = prompt.to_json(prompt_nodes) if prompt_nodes is not None else prompt.materialize()
+        output = {
+            "entity": entity,
+            "prompt": prompt,
+            "answer": self.answer,
+            "original_embedding": self.original_embedding,
+            "time": self.time,
+        }
+        if self.stats is not None:
+            output["stats"] = self.stats.to_json()
+        return output
+
+    def __json__(self):
+        return self.to_json()
+
 
 #region Aliasing
-# Represent a single chat room
+# Represent a single chat room (the survey questions get a read only `ChatSnapshot` of it instead)
 ChatList = list[ChatEntry]
 # Things more efficiently on GPU.
 BatchChatList = list[ChatList]
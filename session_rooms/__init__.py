@@ -1,11 +1,9 @@
 import logging
+from pkgutil import resolve_name
 
 from typing import TYPE_CHECKING
 
 
-from . import batch_session_room
-from . import session_room
-
 logging.getLogger(__name__).setLevel(logging.DEBUG)
 if TYPE_CHECKING:
     from session_rooms.session_room import SessionRoom
@@ -13,7 +11,8 @@ if TYPE_CHECKING:
 
 def get_session_room(name: str) -> type['SessionRoom']:
     _dict = {
-        "base": session_room.SessionRoom,
-        "batch": batch_session_room.BatchSessionRoom
+        "base": "session_rooms.session_room:SessionRoom",
+        "batch": "session_rooms.batch_session_room:BatchSessionRoom",
+        "async": "session_rooms.async_session_room:AsyncSessionRoom",
     }
-    return _dict.get(name)
+    return resolve_name(_dict[name]) if name in _dict else None
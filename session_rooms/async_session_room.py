@@ -0,0 +1,240 @@
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple, TYPE_CHECKING
+
+from experiments.experiment_output import ExperimentOutput
+from experiments.hooks import hook_point
+from experiments.survey_question import SurveyQuestion
+from session_rooms.ChatEntry import ChatEntry
+from session_rooms.chat_log import ChatSnapshot
+from .session_room import SessionRoom, System
+
+if TYPE_CHECKING:
+    from experiments.experiment import Experiment
+    from persons.person import Person
+
+log = logging.getLogger(__name__)
+
+
+class _LaneTurn:
+    """A reserved turn in the lane of the stateful persons (see `AsyncSessionRoom._sequential`)."""
+
+    def __init__(self, previous: asyncio.Future, done: asyncio.Future):
+        self.previous = previous
+        self.done = done
+
+    async def __aenter__(self):
+        # shielded, a cancelled turn must not cancel the ones before it
+        await asyncio.shield(self.previous)
+
+    async def __aexit__(self, *exc_info):
+        self.release()
+
+    def release(self):
+        """Gives the lane to the next turn, once the previous ones are over (the turn may never have been taken)."""
+        if self.previous.done():
+            self._finish()
+        else:
+            self.previous.add_done_callback(self._finish)
+
+    def _finish(self, *args):
+        if not self.done.done():
+            self.done.set_result(None)
+
+
+class AsyncSessionRoom(SessionRoom):
+    """
+    Session room running on asyncio.
+    The turns are still taken one after the other (each answer depends on the previous one), but
+    everything that does not depend on the order overlaps with them: the survey questions are
+    answered in the background while the conversation continues, logging is moved to a worker
+    thread and the session file is written without blocking the event loop.
+    """
+
+    def __init__(self, experiment: Optional[Experiment], survey_workers: int = 8, survey_batching: bool = False,
+                 *args, **kwargs):
+        super().__init__(experiment, survey_workers, survey_batching, *args, **kwargs)
+        self._survey_semaphore: asyncio.Semaphore | None = None
+        # The lane of the persons which can't answer concurrently (see `Person.CONCURRENT_CALLS`): done when the
+        # last call which reserved it is over
+        self._lane_tail: asyncio.Future | None = None
+
+    def run(self, save_session_file_name: str = None, prompt_version: str = "") -> ExperimentOutput:
+        return asyncio.run(self.arun(save_session_file_name, prompt_version=prompt_version))
+
+    async def arun(self, save_session_file_name: str = None, prompt_version: str = "") -> ExperimentOutput:
+        log.info("Async session room is running")
+
+        self.prompt_version = prompt_version
+        output = ExperimentOutput(sink=self.output_sink)
+        # Bounds the survey answers generated at the same time (see `survey_workers`)
+        self._survey_semaphore = asyncio.Semaphore(self.survey_workers)
+        self._lane_tail = asyncio.get_running_loop().create_future()
+        self._lane_tail.set_result(None)
+        # A single worker keeps the log records in order
+        log_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="session-log")
+        # (iteration, task) of the surveys started and not written yet, in the order in which they were started
+        surveys: List[Tuple[int, asyncio.Task]] = []
+
+        def add_surveys(iteration: int, survey_questions: List[SurveyQuestion]):
+            for survey_question in survey_questions:
+                output.add_survey_question(survey_question)
+            self.surveyed_iterations.add(iteration)
+            self.checkpoint()
+
+        try:
+            # surveys interrupted by the end of a previous run (when resuming from a checkpoint)
+            for iteration in self.pending_survey_iterations():
+                surveys.append((iteration, self.start_survey_questions_if_needed(prompt_version, log_executor,
+                                                                                 iteration=iteration)))
+            while not self.experiment.end_type.did_end(self):
+                surveys.append((self.session_length,
+                                self.start_survey_questions_if_needed(prompt_version, log_executor)))
+                new_chat_entry = await self.aiterate(prompt_version=prompt_version, log_executor=log_executor)
+                if new_chat_entry is not None:
+                    output.add_chat_entry(self.chat_room[-1])
+                    self.checkpoint()
+                # the finished surveys are added right away, in the order in which they were started
+                while surveys and surveys[0][1].done():
+                    iteration, survey = surveys.pop(0)
+                    add_surveys(iteration, survey.result())
+            surveys.append((self.session_length, self.start_survey_questions_if_needed(prompt_version, log_executor)))
+
+            for iteration, survey in surveys:
+                add_surveys(iteration, await survey)
+        finally:
+            log_executor.shutdown(wait=True)
+            self._survey_semaphore = None
+            self._lane_tail = None
+
+        if save_session_file_name:
+            await asyncio.to_thread(self.save_session, save_session_file_name)
+
+        return output
+
+    def start_survey_questions_if_needed(self, prompt_version: str, log_executor: ThreadPoolExecutor = None,
+                                         iteration: Optional[int] = None) -> asyncio.Task:
+        """
+        Starts answering the survey questions that should be triggered at the given iteration (the current
+        one by default) and returns the task, which results in the `SurveyQuestion` records.
+        The chat room is captured when calling this function, so the conversation can move on.
+        """
+        if iteration is None:
+            iteration = self.session_length
+        survey_questions = [] if iteration in self.surveyed_iterations else self.triggered_survey_questions(iteration)
+        # the stateful persons answer before the next turn, as in `SessionRoom`: the lane is reserved now, the
+        # task only starts running after the turn was started
+        lane = self._sequential() if survey_questions and any(
+            not next_person.CONCURRENT_CALLS for next_person in self.experiment.persons) else None
+        return asyncio.ensure_future(
+            self.aask_survey_questions(survey_questions, ChatSnapshot(self.chat_room, length=iteration),
+                                       prompt_version, log_executor, lane=lane))
+
+    @hook_point("session.survey", lambda self, survey_questions, chat_room, *args, **kwargs:
+                {"iteration": len(chat_room)})
+    async def aask_survey_questions(self, survey_questions: list[dict], chat_room: ChatSnapshot,
+                                    prompt_version: str, log_executor: ThreadPoolExecutor = None,
+                                    lane: _LaneTurn | None = None) -> List[SurveyQuestion]:
+        """
+        :param lane: the reserved lane of the stateful persons (see `_sequential`), reserved here when not given
+        """
+        try:
+            return await self._aanswer_survey_questions(survey_questions, chat_room, prompt_version, log_executor, lane)
+        finally:
+            # the lane is given back even when the survey failed before taking it
+            if lane is not None:
+                lane.release()
+
+    async def _aanswer_survey_questions(self, survey_questions: list[dict], chat_room: ChatSnapshot,
+                                        prompt_version: str, log_executor: ThreadPoolExecutor | None,
+                                        lane: _LaneTurn | None) -> List[SurveyQuestion]:
+        if not survey_questions:
+            return []
+
+        log.info("Starting survey. Everyone is answering this end_prompt:")
+        iteration = len(chat_room)
+        persons = self.experiment.persons
+        survey_chats = [chat_room + [ChatEntry(System(), "", survey_question["question"])]
+                        for survey_question in survey_questions]
+        # The stateful persons answer one question after the other, in a single lane which they also share with
+        # their turns of the conversation
+        concurrent = [next_person for next_person in persons if next_person.CONCURRENT_CALLS]
+        sequential = [next_person for next_person in persons if not next_person.CONCURRENT_CALLS]
+
+        async def answer_in_sequence() -> list:
+            if not sequential:
+                return []
+            async with lane or self._sequential():
+                return [await self._aperson_answers(next_person, survey_chats, prompt_version)
+                        for next_person in sequential]
+
+        concurrent_answers, sequential_answers = await asyncio.gather(
+            asyncio.gather(*[self._aperson_answers(next_person, survey_chats, prompt_version)
+                             for next_person in concurrent]),
+            answer_in_sequence())
+        answers_by_person = {id(next_person): person_answers for next_person, person_answers
+                             in zip(concurrent + sequential, [*concurrent_answers, *sequential_answers])}
+        answers = [answers_by_person[id(next_person)][q] for q in range(len(survey_chats)) for next_person in persons]
+        asked = [survey_question for survey_question in survey_questions for _ in persons]
+
+        records = []
+        for survey_question, new_chat_entry in zip(asked, answers):
+            if new_chat_entry is not None:
+                records.append(
+                    SurveyQuestion(
+                        question_id=survey_question["id"],
+                        question_content=survey_question["question"],
+                        iteration=iteration,
+                        chat_entry=new_chat_entry))
+                self._log_entry(new_chat_entry, log_executor)
+        return records
+
+    async def _aperson_answers(self, person: Person, survey_chats: list, prompt_version: str) -> list:
+        """The answers of `person` to every survey chat, concurrently when the person allows it."""
+        if self.survey_batching and (person.batches_answers or not person.CONCURRENT_CALLS):
+            return await self._abounded(person.agenerate_answers(
+                self.experiment.scenario, survey_chats, prompt_version, is_questionnaire=True))
+        calls = [person.agenerate_answer(self.experiment.scenario, survey_chat, prompt_version, is_questionnaire=True)
+                 for survey_chat in survey_chats]
+        if person.CONCURRENT_CALLS:
+            return await asyncio.gather(*[self._abounded(call) for call in calls])
+        return [await self._abounded(call) for call in calls]
+
+    def _sequential(self, person: Person | None = None):
+        """
+        Reserves the lane of the persons which can't answer concurrently (nothing for the other ones), the
+        returned context waits for the calls which reserved it before. The lane is taken in the order of the
+        reservations, not in the order in which the tasks happen to run.
+        """
+        if self._lane_tail is None or (person is not None and person.CONCURRENT_CALLS):
+            return contextlib.nullcontext()
+        previous, self._lane_tail = self._lane_tail, asyncio.get_running_loop().create_future()
+        return _LaneTurn(previous, self._lane_tail)
+
+    async def _abounded(self, call):
+        if self._survey_semaphore is None:
+            return await call
+        async with self._survey_semaphore:
+            return await call
+
+    @hook_point("session.iterate", lambda self, *args, **kwargs: {"turn": self.session_length})
+    async def aiterate(self, prompt_version: str = "", log_executor: ThreadPoolExecutor = None):
+        next_person: Person = self.experiment.host.get_curr_person_and_move_to_next()
+        async with self._sequential(next_person):
+            new_chat_entry = await next_person.agenerate_answer(
+                self.experiment.scenario, self.chat_room, prompt_version, is_questionnaire=False)
+        if new_chat_entry is not None:
+            self.chat_room.append(new_chat_entry)
+            self._log_entry(new_chat_entry, log_executor)
+        return new_chat_entry
+
+    @staticmethod
+    def _log_entry(chat_entry: ChatEntry, log_executor: ThreadPoolExecutor = None):
+        if log_executor is None:
+            log.info(chat_entry)
+        else:
+            log_executor.submit(log.info, chat_entry)
@@ -1,12 +1,13 @@
 from __future__ import annotations
 
 import logging
-import pickle
 from typing import TYPE_CHECKING
 
 from experiments.experiment_output import ExperimentOutput
+from experiments.hooks import hook_point
 from experiments.survey_question import SurveyQuestion
 from .ChatEntry import ChatEntry
+from .chat_log import ChatSnapshot
 from .session_room import SessionRoom, System
 
 if TYPE_CHECKING:
@@ -16,75 +17,68 @@ log = logging.getLogger(__name__)
 
 
 class BatchSessionRoom(SessionRoom):
-    def __init__(self, experiment: BatchExperiment | None, batch_size: int = 0):
-        super().__init__(experiment)
+    def __init__(self, experiment: BatchExperiment | None, batch_size: int = 0, *args, **kwargs):
+        super().__init__(experiment, *args, **kwargs)
         self._batch_size = batch_size
         self.chat_rooms = [[] for _ in range(self.batch_size)] if batch_size != 0 else []
 
-    def run(self, save_session_file_name: str = None) -> list[ExperimentOutput]:
+    def run(self, save_session_file_name: str = None, prompt_version: str = "") -> list[ExperimentOutput]:
         log.info("Starting batch session (batch size %d)", self.batch_size)
 
-        outputs = [ExperimentOutput() for _ in range(self.batch_size)]
+        self.prompt_version = prompt_version
+        # the rooms share the output stream, their records are tagged with the room index
+        outputs = [ExperimentOutput(sink=self.output_sink.room(i) if self.output_sink is not None else None)
+                   for i in range(self.batch_size)]
         while not self.experiment.end_type.did_end(self):
-            self.ask_survey_questions_if_needed(outputs)
-            self.iterate()
+            self.ask_survey_questions_if_needed(outputs, prompt_version=prompt_version)
+            self.iterate(prompt_version=prompt_version)
             for i, room in enumerate(self.chat_rooms):
-                outputs[i].chat_entry.append(room[-1])
-        self.ask_survey_questions_if_needed(outputs)
+                outputs[i].add_chat_entry(room[-1])
+        self.ask_survey_questions_if_needed(outputs, prompt_version=prompt_version)
         if save_session_file_name:
-            with open(save_session_file_name, "wb") as file:
-                pickle.dump(self, file)
+            self.save_session(save_session_file_name)
 
         log.info("Session room is done.")
         return outputs
 
-    def ask_survey_questions_if_needed(self, outputs: list[ExperimentOutput]) -> None:
+    @hook_point("session.survey")
+    def ask_survey_questions_if_needed(self, outputs: list[ExperimentOutput], prompt_version: str = "") -> None:
         """
         Asks the survey questions that should be triggered at the current iteration.
         All persons participant in the survey and answers are stored in the
-        `experiment_output`. This function does not modify `self.chat_room`.
+        `experiment_output` of their room. This function does not modify `self.chat_rooms`.
         """
-        for experiment_output in outputs:
-            # Keep only the survey questions that should be asked at the current iteration.
-            should_keep = lambda cur_len, trigger: (cur_len in trigger) or \
-                                                   f"{trigger}".lower() == "always" or \
-                                                   (-1 in trigger and self.experiment.end_type.did_end(self))
-            survey_questions = [q for q in self.experiment.survey_questions \
-                                if should_keep(len(self.chat_room), q.get("iterations"))]
-
-            if not survey_questions:
-                return
-
-            log.info("Starting survey. Everyone is answering this end_prompt:")
-            for survey_question in survey_questions:
-                experiment_output.survey_question.append(
-                    SurveyQuestion(
-                        question_id=survey_question["id"],
-                        question_content=survey_question["question"],
-                        iteration=len(self.chat_room),
-                        chat_entry=self.chat_room))
-
-                survey_entry = ChatEntry(System(), "", survey_question["question"])
-                log.info(survey_entry)
-                for i in range(len(self.chat_rooms)):
-                    # Copy the chat room, so it can later "forget" the survey question.
-                    self.chat_rooms[i].append(survey_entry)
-
-                for next_person in self.experiment.persons:
-                    new_chat_entry = next_person.generate_answer(
-                        self.experiment.scenario, self.chat_rooms)
+        survey_questions = self.triggered_survey_questions()
+
+        if not survey_questions:
+            return
+
+        log.info("Starting survey. Everyone is answering this end_prompt:")
+        for survey_question in survey_questions:
+            survey_entry = ChatEntry(System(), "", survey_question["question"])
+            log.info(survey_entry)
+            # O(1) view of every room followed by the question, the rooms themselves aren't modified
+            chat_rooms_with_survey = [ChatSnapshot(room, overlay=[survey_entry]) for room in self.chat_rooms]
+
+            for next_person in self.experiment.persons:
+                new_chat_entries = next_person.generate_answer(
+                    self.experiment.scenario, chat_rooms_with_survey,
+                    prompt_version=prompt_version, is_questionnaire=True)
+                for experiment_output, room, new_chat_entry in zip(outputs, self.chat_rooms, new_chat_entries):
                     if new_chat_entry is not None:
-                        experiment_output.survey_question[-1].chat_entry.append(
-                            new_chat_entry)
+                        experiment_output.add_survey_question(
+                            SurveyQuestion(
+                                question_id=survey_question["id"],
+                                question_content=survey_question["question"],
+                                iteration=len(room),
+                                chat_entry=new_chat_entry))
                         log.info(new_chat_entry)
-                # remove the question
-                for chat_room in self.chat_rooms:
-                    chat_room.pop()
 
-    def iterate(self):
+    @hook_point("session.iterate", lambda self, *args, **kwargs: {"turn": self.session_length})
+    def iterate(self, prompt_version: str = ""):
         next_person = self.experiment.host.get_curr_person_and_move_to_next()
         new_chat_entries = next_person.generate_answer(
-            self.experiment.scenario, self.chat_rooms)
+            self.experiment.scenario, self.chat_rooms, prompt_version=prompt_version, is_questionnaire=False)
 
         for i, room in enumerate(self.chat_rooms):
             room.append(new_chat_entries[i])
@@ -0,0 +1,73 @@
+from __future__ import annotations
+
+from itertools import chain, islice
+from typing import Iterable, Iterator, List, Optional, Sequence, Tuple, Union, overload, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from session_rooms.ChatEntry import ChatEntry
+
+
+class ChatSnapshot(Sequence):
+    """
+    Immutable view of a chat room at a given moment, optionally followed by overlay entries.
+
+    The chat rooms are append-only lists, so a snapshot only needs a reference to the room and its
+    length at the time the snapshot was taken: taking one is O(1) and never copies the history,
+    and entries appended to the room afterwards are not visible through it. The overlay holds
+    entries that are only part of this view (e.g. a survey question).
+
+    Persons can use it like a list of `ChatEntry` (len, indexing, iteration and `+`).
+    """
+    __slots__ = ("_base", "_length", "_overlay")
+
+    def __init__(self, base: Union[List[ChatEntry], ChatSnapshot], overlay: Iterable[ChatEntry] = (),
+                 length: Optional[int] = None):
+        """
+        :param base: the chat room (or a snapshot to extend with `overlay`)
+        :param overlay: entries following the history
+        :param length: how many entries of the room are part of the view, all of them by default
+        """
+        if isinstance(base, ChatSnapshot):
+            self._base: List[ChatEntry] = base._base
+            self._length: int = base._length
+            self._overlay: Tuple[ChatEntry, ...] = base._overlay + tuple(overlay)
+        else:
+            self._base = base
+            self._length = len(base) if length is None else min(length, len(base))
+            self._overlay = tuple(overlay)
+
+    def __len__(self) -> int:
+        return self._length + len(self._overlay)
+
+    @overload
+    def __getitem__(self, index: int) -> ChatEntry: ...
+
+    @overload
+    def __getitem__(self, index: slice) -> List[ChatEntry]: ...
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError("chat snapshot index out of range")
+        if index < self._length:
+            return self._base[index]
+        return self._overlay[index - self._length]
+
+    def __iter__(self) -> Iterator[ChatEntry]:
+        return chain(islice(self._base, self._length), self._overlay)
+
+    def __add__(self, other: Iterable[ChatEntry]) -> ChatSnapshot:
+        return ChatSnapshot(self, other)
+
+    def __eq__(self, other):
+        if not isinstance(other, Sequence):
+            return NotImplemented
+        return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"ChatSnapshot({list(self)!r})"
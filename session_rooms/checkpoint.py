@@ -0,0 +1,181 @@
+"""
+Lightweight checkpoints of a running session room, to resume an interrupted run (e.g. a SLURM job that
+reached its time limit) from its last completed turn without querying the model again.
+
+A checkpoint is a small json file next to the output, written atomically at a consistent point of the
+run (a turn was added, the surveys of an iteration were written) at most every `interval` seconds, and
+when the run ends or is terminated. Resuming only replays the turns since the last write. It holds:
+    - the chat log, with the persons referred to by name (no prompts, no clients),
+    - the state of the host and of the end type,
+    - the iterations whose surveys were already written (the other triggered ones are pending),
+    - the offset of the output stream (see `experiments.output_sink`) at that point.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+import signal
+import time
+from typing import Optional, Tuple, TYPE_CHECKING
+
+from experiments.output_sink import JsonlOutputSink, atomic_write_json, finalize, stream_path
+from session_rooms.ChatEntry import ChatEntry
+
+if TYPE_CHECKING:
+    from session_rooms.session_room import SessionRoom
+
+log = logging.getLogger(__name__)
+
+CHECKPOINT_VERSION = 1
+
+
+def checkpoint_path(output_path: str) -> str:
+    """The path of the checkpoint written while producing `output_path`."""
+    # not a ".json" suffix, so it doesn't match the "out_*.json" globs of the analysis scripts
+    return f"{output_path}.checkpoint"
+
+
+class SessionCheckpointer:
+    """
+    Keeps the state of the room at its last consistent point and writes it every `interval` seconds.
+    Each write serializes the whole chat log and syncs the output stream, so writing at every turn would
+    cost O(n²) I/O over a run.
+    """
+
+    def __init__(self, path: str, interval: float = 30.0):
+        """
+        :param path: of the checkpoint file
+        :param interval: the least time (in seconds) between two writes, 0 writes at every consistent point
+        """
+        if interval < 0:
+            raise ValueError("interval must not be negative")
+        self.path = path
+        self.interval = interval
+        self._room: Optional[SessionRoom] = None
+        self._state: Optional[dict] = None
+        self._last_write = time.monotonic()
+
+    def boundary(self, room: SessionRoom):
+        """
+        Called by the room at every consistent point. Only the small state is taken here, the chat
+        log is serialized when writing.
+        """
+        sink = room.output_sink
+        self._room = room
+        self._state = {
+            "version": CHECKPOINT_VERSION,
+            "length": len(room.chat_room),
+            "host": room.experiment.host.get_state(),
+            "end_type": room.experiment.end_type.get_state(),
+            "surveyed": sorted(room.surveyed_iterations),
+            "stream_offset": sink.offset if sink is not None else None,
+        }
+        if time.monotonic() - self._last_write >= self.interval:
+            self.write()
+
+    def write(self):
+        """Writes the last consistent state (if any)."""
+        if self._state is None:
+            return
+        sink = self._room.output_sink
+        if sink is not None:
+            # the checkpoint must never refer to output records that aren't on disk
+            sink.sync()
+        state = dict(self._state)
+        state["chat_room"] = [_entry_state(entry) for entry in self._room.chat_room[:state["length"]]]
+        atomic_write_json(self.path, state, pretty=False)
+        self._last_write = time.monotonic()
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def _entry_state(chat_entry: ChatEntry) -> dict:
+    from session_rooms.session_room import System
+
+    return {
+        "name": chat_entry.entity.name,
+        "system": isinstance(chat_entry.entity, System),
+        "answer": chat_entry.answer,
+        "time": chat_entry.time,
+    }
+
+
+def load_checkpoint(path: str) -> Optional[dict]:
+    """Returns the state saved at `path`, None if there is no (usable) checkpoint."""
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as file:
+            state = json.load(file)
+    except (OSError, json.JSONDecodeError):
+        log.exception(f"Unable to read the checkpoint {path}, starting from scratch")
+        return None
+    if state.get("version") != CHECKPOINT_VERSION:
+        log.warning(f"Unknown checkpoint version in {path}, starting from scratch")
+        return None
+    return state
+
+
+def restore_checkpoint(room: SessionRoom, state: dict):
+    """Restores the room (created from the same configuration) to the state of a checkpoint."""
+    from session_rooms.session_room import System
+
+    persons = {person.name: person for person in room.experiment.persons}
+    room.chat_room[:] = [
+        ChatEntry(entity=System() if entry["system"] else persons[entry["name"]], prompt=None,
+                  answer=entry["answer"], time=entry["time"])
+        for entry in state["chat_room"]
+    ]
+    room.experiment.host.set_state(state["host"])
+    room.experiment.end_type.set_state(state["end_type"])
+    room.surveyed_iterations = set(state["surveyed"])
+    log.info(f"Resuming the session from turn {len(room.chat_room)}")
+
+
+def open_run_outputs(room: SessionRoom, output_path: str, full_prompts: bool = False, resume: bool = False,
+                     checkpoint_interval: float = 30.0) -> Tuple[JsonlOutputSink, SessionCheckpointer]:
+    """
+    Attaches the output stream and the checkpointer of `output_path` to `room`.
+    With `resume`, the room and the stream continue from the checkpoint of a previous run, when there is one.
+    """
+    checkpointer = SessionCheckpointer(checkpoint_path(output_path), interval=checkpoint_interval)
+    state = load_checkpoint(checkpointer.path) if resume else None
+    if state is not None and not os.path.exists(stream_path(output_path)):
+        log.warning(f"The output stream of {checkpointer.path} is missing, starting from scratch")
+        state = None
+    sink = JsonlOutputSink(stream_path(output_path), full_prompts=full_prompts,
+                           resume_offset=state["stream_offset"] if state else None)
+    if state is not None:
+        restore_checkpoint(room, state)
+    room.output_sink = sink
+    room.checkpointer = checkpointer
+    return sink, checkpointer
+
+
+def close_run_outputs(sink: JsonlOutputSink, checkpointer: SessionCheckpointer, output_path: Optional[str] = None,
+                      pretty: bool = True):
+    """
+    Closes the output stream. When `output_path` is given (the run is complete), the output file is
+    written and the stream and checkpoint are removed.
+    """
+    sink.close()
+    if output_path is not None:
+        finalize(sink.path, output_path, pretty=pretty)
+        checkpointer.remove()
+
+
+def flush_on_sigterm(checkpointer: SessionCheckpointer):
+    """
+    Writes the last checkpoint when the process receives SIGTERM (then exits).
+    Returns the previous handler, to be restored with `signal.signal(signal.SIGTERM, previous)`.
+    """
+    def handler(signum, frame):
+        log.warning("Received SIGTERM, writing the checkpoint")
+        checkpointer.write()
+        raise SystemExit(128 + signum)
+
+    return signal.signal(signal.SIGTERM, handler)
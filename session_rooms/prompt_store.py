@@ -0,0 +1,133 @@
+"""
+Structurally shared storage of the prompts kept in `ChatEntry.prompt`.
+
+The prompt of a turn is the prompt of the previous turn of the same person plus the messages that
+were added since, so it is stored as a reference to that shared prefix (a `PromptNode`) plus the
+new messages only. The full message list is only materialized when someone reads it.
+"""
+
+from __future__ import annotations
+
+import itertools
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+_node_ids = itertools.count()
+
+
+def skip_node_ids(past: int):
+    """Makes the next node ids greater than `past` (used when appending to the output of a previous process)."""
+    global _node_ids
+    _node_ids = itertools.count(max(next(_node_ids), past + 1))
+
+
+class PromptNode:
+    """
+    Immutable link of a chain of messages: its messages are the messages of `parent` followed by `delta`.
+    """
+    __slots__ = ("parent", "delta", "length", "id")
+
+    def __init__(self, parent: Optional[PromptNode], delta: Iterable[Any]):
+        self.parent: Optional[PromptNode] = parent
+        self.delta: Tuple[Any, ...] = tuple(delta)
+        self.length: int = (parent.length if parent else 0) + len(self.delta)
+        self.id: int = next(_node_ids)
+
+    def extend(self, delta: Sequence[Any]) -> PromptNode:
+        """Returns a node with `delta` appended, or this node if there is nothing to append."""
+        return PromptNode(self, delta) if delta else self
+
+    def chain(self) -> List[PromptNode]:
+        """The nodes from the root to this node."""
+        nodes = []
+        node = self
+        while node is not None:
+            nodes.append(node)
+            node = node.parent
+        nodes.reverse()
+        return nodes
+
+    def materialize(self) -> List[Any]:
+        messages = []
+        for node in self.chain():
+            messages.extend(node.delta)
+        return messages
+
+
+class SharedPrompt(Sequence):
+    """
+    A prompt made of a few head messages (the system message) followed by the messages of a `PromptNode`.
+    It can be used like a read only list, and is materialized on access.
+    """
+    __slots__ = ("head", "node", "tokens")
+
+    def __init__(self, head: Iterable[Any], node: Optional[PromptNode], tokens: Optional[int] = None):
+        self.head: Tuple[Any, ...] = tuple(head)
+        self.node: Optional[PromptNode] = node
+        # Token count of the messages, when the person counted them (see `ContextWindow`)
+        self.tokens: Optional[int] = tokens
+
+    def materialize(self) -> List[Any]:
+        return list(self.head) + (self.node.materialize() if self.node else [])
+
+    def __len__(self) -> int:
+        return len(self.head) + (self.node.length if self.node else 0)
+
+    def __getitem__(self, index):
+        return self.materialize()[index]
+
+    def __iter__(self) -> Iterator[Any]:
+        return iter(self.materialize())
+
+    def __eq__(self, other):
+        if isinstance(other, SharedPrompt):
+            return self.materialize() == other.materialize()
+        if isinstance(other, (list, tuple)):
+            return self.materialize() == list(other)
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"SharedPrompt({self.materialize()!r})"
+
+    def __json__(self):
+        return self.materialize()
+
+    def to_json(self, prompt_nodes: Dict[str, dict]) -> dict:
+        """
+        Compact json representation, referring to the node in `prompt_nodes`.
+        The missing nodes of the chain are added to `prompt_nodes` (parents first).
+        """
+        if self.node is None:
+            return {"head": list(self.head), "node": None}
+        missing = []
+        node = self.node
+        while node is not None and str(node.id) not in prompt_nodes:
+            missing.append(node)
+            node = node.parent
+        for node in reversed(missing):
+            prompt_nodes[str(node.id)] = {
+                "parent": str(node.parent.id) if node.parent else None,
+                "messages": list(node.delta),
+            }
+        return {"head": list(self.head), "node": str(self.node.id)}
+
+
+def materialize_prompt(prompt: Any, prompt_nodes: Optional[Dict[str, dict]] = None) -> Any:
+    """
+    Returns the full message list of a prompt read back from an output file.
+    Prompts written in the compact form ({"head": ..., "node": ...}) are resolved with the
+    "prompt_nodes" table of the same file, anything else is returned as is.
+    """
+    if not (isinstance(prompt, dict) and "head" in prompt and "node" in prompt):
+        return prompt
+    deltas = []
+    node_id = prompt["node"]
+    while node_id is not None:
+        node = prompt_nodes[node_id]
+        deltas.append(node["messages"])
+        node_id = node["parent"]
+    messages = list(prompt["head"])
+    for delta in reversed(deltas):
+        messages.extend(delta)
+    return messages
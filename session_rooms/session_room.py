@@ -2,56 +2,92 @@ from __future__ import annotations
 
 import copy
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
-from typing import List, Optional
+from typing import Dict, List, Optional
 import pickle
 from experiments.experiment_output import ExperimentOutput
+from experiments.hooks import hook_point
 from experiments.survey_question import SurveyQuestion
 
 # protect cyclic imports caused from typing
 from typing import TYPE_CHECKING
 
 from session_rooms.ChatEntry import ChatEntry
+from session_rooms.chat_log import ChatSnapshot
 
 if TYPE_CHECKING:
     from experiments.experiment import Experiment
     from persons.person import Person
+    from experiments.output_sink import JsonlOutputSink
+    from session_rooms.checkpoint import SessionCheckpointer
 
 log = logging.getLogger(__name__)
 
 
 class SessionRoom:
-    def __init__(self, experiment: Optional[Experiment], *args, **kwargs):
+    def __init__(self, experiment: Optional[Experiment], survey_workers: int = 8, survey_batching: bool = False,
+                 *args, **kwargs):
+        """
+        :param experiment: that is run in the room
+        :param survey_workers: how many survey answers can be generated concurrently
+        :param survey_batching: whether each person answers all the questions triggered at an iteration
+                                in a single call (`Person.generate_answers`) instead of one call per question
+        """
         self.experiment: Experiment = experiment
+        # Append-only, `ChatSnapshot` views of it rely on entries never being removed or replaced
         self.chat_room: List[ChatEntry] = []
         self.prompt_version: str = ""
+        if survey_workers < 1:
+            raise ValueError("survey_workers must be at least 1")
+        self.survey_workers: int = survey_workers
+        self.survey_batching: bool = survey_batching
+        # Where the records are streamed during `run` (see `experiments.output_sink`), set by the runner
+        self.output_sink: Optional[JsonlOutputSink] = None
+        # Saves the state at every consistent point of `run` (see `session_rooms.checkpoint`), set by the runner
+        self.checkpointer: Optional[SessionCheckpointer] = None
+        # The iterations whose triggered survey questions were answered and written
+        self.surveyed_iterations: set[int] = set()
 
     def run(self, save_session_file_name: str = None, prompt_version: str = "") -> ExperimentOutput:
         """ Runs the session room and returns the generated chat as a dataframe """
         log.info("Session room is running")
 
         self.prompt_version = prompt_version
-        output = ExperimentOutput()
+        output = ExperimentOutput(sink=self.output_sink)
+        # surveys interrupted by the end of a previous run (when resuming from a checkpoint)
+        for iteration in self.pending_survey_iterations():
+            self.ask_survey_questions_if_needed(output, prompt_version=prompt_version, iteration=iteration)
         while not self.experiment.end_type.did_end(self):
             self.ask_survey_questions_if_needed(output, prompt_version= prompt_version)
             new_chat_entry = self.iterate(prompt_version=prompt_version)
             if new_chat_entry is not None:
-                output.chat_entry.append(self.chat_room[-1])
+                output.add_chat_entry(self.chat_room[-1])
+                self.checkpoint()
         self.ask_survey_questions_if_needed(output,prompt_version= prompt_version)
 
         if save_session_file_name:
-            with open(save_session_file_name, "wb") as file:
-                pickle.dump(self, file)
+            self.save_session(save_session_file_name)
 
         return output
 
-    def ask_survey_questions_if_needed(self, experiment_output: ExperimentOutput, prompt_version: str):
+    def checkpoint(self):
+        """Marks a consistent point of the run (see `session_rooms.checkpoint`)."""
+        if self.checkpointer is not None:
+            self.checkpointer.boundary(self)
+
+    def pending_survey_iterations(self) -> list[int]:
+        """The past iterations whose triggered survey questions weren't answered (only after resuming a run)."""
+        return [iteration for iteration in range(self.session_length)
+                if iteration not in self.surveyed_iterations and self.triggered_survey_questions(iteration)]
+
+    def triggered_survey_questions(self, iteration: Optional[int] = None) -> list[dict]:
         """
-        Asks the survey questions that should be triggered at the current iteration.
-        All persons participant in the survey and answers are stored in the
-        `experiment_output`. This function does not modify `self.chat_room`.
+        Returns (a copy of) the survey questions that should be asked at the given iteration
+        (the current one by default).
         """
-
+        if iteration is None:
+            iteration = self.session_length
         #Keep only the survey questions that should be asked at the current iteration.
         should_keep = lambda cur_len, trigger: (cur_len in trigger) or \
                                                f"{trigger}".lower() == "always" or \
@@ -60,29 +96,85 @@ class SessionRoom:
         should_keep = lambda cur_len, trigger: cur_len % 4 == 0
 
         survey_questions_non_copied = [q for q in self.experiment.survey_questions \
-                            if should_keep(len(self.chat_room), q.get("iterations"))]
+                            if should_keep(iteration, q.get("iterations"))]
 
-        survey_questions = copy.deepcopy(survey_questions_non_copied)
+        return copy.deepcopy(survey_questions_non_copied)
+
+    @hook_point("session.survey", lambda self, *args, iteration=None, **kwargs:
+                {"iteration": self.session_length if iteration is None else iteration})
+    def ask_survey_questions_if_needed(self, experiment_output: ExperimentOutput, prompt_version: str,
+                                       iteration: Optional[int] = None):
+        """
+        Asks the survey questions that should be triggered at the given iteration (the current one by default).
+        All persons participant in the survey and answers are stored in the
+        `experiment_output`. This function does not modify `self.chat_room`.
+        """
+        if iteration is None:
+            iteration = self.session_length
+        if iteration in self.surveyed_iterations:
+            return
+        survey_questions = self.triggered_survey_questions(iteration)
 
         if not survey_questions:
             return
 
         log.info("Starting survey. Everyone is answering this end_prompt:")
-        for survey_question in survey_questions:
-
-            survey_entry = ChatEntry(System(), "", survey_question["question"])
-            chat_room_with_survery = copy.deepcopy(self.chat_room) + [survey_entry]
-
-            for next_person in self.experiment.persons:
-                new_chat_entry = next_person.generate_answer(
-                    self.experiment.scenario, chat_room_with_survery, prompt_version, is_questionnaire=True)
-                if new_chat_entry is not None:
-                    experiment_output.survey_question.append(
-                        SurveyQuestion(
-                            question_id=survey_question["id"],
-                            question_content=survey_question["question"],
-                            iteration=len(self.chat_room),
-                            chat_entry=new_chat_entry))
+        persons = self.experiment.persons
+        # O(1) views of the history followed by the question, the room itself isn't modified
+        survey_chats = [ChatSnapshot(self.chat_room, overlay=[ChatEntry(System(), "", survey_question["question"])],
+                                     length=iteration)
+                        for survey_question in survey_questions]
+
+        # Every (question, person) pair is independent, so they are dispatched at once for the persons which
+        # can answer concurrently (with "survey_batching", the persons sending them in a single request get a single
+        # call). The stateful persons (see `Person.CONCURRENT_CALLS`) answer one question after the other, in a
+        # single lane. The answers are collected by person to keep the output deterministic.
+        concurrent = [next_person for next_person in persons if next_person.CONCURRENT_CALLS]
+        sequential = [next_person for next_person in persons if not next_person.CONCURRENT_CALLS]
+        batched = [self.survey_batching and next_person.batches_answers for next_person in concurrent]
+        calls = sum(1 if is_batched else len(survey_chats) for is_batched in batched) + (1 if sequential else 0)
+        with ThreadPoolExecutor(max_workers=min(self.survey_workers, calls),
+                                thread_name_prefix="survey") as executor:
+            lane = executor.submit(self._answer_in_sequence, sequential, survey_chats, prompt_version) \
+                if sequential else None
+            futures = {}
+            for next_person, is_batched in zip(concurrent, batched):
+                if is_batched:
+                    futures[id(next_person)] = executor.submit(next_person.generate_answers, self.experiment.scenario,
+                                                               survey_chats, prompt_version, is_questionnaire=True)
+                else:
+                    futures[id(next_person)] = [executor.submit(next_person.generate_answer, self.experiment.scenario,
+                                                                survey_chat, prompt_version, is_questionnaire=True)
+                                                for survey_chat in survey_chats]
+            answers_by_person = {key: person_futures.result() if not isinstance(person_futures, list)
+                                 else [future.result() for future in person_futures]
+                                 for key, person_futures in futures.items()}
+            if lane is not None:
+                answers_by_person.update(lane.result())
+        answers = [answers_by_person[id(next_person)][q] for q in range(len(survey_chats)) for next_person in persons]
+
+        asked = [survey_question for survey_question in survey_questions for _ in persons]
+        for survey_question, new_chat_entry in zip(asked, answers):
+            if new_chat_entry is not None:
+                experiment_output.add_survey_question(
+                    SurveyQuestion(
+                        question_id=survey_question["id"],
+                        question_content=survey_question["question"],
+                        iteration=iteration,
+                        chat_entry=new_chat_entry))
+        self.surveyed_iterations.add(iteration)
+        self.checkpoint()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # open files, only meaningful for the running process
+        state["output_sink"] = None
+        state["checkpointer"] = None
+        return state
+
+    def save_session(self, save_session_file_name: str):
+        with open(save_session_file_name, "wb") as file:
+            pickle.dump(self, file)
 
     @staticmethod
     def load_from_pickle(save_session_file_name: str) -> SessionRoom:
@@ -93,6 +185,23 @@ class SessionRoom:
     def print_session(self) -> str:
         raise NotImplementedError("Need to be implanted")
 
+    def _answer_in_sequence(self, persons: List[Person], survey_chats: List[ChatSnapshot],
+                            prompt_version: str) -> Dict[int, list]:
+        """The answers of `persons` to every survey chat (by `id` of the person), one call after the other."""
+        answers = {}
+        for next_person in persons:
+            if self.survey_batching:
+                answers[id(next_person)] = next_person.generate_answers(
+                    self.experiment.scenario, survey_chats, prompt_version, is_questionnaire=True)
+            else:
+                answers[id(next_person)] = [
+                    next_person.generate_answer(self.experiment.scenario, survey_chat, prompt_version,
+                                                is_questionnaire=True)
+                    for survey_chat in survey_chats
+                ]
+        return answers
+
+    @hook_point("session.iterate", lambda self, *args, **kwargs: {"turn": self.session_length})
     def iterate(self, prompt_version: str = "") :
         next_person: Person = self.experiment.host.get_curr_person_and_move_to_next()
         new_chat_entry = next_person.generate_answer(